@@ -1,4 +1,3 @@
-import time
 from typing import Mapping, Optional, Sequence
 
 PORT = 8909
@@ -34,12 +33,17 @@ class FlaskOtelTest:
     def wrapper_command(self) -> str:
         return "opentelemetry-instrument"
 
+    def readiness_probe(self):
+        # local import so oteltest is not needed for parsing this script
+        from oteltest.readiness import TcpProbe
+
+        # on_start() will be called once the server accepts connections. An HttpProbe of / would work too, but each
+        # of its polls would create a server trace of its own.
+        return TcpProbe(PORT, host=HOST)
+
     def on_start(self) -> Optional[float]:
         import http.client
 
-        # Todo: replace this sleep with a liveness check!
-        time.sleep(10)
-
         conn = http.client.HTTPConnection(HOST, PORT)
         conn.request("GET", "/")
         print("response:", conn.getresponse().read().decode())
@@ -56,3 +60,16 @@ class FlaskOtelTest:
 
         span = telemetry.first_span(tel)
         assert telemetry.span_attribute_by_name(span, "http.method") == "GET"
+
+        # the server span of on_start()'s request is the root of its trace: its parent wasn't lost on the way
+        from oteltest.tracetree import build_traces
+
+        traces = [
+            trace
+            for trace in build_traces(tel).values()
+            if any(root.name == "GET /" for root in trace.roots)
+        ]
+        assert traces
+        for trace in traces:
+            assert len(trace.roots) == 1
+            assert not trace.orphans
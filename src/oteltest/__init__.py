@@ -1,6 +1,9 @@
 import abc
-from typing import Mapping, Optional, Sequence
+from typing import Callable, Mapping, Optional, Sequence, Union
 
+from oteltest.expectation import Expectation
+from oteltest.readiness import ReadinessProbe
+from oteltest.sink.faults import FaultPolicy
 from oteltest.telemetry import Telemetry
 
 
@@ -9,7 +12,7 @@ class OtelTest(abc.ABC):
     Abstract base class for tests using OtelTest. No need to instantiate or call it -- just define a subclass of
     OtelTest anywhere in your script.
 
-    The first three methods are for configuration and the second two are callbacks.
+    The first three methods are for configuration and the second two are callbacks. The remaining methods are optional.
 
     When you run the `oteltest` command against your script, a new Python virtual environment is created with the
     configuration specified by this class's implementation. The two callbacks are then run, but not in the subprocess
@@ -38,15 +41,19 @@ class OtelTest(abc.ABC):
     @abc.abstractmethod
     def on_start(self) -> Optional[float]:
         """
-        Called immediately after the script has started.
+        Called immediately after the script has started, or, if `readiness_probe()` returns a probe, once the probe
+        reports that the script is ready.
 
         You can add client code here to call your server and have it produce telemetry.
-        Note: you may need to sleep or check for liveness first!
+        Note: you may need to wait for your server first -- see `readiness_probe()`.
         Note: this method will run in the Python virtual environment of `oteltest`, not that of the script.
 
         Return a float indicating how long to wait in seconds for the script to finish. Once that time has elapsed,
-        the subprocess running the script will be force terminated. Or return `None` to allow the script to finish on
-        its own, in which case the script should shut itself down.
+        the script's process group is sent `--stop-signal` (SIGINT by default, which makes Python flush the
+        OpenTelemetry SDK's exporters on exit), and otelsink keeps receiving telemetry for up to `--grace-period`
+        seconds while the script shuts down. A script still running after that is killed with SIGKILL. Or return
+        `None` to allow the script to finish on its own, in which case the script should shut itself down. Either way,
+        the script is stopped the same way as soon as `expected_telemetry()`, if any, is met.
         """
 
     @abc.abstractmethod
@@ -57,3 +64,48 @@ class OtelTest(abc.ABC):
         Called immediately after the script has ended. Passed in are both the telemetry otelsink received while the
         script was running and the output of the script (stdout, stderr, returncode).
         """
+
+    def readiness_probe(self) -> Optional[ReadinessProbe]:
+        """
+        Optionally return a ReadinessProbe (e.g. `HttpProbe(8000)`) and oteltest will wait for it to succeed before
+        calling `on_start()`. The time the script took to become ready is printed and passed to `on_stop()` as
+        `tel.time_to_ready_s`. Return `None` (the default) to call `on_start()` immediately after the script has
+        started.
+        """
+        return None
+
+    def expected_telemetry(
+        self,
+    ) -> Union[Expectation, Callable[[Telemetry], bool], None]:
+        """
+        Optionally describe the telemetry the script is expected to send, either as an Expectation (e.g.
+        `SpanCount(5, name="my-span")`) or as a function that takes the Telemetry received so far and returns whether
+        it's complete. oteltest checks it as each request arrives and stops the script as soon as it is met, instead of
+        waiting for the script to finish or for on_start()'s timeout. Return `None` (the default) to always wait.
+        """
+        return None
+
+    def otlp_protocol(self) -> str:
+        """
+        Optionally return the OTLP protocol otelsink should accept, as for OTEL_EXPORTER_OTLP_PROTOCOL: "grpc" (the
+        default), "http/protobuf", or "http/json". Unless the script's environment_variables() sets it,
+        OTEL_EXPORTER_OTLP_PROTOCOL is set to this value.
+        """
+        return "grpc"
+
+    def sink_faults(self) -> Optional[FaultPolicy]:
+        """
+        Optionally return a FaultPolicy (e.g. `FaultPolicy(Unavailable(times=2), Latency(0.5, signals=["trace"]))`) to
+        have otelsink slow down or reject the script's export requests, to see how its exporters cope. Every request is
+        still recorded, with the fault injected into its response, if any, in `Request#fault`. Return `None` (the
+        default) to accept all requests right away.
+        """
+        return None
+
+    def bench_latencies(self) -> Optional[Sequence[float]]:
+        """
+        Optionally return the latencies, in seconds, of the requests on_start() made to the script. `oteltest bench`
+        creates a new instance for each run and reports the percentiles of these latencies with and without the
+        wrapper command. Not used by the `oteltest` command itself.
+        """
+        return None
@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+from oteltest.private import (
+    GRPC,
+    AccumulatingHandler,
+    get_otlp_protocol,
+    load_test_class_for_script,
+    ls_scripts,
+    run_python_script,
+)
+from oteltest.sink import GrpcSink, HttpSink
+from oteltest.venvs import DEFAULT_VENV_CACHE_SIZE, VenvCache, get_installer
+
+BENCH_VARIANTS = ("instrumented", "baseline")
+# latency percentiles are per run, so that their overhead gets a confidence interval like the other metrics
+BENCH_METRICS = (
+    "wall_time_s",
+    "cpu_time_s",
+    "peak_rss_kb",
+    "latency_p50_s",
+    "latency_p99_s",
+    "time_to_ready_s",
+)
+
+
+def bench(
+    script_path: str,
+    venv_parent_dir: typing.Optional[str],
+    runs: int = 5,
+    output: str = "oteltest-bench.json",
+    venv_cache_size: int = DEFAULT_VENV_CACHE_SIZE,
+    installer: str = "auto",
+    wheelhouse: typing.Optional[str] = None,
+):
+    """
+    Measures what each script's wrapper command (e.g. opentelemetry-instrument) costs: runs the script `runs` times
+    with its wrapper and `runs` times without, alternating between the two, and writes the wall time, CPU time, peak
+    RSS, and, if the script's test class has a bench_latencies() method, request latencies of each variant, and the
+    overhead of the instrumented variant with 95% confidence intervals, to `output` as JSON.
+    """
+    if os.path.isdir(script_path):
+        script_dir = script_path
+        scripts = ls_scripts(script_path)
+    elif os.path.isfile(script_path):
+        script_dir = os.path.dirname(script_path)
+        scripts = [os.path.basename(script_path)]
+    else:
+        print(f"- {script_path} does not exist")
+        return
+    sys.path.append(script_dir)
+    temp_dir = venv_parent_dir or tempfile.mkdtemp()
+    print(f"- Using temp dir for venvs: {temp_dir}")
+    if wheelhouse:
+        wheelhouse = os.path.abspath(wheelhouse)
+    venv_cache = VenvCache(
+        temp_dir, venv_cache_size, False, get_installer(installer, wheelhouse)
+    )
+    results = {}
+    for script in sorted(scripts):
+        result = bench_script(venv_cache, script_dir, script, runs)
+        if result is not None:
+            results[script] = result
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+        "scripts": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"- Wrote benchmark results to {output}")
+
+
+def bench_script(venv_cache: "VenvCache", script_dir: str, script: str, runs: int):
+    module_name = script[:-3]
+    oteltest_class = load_test_class_for_script(
+        module_name, os.path.join(script_dir, script)
+    )
+    if oteltest_class is None:
+        print(f"Could not find oteltest class for module_name '{module_name}'")
+        return None
+    oteltest_instance = oteltest_class()
+    wrapper = oteltest_instance.wrapper_command()
+    if not wrapper:
+        print(f"- Skipping {script}: it has no wrapper_command() to compare against")
+        return None
+    samples: typing.Dict[str, typing.List[dict]] = {v: [] for v in BENCH_VARIANTS}
+    with venv_cache.use(oteltest_instance.requirements(), wrapper) as script_venv:
+        for i in range(runs):
+            # alternate which variant goes first, so that drift (e.g. a warming page cache) doesn't favor either
+            for variant in BENCH_VARIANTS if i % 2 == 0 else BENCH_VARIANTS[::-1]:
+                print(f"- Bench run {i + 1}/{runs} of {script} ({variant})")
+                # a new instance per run, so that on_start() and bench_latencies() start from a clean slate
+                samples[variant].append(
+                    bench_run(
+                        script_dir,
+                        script,
+                        oteltest_class(),
+                        script_venv,
+                        instrumented=variant == "instrumented",
+                    )
+                )
+    out: typing.Dict[str, typing.Any] = {
+        "requirements": list(oteltest_instance.requirements()),
+        "wrapper_command": wrapper,
+    }
+    for variant in BENCH_VARIANTS:
+        out[variant] = summarize_bench_runs(samples[variant])
+    out["overhead"] = {
+        metric: compare_samples(
+            [r[metric] for r in samples["instrumented"] if r[metric] is not None],
+            [r[metric] for r in samples["baseline"] if r[metric] is not None],
+        )
+        for metric in BENCH_METRICS
+    }
+    print_bench_overhead(script, out["overhead"])
+    return out
+
+
+def bench_run(script_dir, script, oteltest_instance, v, instrumented: bool) -> dict:
+    # the script gets a sink to export to either way, so that exporters don't spend time retrying
+    protocol = get_otlp_protocol(oteltest_instance)
+    sink_class = GrpcSink if protocol == GRPC else HttpSink
+    sink = sink_class(AccumulatingHandler(), address="0.0.0.0:0")
+    sink.start()
+    try:
+        result = run_python_script(
+            script_dir,
+            script,
+            oteltest_instance,
+            v,
+            sink.port,
+            protocol=protocol,
+            use_wrapper=instrumented,
+            # on_start() drives the load, and its timeout is how long to wait for the script to finish, which would
+            # only add noise to the measurements
+            stop_after_on_start=True,
+        )
+    finally:
+        sink.stop()
+    if result.returncode != 0:
+        print(f"- Return Code: {result.returncode}")
+    usage = result.resource_usage
+    latencies = sorted(get_bench_latencies(oteltest_instance) or [])
+    return {
+        "returncode": result.returncode,
+        "wall_time_s": usage.wall_time_s,
+        "cpu_time_s": usage.cpu_time_s,
+        "peak_rss_kb": usage.peak_rss_kb,
+        "latency_p50_s": nearest_rank(latencies, 50) if latencies else None,
+        "latency_p99_s": nearest_rank(latencies, 99) if latencies else None,
+        "time_to_ready_s": result.time_to_ready_s,
+        "latencies_s": latencies,
+    }
+
+
+def get_bench_latencies(oteltest_instance) -> typing.Optional[typing.Sequence[float]]:
+    # bench_latencies() is optional
+    bench_latencies = getattr(oteltest_instance, "bench_latencies", None)
+    return bench_latencies() if bench_latencies else None
+
+
+def summarize_bench_runs(runs: typing.List[dict]) -> dict:
+    out: typing.Dict[str, typing.Any] = {
+        metric: summarize_samples([r[metric] for r in runs if r[metric] is not None])
+        for metric in BENCH_METRICS
+    }
+    latencies = sorted(latency for r in runs for latency in r["latencies_s"])
+    if latencies:
+        out["latency_s"] = {
+            "count": len(latencies),
+            **{f"p{p}": nearest_rank(latencies, p) for p in (50, 90, 99)},
+        }
+    out["returncodes"] = [r["returncode"] for r in runs]
+    return out
+
+
+def nearest_rank(sorted_values: typing.Sequence[float], p: float) -> float:
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+# two-sided 95% critical values of Student's t distribution for 1 to 30 degrees of freedom. Beyond that, 1.96 is
+# close enough.
+T_95 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)  # fmt: skip
+
+
+def t_95(df: float) -> float:
+    df = int(df)
+    if df < 1:
+        return math.inf
+    return T_95[df - 1] if df <= len(T_95) else 1.96
+
+
+def summarize_samples(values: typing.Sequence[float]) -> typing.Optional[dict]:
+    """The mean of `values`, their standard deviation, and a 95% confidence interval for the mean."""
+    if not values:
+        return None
+    mean = statistics.fmean(values)
+    stdev = statistics.stdev(values) if len(values) > 1 else 0.0
+    margin = t_95(len(values) - 1) * stdev / math.sqrt(len(values))
+    return {
+        "n": len(values),
+        "mean": mean,
+        "stdev": stdev,
+        "ci95": [mean - margin, mean + margin],
+    }
+
+
+def compare_samples(
+    instrumented: typing.Sequence[float], baseline: typing.Sequence[float]
+) -> typing.Optional[dict]:
+    """
+    The difference between the means of the instrumented and baseline samples, absolute and relative to the baseline,
+    with a 95% confidence interval for the absolute difference (Welch's t-interval, which doesn't assume the variances
+    are equal).
+    """
+    if len(instrumented) < 2 or len(baseline) < 2:
+        return None
+    base = statistics.fmean(baseline)
+    diff = statistics.fmean(instrumented) - base
+    var_i = statistics.variance(instrumented) / len(instrumented)
+    var_b = statistics.variance(baseline) / len(baseline)
+    if var_i + var_b == 0:
+        margin = 0.0
+    else:
+        df = (var_i + var_b) ** 2 / (
+            var_i**2 / (len(instrumented) - 1) + var_b**2 / (len(baseline) - 1)
+        )
+        margin = t_95(df) * math.sqrt(var_i + var_b)
+    return {
+        "diff": diff,
+        "diff_ci95": [diff - margin, diff + margin],
+        "relative_pct": 100 * diff / base if base else None,
+    }
+
+
+def print_bench_overhead(script: str, overhead: dict):
+    print(f"- Overhead of instrumenting {script}:")
+    for metric, comparison in overhead.items():
+        if comparison is None:
+            print(f"  {metric}: not enough runs")
+            continue
+        low, high = comparison["diff_ci95"]
+        relative = comparison["relative_pct"]
+        relative_str = f" ({relative:+.1f}%)" if relative is not None else ""
+        print(
+            f"  {metric}: {comparison['diff']:+.4g}{relative_str}, 95% CI [{low:+.4g}, {high:+.4g}]"
+        )
@@ -0,0 +1,261 @@
+import csv
+import json
+import os
+from typing import Dict, List, Optional
+
+from oteltest.telemetry import Telemetry, any_value_to_python, attributes_to_dict
+
+PARQUET = "parquet"
+CSV = "csv"
+AUTO = "auto"
+
+# the columns of each table and their types: "string", "int64", "float64", "list<int64>", "list<float64>", or "json"
+# for attribute maps, which are dicts in memory and JSON objects in files. Times are in nanoseconds since the epoch.
+SCHEMAS = {
+    "spans": (
+        ("run", "string"),
+        ("seq", "int64"),
+        ("test_elapsed_ms", "int64"),
+        ("service_name", "string"),
+        ("scope_name", "string"),
+        ("trace_id", "string"),
+        ("span_id", "string"),
+        ("parent_span_id", "string"),
+        ("name", "string"),
+        ("kind", "int64"),
+        ("start_time_unix_nano", "int64"),
+        ("end_time_unix_nano", "int64"),
+        ("duration_ns", "int64"),
+        ("status_code", "int64"),
+        ("attributes", "json"),
+        ("resource_attributes", "json"),
+    ),
+    "metric_points": (
+        ("run", "string"),
+        ("seq", "int64"),
+        ("test_elapsed_ms", "int64"),
+        ("service_name", "string"),
+        ("scope_name", "string"),
+        ("metric_name", "string"),
+        ("unit", "string"),
+        ("type", "string"),
+        ("start_time_unix_nano", "int64"),
+        ("time_unix_nano", "int64"),
+        # gauges and sums
+        ("value", "float64"),
+        # histograms, exponential histograms, and summaries
+        ("count", "int64"),
+        ("sum", "float64"),
+        # histograms
+        ("bucket_counts", "list<int64>"),
+        ("explicit_bounds", "list<float64>"),
+        ("attributes", "json"),
+        ("resource_attributes", "json"),
+    ),
+    "logs": (
+        ("run", "string"),
+        ("seq", "int64"),
+        ("test_elapsed_ms", "int64"),
+        ("service_name", "string"),
+        ("scope_name", "string"),
+        ("time_unix_nano", "int64"),
+        ("observed_time_unix_nano", "int64"),
+        ("severity_number", "int64"),
+        ("severity_text", "string"),
+        ("body", "string"),
+        ("trace_id", "string"),
+        ("span_id", "string"),
+        ("attributes", "json"),
+        ("resource_attributes", "json"),
+    ),
+}
+
+
+def telemetry_tables(tel: Telemetry, run: str = "") -> Dict[str, Dict[str, list]]:
+    """
+    Flattens a Telemetry's spans, metric data points, and log records into tables, one row per item, each table a
+    dict of column name to list of values, with the columns in SCHEMAS. `run` fills the run column, so that tables
+    from many runs can be concatenated and compared.
+    """
+    tables = {
+        name: {column: [] for column, _ in schema} for name, schema in SCHEMAS.items()
+    }
+    spans, points, logs = tables["spans"], tables["metric_points"], tables["logs"]
+    for req in tel.trace_requests:
+        for rs in req.pbreq.resource_spans:
+            resource = _resource_columns(rs.resource)
+            for ss in rs.scope_spans:
+                for span in ss.spans:
+                    _append(spans, run, req, resource, ss.scope.name)
+                    spans["trace_id"].append(span.trace_id.hex())
+                    spans["span_id"].append(span.span_id.hex())
+                    spans["parent_span_id"].append(span.parent_span_id.hex())
+                    spans["name"].append(span.name)
+                    spans["kind"].append(span.kind)
+                    spans["start_time_unix_nano"].append(span.start_time_unix_nano)
+                    spans["end_time_unix_nano"].append(span.end_time_unix_nano)
+                    spans["duration_ns"].append(
+                        span.end_time_unix_nano - span.start_time_unix_nano
+                    )
+                    spans["status_code"].append(span.status.code)
+                    spans["attributes"].append(attributes_to_dict(span.attributes))
+    for req in tel.metric_requests:
+        for rm in req.pbreq.resource_metrics:
+            resource = _resource_columns(rm.resource)
+            for sm in rm.scope_metrics:
+                for metric in sm.metrics:
+                    kind = metric.WhichOneof("data")
+                    if kind is None:
+                        continue
+                    for point in getattr(metric, kind).data_points:
+                        _append(points, run, req, resource, sm.scope.name)
+                        points["metric_name"].append(metric.name)
+                        points["unit"].append(metric.unit)
+                        points["type"].append(kind)
+                        points["start_time_unix_nano"].append(
+                            point.start_time_unix_nano
+                        )
+                        points["time_unix_nano"].append(point.time_unix_nano)
+                        _append_point_values(points, kind, point)
+                        points["attributes"].append(
+                            attributes_to_dict(point.attributes)
+                        )
+    for req in tel.log_requests:
+        for rl in req.pbreq.resource_logs:
+            resource = _resource_columns(rl.resource)
+            for sl in rl.scope_logs:
+                for record in sl.log_records:
+                    _append(logs, run, req, resource, sl.scope.name)
+                    logs["time_unix_nano"].append(record.time_unix_nano)
+                    logs["observed_time_unix_nano"].append(
+                        record.observed_time_unix_nano
+                    )
+                    logs["severity_number"].append(record.severity_number)
+                    logs["severity_text"].append(record.severity_text)
+                    body = any_value_to_python(record.body)
+                    logs["body"].append(
+                        body
+                        if isinstance(body, str) or body is None
+                        else json.dumps(body)
+                    )
+                    logs["trace_id"].append(record.trace_id.hex())
+                    logs["span_id"].append(record.span_id.hex())
+                    logs["attributes"].append(attributes_to_dict(record.attributes))
+    return tables
+
+
+def _resource_columns(resource) -> tuple:
+    attributes = attributes_to_dict(resource.attributes)
+    return attributes.get("service.name"), attributes
+
+
+def _append(table: Dict[str, list], run: str, req, resource: tuple, scope_name: str):
+    """Appends the columns every table has."""
+    service_name, resource_attributes = resource
+    table["run"].append(run)
+    table["seq"].append(req.seq)
+    table["test_elapsed_ms"].append(req.test_elapsed_ms)
+    table["service_name"].append(service_name)
+    table["scope_name"].append(scope_name)
+    table["resource_attributes"].append(resource_attributes)
+
+
+def _append_point_values(points: Dict[str, list], kind: str, point):
+    if kind in ("gauge", "sum"):
+        value = (
+            point.as_double
+            if point.WhichOneof("value") == "as_double"
+            else float(point.as_int)
+        )
+        points["value"].append(value)
+        points["count"].append(None)
+        points["sum"].append(None)
+    else:
+        points["value"].append(None)
+        points["count"].append(point.count)
+        points["sum"].append(point.sum)
+    if kind == "histogram":
+        points["bucket_counts"].append(list(point.bucket_counts))
+        points["explicit_bounds"].append(list(point.explicit_bounds))
+    else:
+        points["bucket_counts"].append(None)
+        points["explicit_bounds"].append(None)
+
+
+def write_columnar(
+    tel: Telemetry, directory: str, run: str, fmt: str = AUTO
+) -> List[str]:
+    """
+    Writes the tables of `tel` (see telemetry_tables) to `directory`, one file per table named <run>.<table>.<fmt>,
+    returning their paths. `fmt` is "parquet", which needs pyarrow (pip install oteltest[columnar]), "csv", or
+    "auto" for Parquet if pyarrow is installed and CSV otherwise. In CSV files, lists and attribute maps are JSON.
+    """
+    pyarrow = _import_pyarrow()
+    if fmt == AUTO:
+        fmt = CSV if pyarrow is None else PARQUET
+    if fmt == PARQUET and pyarrow is None:
+        raise ImportError(
+            "writing Parquet files needs pyarrow: pip install oteltest[columnar]"
+        )
+    if fmt not in (PARQUET, CSV):
+        raise ValueError(f"Unsupported columnar format: '{fmt}'")
+    paths = []
+    for name, columns in telemetry_tables(tel, run).items():
+        path = os.path.join(directory, f"{run}.{name}.{fmt}")
+        if fmt == PARQUET:
+            _write_parquet(pyarrow, path, SCHEMAS[name], columns)
+        else:
+            _write_csv(path, SCHEMAS[name], columns)
+        paths.append(path)
+    return paths
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow  # type: ignore
+        import pyarrow.parquet  # type: ignore  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _write_parquet(pyarrow, path: str, schema, columns: Dict[str, list]):
+    types = {
+        "string": pyarrow.string(),
+        "int64": pyarrow.int64(),
+        "float64": pyarrow.float64(),
+        "list<int64>": pyarrow.list_(pyarrow.int64()),
+        "list<float64>": pyarrow.list_(pyarrow.float64()),
+        "json": pyarrow.string(),
+    }
+    arrays = {}
+    for column, column_type in schema:
+        values = columns[column]
+        if column_type == "json":
+            values = [_to_json(value) for value in values]
+        arrays[column] = pyarrow.array(values, type=types[column_type])
+    pyarrow.parquet.write_table(pyarrow.table(arrays), path, compression="zstd")
+
+
+def _write_csv(path: str, schema, columns: Dict[str, list]):
+    encoded = [
+        (
+            [_to_json(value) for value in columns[column]]
+            if column_type == "json" or column_type.startswith("list")
+            else columns[column]
+        )
+        for column, column_type in schema
+    ]
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow([column for column, _ in schema])
+        writer.writerows(zip(*encoded))
+
+
+def _to_json(value) -> Optional[str]:
+    if value is None:
+        return None
+    # bytes attribute values aren't JSON serializable
+    return json.dumps(
+        value, default=lambda v: v.hex() if isinstance(v, bytes) else str(v)
+    )
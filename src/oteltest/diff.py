@@ -0,0 +1,296 @@
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+from oteltest.stats import LogHistogram
+from oteltest.telemetry import LazyRequest, Request, Telemetry, read_telemetry
+
+# what each kind of named item is called in a diff: spans by name, metrics by name, and log records by scope name
+CATEGORIES = ("span", "metric", "log")
+SIGNALS = ("trace", "metric", "log")
+DEFAULT_TOLERANCE = 0.1
+
+
+class ItemSummary:
+    """
+    The spans with one name, the data points of one metric, or the log records of one scope: how many there were, and
+    how many of them had each attribute key. For metrics, `kind` is the data point type and unit, e.g. "sum (ms)".
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.attribute_keys: Dict[str, int] = {}
+        self.kind: Optional[str] = None
+
+    def add(self, attributes, count: int = 1):
+        self.count += count
+        for kv in attributes:
+            self.attribute_keys[kv.key] = self.attribute_keys.get(kv.key, 0) + 1
+
+
+class ExportSummary:
+    """
+    The requests of one signal: how many, their items and bytes, and histograms of their sizes in bytes and of the
+    time between them in milliseconds, i.e. the export interval.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.items = 0
+        self.bytes = 0
+        self.size = LogHistogram()
+        self.interval_ms = LogHistogram()
+        self.last_elapsed_ms: Optional[int] = None
+
+    def add(self, req: Request, items: int):
+        self.requests += 1
+        self.items += items
+        size = req.size
+        self.bytes += size
+        self.size.record(size)
+        if self.last_elapsed_ms is not None:
+            self.interval_ms.record(req.test_elapsed_ms - self.last_elapsed_ms)
+        self.last_elapsed_ms = req.test_elapsed_ms
+
+    def measures(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "items": self.items,
+            "bytes": self.bytes,
+            "size_p50": self.size.percentile(50),
+            "size_p99": self.size.percentile(99),
+            "interval_p50_ms": self.interval_ms.percentile(50),
+        }
+
+
+class TelemetrySummary:
+    """
+    A normalized summary of a run's telemetry, which is all that's needed to compare runs: the spans, metrics, and log
+    records by name (see ItemSummary), the resource attribute keys, and the exports of each signal (see
+    ExportSummary). Built one request at a time, so its size depends on the number of distinct names, not of requests.
+    """
+
+    def __init__(self):
+        self.items: Dict[str, Dict[str, ItemSummary]] = {c: {} for c in CATEGORIES}
+        self.resource_keys: Dict[str, int] = {}
+        self.exports: Dict[str, ExportSummary] = {}
+
+    def add(self, signal: str, req: Request):
+        # lazily read requests are parsed without being kept
+        pbreq = req.parse() if isinstance(req, LazyRequest) else req.pbreq
+        if signal == "trace":
+            items = self._add_spans(pbreq)
+        elif signal == "metric":
+            items = self._add_metrics(pbreq)
+        else:
+            items = self._add_logs(pbreq)
+        self.exports.setdefault(signal, ExportSummary()).add(req, items)
+
+    def _item(self, category: str, name: str) -> ItemSummary:
+        summaries = self.items[category]
+        out = summaries.get(name)
+        if out is None:
+            out = summaries[name] = ItemSummary()
+        return out
+
+    def _add_resource(self, resource):
+        for kv in resource.attributes:
+            self.resource_keys[kv.key] = self.resource_keys.get(kv.key, 0) + 1
+
+    def _add_spans(self, pbreq) -> int:
+        items = 0
+        for rs in pbreq.resource_spans:
+            self._add_resource(rs.resource)
+            for ss in rs.scope_spans:
+                for span in ss.spans:
+                    self._item("span", span.name).add(span.attributes)
+                    items += 1
+        return items
+
+    def _add_metrics(self, pbreq) -> int:
+        items = 0
+        for rm in pbreq.resource_metrics:
+            self._add_resource(rm.resource)
+            for sm in rm.scope_metrics:
+                for metric in sm.metrics:
+                    kind = metric.WhichOneof("data")
+                    if kind is None:
+                        continue
+                    item = self._item("metric", metric.name)
+                    item.kind = f"{kind} ({metric.unit})" if metric.unit else kind
+                    for point in getattr(metric, kind).data_points:
+                        item.add(point.attributes)
+                        items += 1
+        return items
+
+    def _add_logs(self, pbreq) -> int:
+        items = 0
+        for rl in pbreq.resource_logs:
+            self._add_resource(rl.resource)
+            for sl in rl.scope_logs:
+                item = self._item("log", sl.scope.name)
+                for record in sl.log_records:
+                    item.add(record.attributes)
+                    items += 1
+        return items
+
+
+def summarize(tel: Telemetry) -> TelemetrySummary:
+    """
+    Summarizes a Telemetry in a single pass over its requests. For telemetry read with read_ndjson or read_capture, only
+    one request at a time is held in memory.
+    """
+    summary = TelemetrySummary()
+    for signal, requests in (
+        ("trace", tel.trace_requests),
+        ("metric", tel.metric_requests),
+        ("log", tel.log_requests),
+    ):
+        for req in requests:
+            summary.add(signal, req)
+    return summary
+
+
+@dataclasses.dataclass
+class TelemetryDiff:
+    """
+    What changed between two runs' telemetry, by category ("span", "metric", or "log"):
+
+    - `added` and `removed` names, e.g. of spans that are no longer created.
+    - `counts` of items that changed by more than the tolerance, as (old, new).
+    - `attribute_keys` that some items now have and none did before, or the other way around, as (added, removed).
+    - `kinds` of metrics whose data point type or unit changed, as (old, new).
+
+    plus the `resource_keys` added and removed, and the `exports` measures of each signal (see ExportSummary#measures)
+    that changed by more than the tolerance, as (old, new). A diff is falsy if nothing changed.
+    """
+
+    added: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
+    removed: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
+    counts: Dict[str, Dict[str, Tuple[int, int]]] = dataclasses.field(
+        default_factory=dict
+    )
+    attribute_keys: Dict[str, Dict[str, Tuple[List[str], List[str]]]] = (
+        dataclasses.field(default_factory=dict)
+    )
+    kinds: Dict[str, Tuple[str, str]] = dataclasses.field(default_factory=dict)
+    resource_keys: Tuple[List[str], List[str]] = dataclasses.field(
+        default_factory=lambda: ([], [])
+    )
+    exports: Dict[str, Dict[str, Tuple[int, int]]] = dataclasses.field(
+        default_factory=dict
+    )
+
+    def __bool__(self):
+        return bool(
+            self.added
+            or self.removed
+            or self.counts
+            or self.attribute_keys
+            or self.kinds
+            or any(self.resource_keys)
+            or self.exports
+        )
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    def summary(self) -> str:
+        if not self:
+            return "- No differences"
+        lines = []
+        for category in CATEGORIES:
+            label = "Log scopes" if category == "log" else f"{category.title()}s"
+            if category in self.added:
+                lines.append(f"- {label} added: {', '.join(self.added[category])}")
+            if category in self.removed:
+                lines.append(f"- {label} removed: {', '.join(self.removed[category])}")
+            for name, (old, new) in self.counts.get(category, {}).items():
+                lines.append(
+                    f"- {category.title()} count: {name or '(no scope)'} {old} -> {new} ({_percent(old, new)})"
+                )
+            for name, (added, removed) in self.attribute_keys.get(category, {}).items():
+                keys = [f"+{key}" for key in added] + [f"-{key}" for key in removed]
+                lines.append(
+                    f"- {category.title()} attribute keys: {name or '(no scope)'} {' '.join(keys)}"
+                )
+        for name, (old, new) in self.kinds.items():
+            lines.append(f"- Metric type: {name} {old} -> {new}")
+        if any(self.resource_keys):
+            added, removed = self.resource_keys
+            keys = [f"+{key}" for key in added] + [f"-{key}" for key in removed]
+            lines.append(f"- Resource attribute keys: {' '.join(keys)}")
+        for signal, measures in self.exports.items():
+            changes = ", ".join(
+                f"{measure} {old} -> {new} ({_percent(old, new)})"
+                for measure, (old, new) in measures.items()
+            )
+            lines.append(f"- {signal.title()} exports: {changes}")
+        return "\n".join(lines)
+
+
+def _percent(old: int, new: int) -> str:
+    if not old:
+        return "new"
+    return f"{(new - old) / old:+.0%}"
+
+
+def _exceeds(old: int, new: int, tolerance: float) -> bool:
+    return abs(new - old) > tolerance * old if old else new != old
+
+
+def _key_drift(old: Dict[str, int], new: Dict[str, int]) -> Tuple[List[str], List[str]]:
+    return sorted(new.keys() - old.keys()), sorted(old.keys() - new.keys())
+
+
+def diff_summaries(
+    old: TelemetrySummary,
+    new: TelemetrySummary,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> TelemetryDiff:
+    """
+    Compares two runs' summaries. Counts and export measures are only reported if they changed by more than
+    `tolerance`, a fraction of the old value, so that run-to-run noise doesn't show up as a difference.
+    """
+    out = TelemetryDiff()
+    for category in CATEGORIES:
+        old_items, new_items = old.items[category], new.items[category]
+        added = sorted(new_items.keys() - old_items.keys())
+        removed = sorted(old_items.keys() - new_items.keys())
+        if added:
+            out.added[category] = added
+        if removed:
+            out.removed[category] = removed
+        for name in sorted(old_items.keys() & new_items.keys()):
+            before, after = old_items[name], new_items[name]
+            if _exceeds(before.count, after.count, tolerance):
+                out.counts.setdefault(category, {})[name] = (before.count, after.count)
+            drift = _key_drift(before.attribute_keys, after.attribute_keys)
+            if any(drift):
+                out.attribute_keys.setdefault(category, {})[name] = drift
+            if before.kind != after.kind:
+                out.kinds[name] = (before.kind, after.kind)
+    out.resource_keys = _key_drift(old.resource_keys, new.resource_keys)
+    for signal in SIGNALS:
+        if signal not in old.exports and signal not in new.exports:
+            continue
+        before = old.exports.get(signal, ExportSummary()).measures()
+        after = new.exports.get(signal, ExportSummary()).measures()
+        changed = {
+            measure: (before[measure], after[measure])
+            for measure in before
+            if _exceeds(before[measure], after[measure], tolerance)
+        }
+        if changed:
+            out.exports[signal] = changed
+    return out
+
+
+def diff_files(
+    old_path: str, new_path: str, tolerance: float = DEFAULT_TOLERANCE
+) -> TelemetryDiff:
+    """Compares two telemetry files saved by oteltest, in any format (see read_telemetry)."""
+    return diff_summaries(
+        summarize(read_telemetry(old_path)),
+        summarize(read_telemetry(new_path)),
+        tolerance,
+    )
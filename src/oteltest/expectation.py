@@ -0,0 +1,107 @@
+import abc
+from typing import Callable, Optional
+
+from oteltest.telemetry import Telemetry
+
+TRACE = "trace"
+METRIC = "metric"
+LOG = "log"
+
+
+class Expectation(abc.ABC):
+    """
+    Describes the telemetry a script is expected to send. Return an instance from OtelTest#expected_telemetry() and
+    oteltest will check it against each request as otelsink receives it, and stop the script as soon as it is met,
+    rather than waiting for the script to finish or for the timeout returned by on_start() to elapse.
+    """
+
+    @abc.abstractmethod
+    def observe(self, tel: Telemetry, signal: str, pbreq) -> bool:
+        """
+        Called with each request otelsink receives, after it has been added to `tel`. `signal` is one of "trace",
+        "metric", or "log". Returns whether the expectation has been met. Once this returns True it won't be called
+        again.
+        """
+
+
+class SpanCount(Expectation):
+    """
+    Met once at least `at_least` spans have been received, counting only spans called `name` if a name is given.
+    """
+
+    def __init__(self, at_least: int = 1, name: Optional[str] = None):
+        self.at_least = at_least
+        self.name = name
+        self.count = 0
+
+    def observe(self, tel, signal, pbreq) -> bool:  # noqa: ARG002
+        if signal == TRACE:
+            for rs in pbreq.resource_spans:
+                for ss in rs.scope_spans:
+                    if self.name is None:
+                        self.count += len(ss.spans)
+                    else:
+                        self.count += sum(1 for s in ss.spans if s.name == self.name)
+        return self.count >= self.at_least
+
+
+class MetricPresent(Expectation):
+    """
+    Met once a metric called `name` has been received.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def observe(self, tel, signal, pbreq) -> bool:  # noqa: ARG002
+        if signal != METRIC:
+            return False
+        for rm in pbreq.resource_metrics:
+            for sm in rm.scope_metrics:
+                for metric in sm.metrics:
+                    if metric.name == self.name:
+                        return True
+        return False
+
+
+class LogCount(Expectation):
+    """
+    Met once at least `at_least` log records have been received.
+    """
+
+    def __init__(self, at_least: int = 1):
+        self.at_least = at_least
+        self.count = 0
+
+    def observe(self, tel, signal, pbreq) -> bool:  # noqa: ARG002
+        if signal == LOG:
+            for rl in pbreq.resource_logs:
+                for sl in rl.scope_logs:
+                    self.count += len(sl.log_records)
+        return self.count >= self.at_least
+
+
+class AllOf(Expectation):
+    """
+    Met once all of the given expectations have been met.
+    """
+
+    def __init__(self, *expectations: Expectation):
+        self.pending = list(expectations)
+
+    def observe(self, tel, signal, pbreq) -> bool:
+        self.pending = [e for e in self.pending if not e.observe(tel, signal, pbreq)]
+        return not self.pending
+
+
+class Predicate(Expectation):
+    """
+    Met once `fn`, called with all telemetry received so far, returns True. Unlike the other expectations, `fn`
+    looks at all telemetry every time a request is received, so it should be cheap.
+    """
+
+    def __init__(self, fn: Callable[[Telemetry], bool]):
+        self.fn = fn
+
+    def observe(self, tel, signal, pbreq) -> bool:  # noqa: ARG002
+        return bool(self.fn(tel))
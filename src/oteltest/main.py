@@ -1,9 +1,32 @@
 import argparse
+import json
+import os
+import sys
 
-from oteltest.private import run
+from oteltest.bench import bench
+from oteltest.columnar import AUTO, CSV as CSV_FORMAT, PARQUET, write_columnar
+from oteltest.diff import DEFAULT_TOLERANCE, diff_files
+from oteltest.private import (
+    CAPTURE,
+    DEFAULT_GRACE_PERIOD,
+    DEFAULT_OUTPUT_LIMIT,
+    JSON,
+    NDJSON,
+    STOP_SIGNALS,
+    files_to_diff,
+    prefetch,
+    run,
+)
+from oteltest.telemetry import read_telemetry
+from oteltest.venvs import DEFAULT_VENV_CACHE_SIZE
 
 
 def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command in COMMANDS:
+        COMMANDS[command](sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="OpenTelemetry Python Tester")
 
     d_help = "An optional override directory to hold per-script venv directories."
@@ -11,6 +34,118 @@ def main():
         "-d", "--venv-parent-dir", type=str, required=False, help=d_help
     )
 
+    j_help = (
+        "The number of scripts to run concurrently when running a directory of scripts. Each concurrent script gets "
+        "its own sink on an ephemeral port. Defaults to 1."
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=1, help=j_help)
+
+    c_help = (
+        "The maximum number of venvs to keep in the venv parent dir. Venvs are shared by scripts with the same "
+        "requirements and reused across runs, least recently used venvs are removed first. Defaults to "
+        f"{DEFAULT_VENV_CACHE_SIZE}."
+    )
+    parser.add_argument(
+        "--venv-cache-size",
+        type=int,
+        default=DEFAULT_VENV_CACHE_SIZE,
+        help=c_help,
+    )
+
+    r_help = "Rebuild cached venvs instead of reusing venvs built by previous runs."
+    parser.add_argument("--rebuild", action="store_true", help=r_help)
+
+    i_help = (
+        "The tool that installs script requirements: 'pip', 'uv', or 'auto' to use uv if it's on the PATH and pip "
+        "otherwise. Defaults to 'auto'."
+    )
+    parser.add_argument(
+        "--installer", choices=["auto", "pip", "uv"], default="auto", help=i_help
+    )
+
+    w_help = (
+        "A directory of wheels, e.g. populated by `oteltest prefetch`, to install script requirements from. When set, "
+        "no package index is contacted."
+    )
+    parser.add_argument("--wheelhouse", type=str, required=False, help=w_help)
+
+    t_help = (
+        "Create each script venv from scratch instead of cloning a template venv that has pip and the requirements "
+        "common to all scripts in the directory."
+    )
+    parser.add_argument("--no-template-venv", action="store_true", help=t_help)
+
+    f_help = (
+        f"The format to save telemetry in. '{JSON}' (the default) writes all telemetry to a .json file once the script "
+        f"is done. '{NDJSON}' writes each request to a .ndjson file as it arrives, so memory use stays flat no matter "
+        "how much telemetry a script sends. "
+        f"'{CAPTURE}' writes each request to an .otcap file as it arrives, exactly as received over the wire, without "
+        "deserializing it."
+    )
+    parser.add_argument(
+        "--format", choices=[JSON, NDJSON, CAPTURE], default=JSON, help=f_help
+    )
+
+    s_help = (
+        "The number of processes that receive each script's gRPC telemetry, all listening on the same port (via "
+        "SO_REUSEPORT). Their telemetry is merged before on_stop() is called. Only applies to the 'json' format. "
+        "Defaults to 1."
+    )
+    parser.add_argument("--sink-workers", type=int, default=1, help=s_help)
+
+    o_help = (
+        "Write each script's stdout and stderr to the console as they are written, each line prefixed with the "
+        "script's name, rather than once the script is done."
+    )
+    parser.add_argument("--stream-output", action="store_true", help=o_help)
+
+    l_help = (
+        "The number of characters of each of a script's stdout and stderr to keep in memory and pass to on_stop(). "
+        f"Once exceeded, the oldest lines are dropped. Defaults to {DEFAULT_OUTPUT_LIMIT}."
+    )
+    parser.add_argument(
+        "--output-limit", type=int, default=DEFAULT_OUTPUT_LIMIT, help=l_help
+    )
+
+    p_help = (
+        "Also write each script's full stdout and stderr to <script>.stdout.log and <script>.stderr.log in the "
+        "script directory, however long they get."
+    )
+    parser.add_argument("--spill-output", action="store_true", help=p_help)
+
+    ss_help = (
+        "The signal sent to a script's process group to stop it once its expected telemetry has arrived or "
+        "on_start()'s timeout has elapsed. SIGINT (the default) makes Python run its atexit handlers, which flush the "
+        "OpenTelemetry SDK's exporters."
+    )
+    parser.add_argument(
+        "--stop-signal", choices=STOP_SIGNALS, default="SIGINT", help=ss_help
+    )
+
+    g_help = (
+        "The number of seconds a script gets to exit after being sent the stop signal, while otelsink keeps "
+        f"receiving its telemetry, before its process group is killed. Defaults to {DEFAULT_GRACE_PERIOD}."
+    )
+    parser.add_argument(
+        "--grace-period", type=float, default=DEFAULT_GRACE_PERIOD, help=g_help
+    )
+
+    sd_help = (
+        "The control address, e.g. 127.0.0.1:4319, of an otelsink daemon (see `otelsink --control-address`) to send "
+        "telemetry to, in a session per script, instead of starting a sink for each script. Telemetry is saved in "
+        "the 'json' format, and expected_telemetry() and sink_faults() are ignored."
+    )
+    parser.add_argument("--sink-daemon", type=str, required=False, help=sd_help)
+
+    col_help = (
+        "Also save each script's spans, metric data points, and log records as tables, one file per table, named "
+        "like the telemetry file, e.g. my_script.3.spans.parquet. 'parquet' needs pyarrow (pip install "
+        "oteltest[columnar]), 'auto' uses it if it's installed and writes CSV otherwise."
+    )
+    parser.add_argument(
+        "--columnar", choices=[AUTO, PARQUET, CSV_FORMAT], required=False, help=col_help
+    )
+
     parser.add_argument(
         "script_dir",
         type=str,
@@ -18,7 +153,189 @@ def main():
     )
 
     args = parser.parse_args()
-    run(args.script_dir, args.venv_parent_dir)
+    run(
+        args.script_dir,
+        args.venv_parent_dir,
+        jobs=args.jobs,
+        venv_cache_size=args.venv_cache_size,
+        rebuild=args.rebuild,
+        installer=args.installer,
+        wheelhouse=args.wheelhouse,
+        template=not args.no_template_venv,
+        output_format=args.format,
+        sink_workers=args.sink_workers,
+        stream_output=args.stream_output,
+        output_limit=args.output_limit,
+        spill_output=args.spill_output,
+        stop_signal=args.stop_signal,
+        grace_period=args.grace_period,
+        sink_daemon=args.sink_daemon,
+        columnar=args.columnar,
+    )
+
+
+def prefetch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="oteltest prefetch",
+        description="Downloads or builds wheels for the requirements of oteltest scripts into a wheelhouse directory",
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        type=str,
+        required=True,
+        help="The directory to put the wheels in",
+    )
+    parser.add_argument(
+        "script_dir",
+        type=str,
+        help="The directory containing oteltest scripts at its top level, or a single script",
+    )
+    args = parser.parse_args(argv)
+    prefetch(args.script_dir, args.wheelhouse)
+
+
+def bench_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="oteltest bench",
+        description="Measures the overhead of oteltest scripts' wrapper commands by running each script with and "
+        "without its wrapper",
+    )
+    parser.add_argument(
+        "-n",
+        "--runs",
+        type=int,
+        default=5,
+        help="The number of times to run each script with its wrapper, and without. Defaults to 5.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="oteltest-bench.json",
+        help="The file to write the results to, as JSON. Defaults to oteltest-bench.json.",
+    )
+    parser.add_argument(
+        "-d",
+        "--venv-parent-dir",
+        type=str,
+        required=False,
+        help="Optional argument to specify the parent directory inside which venvs will be created and cached",
+    )
+    parser.add_argument(
+        "--installer",
+        choices=["auto", "pip", "uv"],
+        default="auto",
+        help="The tool that installs script requirements: 'pip', 'uv', or 'auto' to use uv if it's on the PATH and "
+        "pip otherwise. Defaults to 'auto'.",
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        type=str,
+        required=False,
+        help="A directory of wheels, e.g. populated by `oteltest prefetch`, to install script requirements from. "
+        "When set, no package index is contacted.",
+    )
+    parser.add_argument(
+        "script_dir",
+        type=str,
+        help="The directory containing oteltest scripts at its top level, or a single script",
+    )
+    args = parser.parse_args(argv)
+    bench(
+        args.script_dir,
+        args.venv_parent_dir,
+        runs=args.runs,
+        output=args.output,
+        installer=args.installer,
+        wheelhouse=args.wheelhouse,
+    )
+
+
+def columnar_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="oteltest columnar",
+        description="Saves the spans, metric data points, and log records of telemetry files saved by oteltest as "
+        "tables, one file per table, named like the telemetry file, e.g. my_script.3.spans.parquet",
+    )
+    parser.add_argument(
+        "--format",
+        choices=[AUTO, PARQUET, CSV_FORMAT],
+        default=AUTO,
+        help="'parquet' needs pyarrow (pip install oteltest[columnar]), 'auto' (the default) uses it if it's "
+        "installed and writes CSV otherwise.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        required=False,
+        help="The directory to write the tables to. Defaults to the directory of each telemetry file.",
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="Telemetry files: .json, .ndjson, or .otcap",
+    )
+    args = parser.parse_args(argv)
+    for path in args.files:
+        directory = args.output_dir or os.path.dirname(path) or "."
+        run_name = os.path.basename(path).rsplit(".", 1)[0]
+        for written in write_columnar(
+            read_telemetry(path), directory, run_name, args.format
+        ):
+            print(written)
+
+
+def diff_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="oteltest diff",
+        description="Compares the telemetry of two runs of an oteltest script: span, metric, and log scope names, "
+        "span and data point counts, attribute keys, and export timing and payload sizes. Exits with status 1 if "
+        "they differ.",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        required=False,
+        help="A telemetry file to compare with, e.g. one kept from a known good run. Defaults to the telemetry file "
+        "numbered before the one being compared.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE * 100,
+        help="How much, in percent, counts and export measures may change before they're reported. Defaults to "
+        f"{DEFAULT_TOLERANCE * 100:.0f}.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the differences as JSON"
+    )
+    parser.add_argument(
+        "path",
+        type=str,
+        help="An oteltest script, to compare its latest telemetry file, or a telemetry file (.json, .ndjson, or "
+        ".otcap) to compare",
+    )
+    args = parser.parse_args(argv)
+    try:
+        old, new = files_to_diff(args.path, args.baseline)
+    except ValueError as e:
+        parser.error(str(e))
+    diff = diff_files(old, new, args.tolerance / 100)
+    if args.json:
+        print(json.dumps({"old": old, "new": new, **diff.to_dict()}, indent=2))
+    else:
+        print(f"Comparing {old} with {new}")
+        print(diff.summary())
+    sys.exit(1 if diff else 0)
+
+
+COMMANDS = {
+    "bench": bench_main,
+    "columnar": columnar_main,
+    "diff": diff_main,
+    "prefetch": prefetch_main,
+}
 
 
 if __name__ == "__main__":
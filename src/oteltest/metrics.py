@@ -0,0 +1,396 @@
+import math
+from typing import Dict, List, Optional, Sequence
+
+from oteltest.telemetry import Telemetry, attributes_to_dict
+
+try:
+    import numpy as _np  # type: ignore
+except ImportError:
+    _np = None
+
+# AggregationTemporality in the OTLP metrics proto
+DELTA = 1
+CUMULATIVE = 2
+
+# the data point types with a count and sum rather than a value
+_DISTRIBUTIONS = ("histogram", "exponential_histogram", "summary")
+
+
+class MetricSeries:
+    """
+    The data points of one time series of a metric, i.e. those with the same resource, scope, and attributes, sorted by
+    time. Times are in nanoseconds since the epoch.
+
+    The columns are arrays: NumPy arrays if NumPy is installed (pip install oteltest[metrics]), and lists otherwise, so
+    the same code works either way. Gauges and sums have `values`; histograms, exponential histograms, and summaries
+    have `counts` and `sums`, and histograms also `bucket_counts`, one row of counts per data point, and
+    `explicit_bounds`, the upper bounds of all but the last bucket.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        unit: str = "",
+        temporality: int = 0,
+        monotonic: bool = False,
+        attributes: Optional[dict] = None,
+        resource_attributes: Optional[dict] = None,
+    ):
+        self.name = name
+        # the data point type: "gauge", "sum", "histogram", "exponential_histogram", or "summary"
+        self.kind = kind
+        self.unit = unit
+        # DELTA or CUMULATIVE, or 0 for gauges and summaries
+        self.temporality = temporality
+        self.monotonic = monotonic
+        self.attributes = attributes or {}
+        self.resource_attributes = resource_attributes or {}
+        self.start_times = _array([], int)
+        self.times = _array([], int)
+        self.values = None
+        self.counts = None
+        self.sums = None
+        self.bucket_counts = None
+        self.explicit_bounds: Optional[List[float]] = None
+        # the smallest and largest values recorded, if every histogram data point has them
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return f"MetricSeries({self.name!r}, {self.kind}, {self.attributes}, {len(self)} points)"
+
+    def to_delta(self) -> "MetricSeries":
+        """
+        Returns the series with each data point holding the change since the previous one, rather than the total since
+        the series started. A data point with a new start time, or, for monotonic sums and histograms, a total lower
+        than the previous one, means the series was reset, e.g. because the process restarted, and its total is taken
+        as its change. Returns the series itself if it's already delta.
+        """
+        self._check_aggregated()
+        if self.temporality == DELTA:
+            return self
+        out = self._derive(DELTA)
+        if not len(self):
+            return out
+        totals = self.values if self.counts is None else self.counts
+        resets = _resets(self.start_times, totals, self.monotonic)
+        if _np is not None:
+            out.start_times = _np.where(
+                resets, self.start_times, _np.concatenate(([0], self.times[:-1]))
+            )
+            for column in ("values", "counts", "sums", "bucket_counts"):
+                values = getattr(self, column)
+                if values is not None:
+                    previous = _np.concatenate(
+                        (_np.zeros_like(values[:1]), values[:-1])
+                    )
+                    mask = resets if values.ndim == 1 else resets[:, None]
+                    setattr(out, column, _np.where(mask, values, values - previous))
+            return out
+        out.start_times = [
+            start if reset else previous
+            for start, reset, previous in zip(
+                self.start_times, resets, [0] + self.times[:-1]
+            )
+        ]
+        for column in ("values", "counts", "sums", "bucket_counts"):
+            values = getattr(self, column)
+            if values is not None:
+                setattr(out, column, _differences(values, resets))
+        return out
+
+    def to_cumulative(self) -> "MetricSeries":
+        """
+        Returns the series with each data point holding the total since the first one started, rather than the change
+        since the previous one. Returns the series itself if it's already cumulative.
+        """
+        self._check_aggregated()
+        if self.temporality == CUMULATIVE:
+            return self
+        out = self._derive(CUMULATIVE)
+        if not len(self):
+            return out
+        first_start = self.start_times[0]
+        if _np is not None:
+            out.start_times = _np.full_like(self.start_times, first_start)
+            for column in ("values", "counts", "sums", "bucket_counts"):
+                values = getattr(self, column)
+                if values is not None:
+                    setattr(out, column, _np.cumsum(values, axis=0))
+            return out
+        out.start_times = [first_start] * len(self)
+        for column in ("values", "counts", "sums", "bucket_counts"):
+            values = getattr(self, column)
+            if values is not None:
+                setattr(out, column, _running_totals(values))
+        return out
+
+    def rates(self):
+        """
+        Returns the rate of change per second over each data point's interval, e.g. requests per second for a request
+        counter, or observations per second for a histogram. NaN for intervals that took no time.
+        """
+        delta = self.to_delta()
+        changes = delta.values if delta.counts is None else delta.counts
+        if _np is not None:
+            seconds = (delta.times - delta.start_times) / 1e9
+            with _np.errstate(divide="ignore", invalid="ignore"):
+                return _np.where(seconds > 0, changes / seconds, _np.nan)
+        return [
+            change / ((time - start) / 1e9) if time > start else math.nan
+            for change, start, time in zip(changes, delta.start_times, delta.times)
+        ]
+
+    def bucket_totals(self) -> List[int]:
+        """Returns the number of observations in each bucket of a histogram over the whole series."""
+        self._check_histogram()
+        delta = self.to_delta()
+        if not len(self):
+            return [0] * (len(self.explicit_bounds or []) + 1)
+        if _np is not None:
+            return delta.bucket_counts.sum(axis=0).tolist()
+        return [sum(column) for column in zip(*delta.bucket_counts)]
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Estimates the `p`th percentile (0-100) of the values a histogram observed over the whole series, see
+        histogram_percentile. None if it observed none.
+        """
+        return histogram_percentile(
+            self.bucket_totals(), self.explicit_bounds, p, self.min, self.max
+        )
+
+    def percentiles(self, p: float) -> List[Optional[float]]:
+        """Estimates the `p`th percentile (0-100) of the values a histogram observed in each data point's interval."""
+        self._check_histogram()
+        rows = self.to_delta().bucket_counts
+        if _np is not None:
+            rows = rows.tolist()
+        return [
+            histogram_percentile(row, self.explicit_bounds, p, self.min, self.max)
+            for row in rows
+        ]
+
+    def _derive(self, temporality: int) -> "MetricSeries":
+        out = MetricSeries(
+            self.name,
+            self.kind,
+            self.unit,
+            temporality,
+            self.monotonic,
+            self.attributes,
+            self.resource_attributes,
+        )
+        out.times = self.times
+        out.explicit_bounds = self.explicit_bounds
+        out.min, out.max = self.min, self.max
+        return out
+
+    def _check_aggregated(self):
+        if self.temporality not in (DELTA, CUMULATIVE):
+            raise ValueError(f"{self.name} is a {self.kind}, which has no temporality")
+
+    def _check_histogram(self):
+        if self.kind != "histogram":
+            raise ValueError(f"{self.name} is a {self.kind}, not a histogram")
+
+
+def _array(values: list, dtype):
+    if _np is None:
+        return values
+    return _np.array(values, dtype=_np.int64 if dtype is int else _np.float64)
+
+
+def _resets(start_times: Sequence[int], totals: Sequence, monotonic: bool):
+    """Returns, for each data point of a cumulative series, whether the series was reset at that point."""
+    if _np is not None:
+        resets = _np.ones(len(start_times), dtype=bool)
+        resets[1:] = start_times[1:] != start_times[:-1]
+        if monotonic:
+            resets[1:] |= totals[1:] < totals[:-1]
+        return resets
+    resets = [True]
+    for i in range(1, len(start_times)):
+        resets.append(
+            start_times[i] != start_times[i - 1]
+            or (monotonic and totals[i] < totals[i - 1])
+        )
+    return resets
+
+
+def _differences(values: list, resets: List[bool]) -> list:
+    out = []
+    previous = None
+    for value, reset in zip(values, resets):
+        if reset:
+            out.append(value)
+        elif isinstance(value, list):
+            out.append([v - p for v, p in zip(value, previous)])
+        else:
+            out.append(value - previous)
+        previous = value
+    return out
+
+
+def _running_totals(values: list) -> list:
+    out = []
+    total = None
+    for value in values:
+        if total is None:
+            total = value
+        elif isinstance(value, list):
+            total = [t + v for t, v in zip(total, value)]
+        else:
+            total = total + value
+        out.append(total)
+    return out
+
+
+def histogram_percentile(
+    bucket_counts: Sequence[int],
+    explicit_bounds: Sequence[float],
+    p: float,
+    min_value: Optional[float] = None,
+    max_value: Optional[float] = None,
+) -> Optional[float]:
+    """
+    Estimates the `p`th percentile (0-100) of the values counted in histogram buckets, assuming values are spread
+    evenly within each bucket, as Prometheus's histogram_quantile does. The first bucket is taken to start at
+    `min_value`, or at 0 if its upper bound is positive, and the last, unbounded, bucket to end at `max_value`,
+    without which percentiles that fall in it are its lower bound. Returns None if the buckets are empty.
+    """
+    total = sum(bucket_counts)
+    if not total:
+        return None
+    rank = p / 100 * total
+    seen = 0
+    for i, count in enumerate(bucket_counts):
+        if not count or seen + count < rank:
+            seen += count
+            continue
+        if i == 0:
+            first_bound = explicit_bounds[0] if explicit_bounds else 0
+            lower = min_value if min_value is not None else min(first_bound, 0)
+        else:
+            lower = explicit_bounds[i - 1]
+        if i < len(explicit_bounds):
+            upper = explicit_bounds[i]
+        elif max_value is not None:
+            upper = max_value
+        else:
+            return lower
+        estimate = lower + (upper - lower) * (rank - seen) / count
+        if min_value is not None:
+            estimate = max(estimate, min_value)
+        if max_value is not None:
+            estimate = min(estimate, max_value)
+        return estimate
+    return None
+
+
+def metric_series(
+    tel: Telemetry, name: str, attributes: Optional[dict] = None
+) -> List[MetricSeries]:
+    """
+    Collects the data points of the metric called `name`, across all requests, into one MetricSeries per time series,
+    in the order each series first appeared. Pass `attributes` to only get the series whose data points have those
+    attribute values. Raises ValueError if a histogram's bucket bounds change within a series.
+    """
+    # the series' columns, as lists, by resource, scope, and data point attributes
+    columns: Dict[tuple, dict] = {}
+    # the resource part of the key, by id() of each resource
+    resource_keys: Dict[int, str] = {}
+    index = tel.index
+    for metric in index.metrics_by_name(name):
+        kind = metric.WhichOneof("data")
+        if kind is None:
+            continue
+        data = getattr(metric, kind)
+        resource = index.resource(metric)
+        resource_attributes = index.attributes(resource)
+        resource_key = resource_keys.get(id(resource))
+        if resource_key is None:
+            resource_key = resource_keys[id(resource)] = repr(
+                sorted(resource_attributes.items())
+            )
+        scope_name = index.scope(metric).name
+        for point in data.data_points:
+            point_attributes = attributes_to_dict(point.attributes)
+            if attributes and any(
+                point_attributes.get(k) != v for k, v in attributes.items()
+            ):
+                continue
+            key = (
+                resource_key,
+                scope_name,
+                repr(sorted(point_attributes.items())),
+            )
+            c = columns.get(key)
+            if c is None:
+                c = columns[key] = _new_columns(
+                    metric, kind, data, point_attributes, resource_attributes
+                )
+            _add_point(c, kind, point)
+    return [_to_series(c) for c in columns.values()]
+
+
+def _new_columns(metric, kind, data, point_attributes, resource_attributes) -> dict:
+    return {
+        "series": MetricSeries(
+            metric.name,
+            kind,
+            metric.unit,
+            getattr(data, "aggregation_temporality", 0),
+            getattr(
+                data, "is_monotonic", kind in ("histogram", "exponential_histogram")
+            ),
+            point_attributes,
+            resource_attributes,
+        ),
+        "points": [],
+    }
+
+
+def _add_point(c: dict, kind: str, point):
+    if kind in _DISTRIBUTIONS:
+        row = [point.start_time_unix_nano, point.time_unix_nano, point.count, point.sum]
+    elif point.WhichOneof("value") == "as_double":
+        row = [point.start_time_unix_nano, point.time_unix_nano, point.as_double]
+    else:
+        row = [point.start_time_unix_nano, point.time_unix_nano, float(point.as_int)]
+    if kind == "histogram":
+        row.append(list(point.bucket_counts))
+        row.append(list(point.explicit_bounds))
+        row.append(point.min if point.HasField("min") else None)
+        row.append(point.max if point.HasField("max") else None)
+    c["points"].append(row)
+
+
+def _to_series(c: dict) -> MetricSeries:
+    series = c["series"]
+    # exports from a single process arrive in order, but retries and multiple sink workers can reorder them
+    points = sorted(c["points"], key=lambda row: row[1])
+    columns = list(zip(*points))
+    series.start_times = _array(list(columns[0]), int)
+    series.times = _array(list(columns[1]), int)
+    if series.kind not in _DISTRIBUTIONS:
+        series.values = _array(list(columns[2]), float)
+        return series
+    series.counts = _array(list(columns[2]), int)
+    series.sums = _array(list(columns[3]), float)
+    if series.kind == "histogram":
+        bounds = columns[5][0]
+        if any(b != bounds for b in columns[5]):
+            raise ValueError(f"the bucket bounds of {series.name} changed")
+        series.explicit_bounds = bounds
+        series.bucket_counts = _array(list(columns[4]), int)
+        mins, maxes = columns[6], columns[7]
+        if None not in mins:
+            series.min = min(mins)
+        if None not in maxes:
+            series.max = max(maxes)
+    return series
@@ -1,15 +1,27 @@
+import collections
+import contextlib
+import dataclasses
+import functools
 import glob
 import importlib
 import importlib.util
 import inspect
+import io
+import json
+import multiprocessing
 import os
-import shutil
+import resource
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
+import traceback
+import types
 import typing
-import venv
+import uuid
+from concurrent import futures
 from pathlib import Path
 
 from google.protobuf.json_format import MessageToDict
@@ -24,34 +36,261 @@ from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
 )
 
 from oteltest import OtelTest, Telemetry
-from oteltest.sink import GrpcSink, RequestHandler
+from oteltest.columnar import write_columnar
+from oteltest.expectation import LOG, METRIC, TRACE, Expectation, Predicate
+from oteltest.readiness import ReadinessProbe
+from oteltest.sink import (
+    GrpcSink,
+    HttpSink,
+    MultiProcessGrpcSink,
+    RawRequestHandler,
+    RequestHandler,
+)
+from oteltest.sink.daemon import SESSION_HEADER, SinkDaemonClient
+from oteltest.sink.faults import FaultPolicy
+from oteltest.stats import IngestStats, ResourceUsage, count_items
+from oteltest.telemetry import (
+    PBTYPES,
+    CaptureWriter,
+    NdjsonWriter,
+    read_capture,
+    read_ndjson,
+)
+from oteltest.venvs import (
+    DEFAULT_VENV_CACHE_SIZE,
+    VenvCache,
+    common_requirements,
+    get_installer,
+    print_subprocess_result,
+    run_subprocess,
+)
+
+GRPC = "grpc"
+# the default port of otelsink for each OTLP protocol
+SINK_PORTS = {GRPC: 4317, "http/protobuf": 4318, "http/json": 4318}
+# the number of characters of each of a script's stdout and stderr kept for on_stop()
+DEFAULT_OUTPUT_LIMIT = 10 * 1024 * 1024
+# the signals a script can be asked to stop with before it's killed
+STOP_SIGNALS = ("SIGINT", "SIGTERM")
+DEFAULT_GRACE_PERIOD = 5.0
+
+JSON = "json"
+NDJSON = "ndjson"
+CAPTURE = "capture"
+# the extension of the telemetry files of each output format
+FORMAT_EXTENSIONS = {JSON: "json", NDJSON: "ndjson", CAPTURE: "otcap"}
+TELEMETRY_EXTENSIONS = tuple(FORMAT_EXTENSIONS.values())
+# functions that return a Telemetry backed by a telemetry file of each streaming output format
+READERS = {NDJSON: read_ndjson, CAPTURE: read_capture}
+
 
+@dataclasses.dataclass
+class RunOptions:
+    """
+    Options that apply to every script in a run.
+    """
 
-def run(script_path: str, venv_parent_dir: str):
+    # whether sinks listen on ephemeral ports rather than the default ports for their protocol
+    ephemeral_sink_ports: bool = False
+    # the format telemetry is saved in: JSON is written once the script is done, NDJSON and CAPTURE (the serialized
+    # requests as received) as telemetry arrives
+    output_format: str = JSON
+    # the number of processes receiving gRPC telemetry for each script, see MultiProcessGrpcSink
+    sink_workers: int = 1
+    # whether script output is written to the console as it arrives, each line prefixed with the script's name
+    stream_output: bool = False
+    # the number of characters of each of a script's stdout and stderr kept in memory for on_stop(), the oldest lines
+    # being dropped once there are more
+    output_limit: int = DEFAULT_OUTPUT_LIMIT
+    # whether a script's full stdout and stderr are written to <script>.stdout.log and <script>.stderr.log
+    spill_output: bool = False
+    # the signal a script's process group is sent when it's stopped, and the number of seconds it gets to exit, while
+    # otelsink keeps receiving, before it's killed
+    stop_signal: str = "SIGINT"
+    grace_period: float = DEFAULT_GRACE_PERIOD
+    # the control address of an otelsink daemon to send telemetry to, in a session per script, rather than starting
+    # a sink for each script, see oteltest.sink.daemon
+    sink_daemon: typing.Optional[str] = None
+    # if set, the columnar format ("parquet", "csv", or "auto") telemetry is also saved in, see oteltest.columnar
+    columnar: typing.Optional[str] = None
+
+
+def run(
+    script_path: str,
+    venv_parent_dir: str,
+    jobs: int = 1,
+    venv_cache_size: int = DEFAULT_VENV_CACHE_SIZE,
+    rebuild: bool = False,
+    installer: str = "auto",
+    wheelhouse: typing.Optional[str] = None,
+    template: bool = True,
+    output_format: str = JSON,
+    sink_workers: int = 1,
+    stream_output: bool = False,
+    output_limit: int = DEFAULT_OUTPUT_LIMIT,
+    spill_output: bool = False,
+    stop_signal: str = "SIGINT",
+    grace_period: float = DEFAULT_GRACE_PERIOD,
+    sink_daemon: typing.Optional[str] = None,
+    columnar: typing.Optional[str] = None,
+):
     temp_dir = venv_parent_dir or tempfile.mkdtemp()
     print(f"- Using temp dir for venvs: {temp_dir}")
+    if wheelhouse:
+        wheelhouse = os.path.abspath(wheelhouse)
+        print(f"- Installing requirements only from wheelhouse: {wheelhouse}")
+    venv_cache = VenvCache(
+        temp_dir, venv_cache_size, rebuild, get_installer(installer, wheelhouse)
+    )
+
+    options = RunOptions(
+        output_format=output_format,
+        sink_workers=sink_workers,
+        stream_output=stream_output,
+        output_limit=output_limit,
+        spill_output=spill_output,
+        stop_signal=stop_signal,
+        grace_period=grace_period,
+        sink_daemon=sink_daemon,
+        columnar=columnar,
+    )
 
     if os.path.isdir(script_path):
-        handle_dir(script_path, temp_dir)
+        handle_dir(script_path, venv_cache, options, jobs, template)
     elif os.path.isfile(script_path):
-        handle_file(script_path, temp_dir)
+        handle_file(script_path, venv_cache, options)
     else:
         print(f"- {script_path} does not exist")
         return
 
 
-def handle_dir(dir_path, temp_dir):
+def handle_dir(dir_path, venv_cache, options, jobs=1, template=True):
     sys.path.append(dir_path)
-    for script in ls_scripts(dir_path):
+    scripts = ls_scripts(dir_path)
+    if template and len(scripts) > 1:
+        venv_cache.use_template(
+            common_requirements(
+                [load_requirements(dir_path, script) for script in scripts]
+            )
+        )
+    if jobs > 1:
+        run_scripts_concurrently(venv_cache, dir_path, scripts, options, jobs)
+        return
+    for script in scripts:
+        print(f"- Setting up environment for script {script}")
+        setup_script_environment(venv_cache, dir_path, script, options)
+
+
+def run_scripts_concurrently(venv_cache, script_dir, scripts, options, jobs):
+    """
+    Runs scripts in a pool of worker processes. Each script gets its own sink on an ephemeral port, and its output is
+    buffered and printed in one piece once the script is done, so the output of concurrent scripts never interleaves.
+    """
+    print(f"- Running {len(scripts)} scripts with up to {jobs} concurrent jobs")
+    failed = []
+    # spawn rather than fork: forking a process in which grpc may already be running is not supported by grpc
+    mp_context = multiprocessing.get_context("spawn")
+    options = dataclasses.replace(options, ephemeral_sink_ports=True)
+    with futures.ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as pool:
+        pending = {
+            pool.submit(
+                run_script_captured, venv_cache, script_dir, script, options
+            ): script
+            for script in scripts
+        }
+        for future in futures.as_completed(pending):
+            script = pending[future]
+            output, error = future.result()
+            print(output, end="")
+            if error:
+                print(error)
+                print(f"- FAILED: {script}")
+                failed.append(script)
+    if failed:
+        raise RuntimeError(f"{len(failed)} script(s) failed: {', '.join(failed)}")
+
+
+def run_script_captured(
+    venv_cache: "VenvCache", script_dir: str, script: str, options: RunOptions
+) -> typing.Tuple[str, typing.Optional[str]]:
+    """
+    Runs a single script in a worker process, returning the script's buffered output and, if the run raised, the
+    formatted traceback.
+    """
+    if script_dir not in sys.path:
+        sys.path.append(script_dir)
+    out = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(out):
         print(f"- Setting up environment for script {script}")
-        setup_script_environment(temp_dir, dir_path, script)
+        try:
+            setup_script_environment(venv_cache, script_dir, script, options)
+        except Exception:  # pylint: disable=W0718
+            error = traceback.format_exc()
+    return out.getvalue(), error
 
 
-def handle_file(file_path, temp_dir):
+def handle_file(file_path, venv_cache, options):
     print(f"- Setting up environment for file {file_path}")
     script_dir = os.path.dirname(file_path)
     sys.path.append(script_dir)
-    setup_script_environment(temp_dir, script_dir, os.path.basename(file_path))
+    setup_script_environment(
+        venv_cache, script_dir, os.path.basename(file_path), options
+    )
+
+
+def prefetch(script_path: str, wheelhouse: str):
+    """
+    Builds or downloads wheels for the requirements of every script at `script_path` into `wheelhouse`, so that later
+    runs with that wheelhouse can install requirements without network access. Scripts with the same requirements are
+    only prefetched once.
+    """
+    if os.path.isdir(script_path):
+        script_dir = script_path
+        scripts = ls_scripts(script_path)
+    elif os.path.isfile(script_path):
+        script_dir = os.path.dirname(script_path)
+        scripts = [os.path.basename(script_path)]
+    else:
+        print(f"- {script_path} does not exist")
+        return
+    sys.path.append(script_dir)
+
+    os.makedirs(wheelhouse, exist_ok=True)
+    done = set()
+    for script in scripts:
+        requirements = tuple(load_requirements(script_dir, script))
+        if not requirements or tuple(sorted(requirements)) in done:
+            continue
+        done.add(tuple(sorted(requirements)))
+        print(f"- Prefetching requirements for script {script}: {requirements}")
+        # pip wheel downloads wheels where they exist and builds them from source distributions otherwise
+        run_subprocess(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "wheel",
+                "--wheel-dir",
+                wheelhouse,
+                *requirements,
+            ]
+        )
+    print(f"- Prefetched requirements for {len(done)} script(s) into {wheelhouse}")
+
+
+def load_requirements(script_dir: str, script: str) -> typing.Sequence[str]:
+    """
+    Returns the requirements of the oteltest class in `script`, or no requirements if it doesn't have one.
+    """
+    module_name = script[:-3]
+    oteltest_class = load_test_class_for_script(
+        module_name, os.path.join(script_dir, script)
+    )
+    if oteltest_class is None:
+        print(f"Could not find oteltest class for module_name '{module_name}'")
+        return []
+    return oteltest_class().requirements()
 
 
 def ls_scripts(script_dir):
@@ -62,11 +301,13 @@ def ls_scripts(script_dir):
     return scripts
 
 
-def setup_script_environment(venv_parent: str, script_dir: str, script: str):
-    handler = AccumulatingHandler()
-    sink = GrpcSink(handler)
-    sink.start()
-
+def setup_script_environment(
+    venv_cache: "VenvCache",
+    script_dir: str,
+    script: str,
+    options: typing.Optional[RunOptions] = None,
+):
+    options = options or RunOptions()
     module_name = script[:-3]
     module_path = os.path.join(script_dir, script)
     oteltest_class = load_test_class_for_script(module_name, module_path)
@@ -75,38 +316,197 @@ def setup_script_environment(venv_parent: str, script_dir: str, script: str):
         return
     oteltest_instance = oteltest_class()
 
-    script_venv = Venv(str(Path(venv_parent) / module_name))
-    script_venv.create()
+    protocol = get_otlp_protocol(oteltest_instance)
+    output_format = options.output_format
+    daemon = SinkDaemonClient(options.sink_daemon) if options.sink_daemon else None
+    if daemon is not None and output_format != JSON:
+        print(
+            f"- Saving telemetry as '{JSON}': the otelsink daemon returns all of it at once"
+        )
+        output_format = JSON
+    sink_workers = 1 if daemon is not None else options.sink_workers
+    if sink_workers > 1 and (protocol != GRPC or output_format != JSON):
+        print(
+            f"- Using one sink process: multiple sink processes need the '{GRPC}' protocol and the '{JSON}' format"
+        )
+        sink_workers = 1
 
-    pip_path = script_venv.path_to_executable("pip")
+    expectation = get_expectation(oteltest_instance)
+    if isinstance(expectation, Predicate) and output_format != JSON:
+        print(
+            f"- Ignoring expected_telemetry(): functions of the telemetry need the '{JSON}' format"
+        )
+        expectation = None
+    if expectation is not None and sink_workers > 1:
+        print(
+            "- Ignoring expected_telemetry(): telemetry is split across multiple sink processes"
+        )
+        expectation = None
+    if expectation is not None and daemon is not None:
+        print(
+            "- Ignoring expected_telemetry(): telemetry is received by the otelsink daemon"
+        )
+        expectation = None
 
-    for req in oteltest_instance.requirements():
-        print(f"- Will install requirement: '{req}'")
-        run_subprocess([pip_path, "install", req])
+    writer = None
+    if output_format == JSON:
+        handler = AccumulatingHandler(expectation)
+    else:
+        filename = get_next_json_file(
+            script_dir, module_name, FORMAT_EXTENSIONS[output_format]
+        )
+        print(f"- Will stream telemetry to {filename}")
+        path = str(Path(script_dir) / filename)
+        if output_format == NDJSON:
+            writer = NdjsonWriter(path)
+            handler = AccumulatingHandler(expectation, writer)
+        else:
+            writer = CaptureWriter(path)
+            handler = CaptureHandler(writer, expectation)
+    faults = get_sink_faults(oteltest_instance)
+    sink = None
+    session = None
+    start_time = handler.start_time
+    if daemon is not None:
+        if faults is not None:
+            print("- Ignoring sink_faults(): the otelsink daemon doesn't inject faults")
+        session = f"{module_name}-{uuid.uuid4().hex[:8]}"
+        ports = daemon.info()
+        sink_port = ports["grpc_port" if protocol == GRPC else "http_port"]
+        start_time = daemon.start_session(session)
+        print(
+            f"- Using otelsink daemon at {options.sink_daemon} ({protocol}, port {sink_port}), session {session}"
+        )
+    else:
+        port = 0 if options.ephemeral_sink_ports else SINK_PORTS[protocol]
+        address = f"0.0.0.0:{port}"
+        if sink_workers > 1:
+            # each worker accumulates what it receives, and the results are merged once the script is done. Workers
+            # measure elapsed times from the same start time, so that merging can order their requests.
+            sink = MultiProcessGrpcSink(
+                functools.partial(AccumulatingHandler, start_time=start_time),
+                sink_workers,
+                address=address,
+                faults=faults,
+            )
+        else:
+            sink_class = GrpcSink if protocol == GRPC else HttpSink
+            sink = sink_class(handler, address=address, faults=faults)
+        sink.start()
+        sink_port = sink.port
+        print(f"- Started otelsink ({protocol}) on port {sink_port}")
+        if faults is not None:
+            print(f"- Injecting faults: {faults}")
 
-    stdout, stderr, returncode = run_python_script(
-        script_dir, script, oteltest_instance, script_venv
-    )
-    print_subprocess_result(stdout, stderr, returncode)
+    try:
+        with venv_cache.use(
+            oteltest_instance.requirements(), oteltest_instance.wrapper_command()
+        ) as script_venv:
+            result = run_python_script(
+                script_dir,
+                script,
+                oteltest_instance,
+                script_venv,
+                sink_port,
+                handler.expectation_met,
+                protocol,
+                options=options,
+                session=session,
+            )
+    except BaseException:
+        # so that the port is free for the next script
+        if sink is not None:
+            sink.stop()
+        elif session is not None:
+            daemon.stop_session(session)
+        raise
+    stdout, stderr, returncode, resource_usage, shutdown, time_to_ready_s = result
+    print_subprocess_result(stdout, stderr, returncode, options.stream_output)
+    print(resource_usage.summary())
 
-    filename = get_next_json_file(script_dir, module_name)
-    print(f"- Will save telemetry to {filename}")
-    save_telemetry_json(script_dir, filename, handler.telemetry_to_json())
+    if writer is None:
+        if daemon is not None:
+            tel = daemon.stop_session(session)
+        elif sink_workers > 1:
+            tel = Telemetry.merge(*sink.stop())
+        else:
+            sink.stop()
+            tel = handler.collect()
+        tel.resource_usage = resource_usage
+        tel.time_to_ready_s = time_to_ready_s
+        filename = get_next_json_file(script_dir, module_name)
+        print(f"- Will save telemetry to {filename}")
+        save_telemetry_json(script_dir, filename, tel.to_json())
+    else:
+        sink.stop()
+        writer.close()
+        tel = READERS[output_format](writer.path)
+        tel.ingest_stats = handler.stats
+        tel.resource_usage = resource_usage
+        tel.time_to_ready_s = time_to_ready_s
+    # the otelsink daemon doesn't keep ingest stats per session
+    if tel.ingest_stats is not None:
+        print(tel.ingest_stats.summary())
+    if shutdown is not None:
+        print(shutdown.summary(tel, start_time))
+    if options.columnar:
+        # named like the telemetry file, e.g. my_script.3.spans.parquet for my_script.3.json
+        run_name = filename.rsplit(".", 1)[0]
+        paths = write_columnar(tel, script_dir, run_name, options.columnar)
+        print(
+            f"- Saved columnar tables: {', '.join(os.path.basename(p) for p in paths)}"
+        )
 
-    oteltest_instance.on_stop(handler.telemetry, stdout, stderr, returncode)
+    oteltest_instance.on_stop(tel, stdout, stderr, returncode)
     print(f"- PASSED: {script}")
 
 
-def get_next_json_file(path_str: str, module_name: str):
-    path = Path(path_str)
-    max_index = -1
-    for file in path.glob(f"{module_name}.*.json"):
-        last_part = file.stem.split(".")[-1]
-        if last_part.isdigit():
-            index = int(last_part)
-            if index > max_index:
-                max_index = index
-    return f"{module_name}.{max_index + 1}.json"
+def get_next_json_file(path_str: str, module_name: str, extension: str = JSON):
+    # telemetry files of all formats share one sequence of numbers
+    history = telemetry_history(path_str, module_name)
+    max_index = history[-1][0] if history else -1
+    return f"{module_name}.{max_index + 1}.{extension}"
+
+
+def telemetry_history(
+    path_str: str, module_name: str
+) -> typing.List[typing.Tuple[int, Path]]:
+    """Returns the numbered telemetry files of a script, in any format, as (number, path), oldest first."""
+    out = []
+    for ext in TELEMETRY_EXTENSIONS:
+        for file in Path(path_str).glob(f"{module_name}.*.{ext}"):
+            last_part = file.stem.split(".")[-1]
+            if last_part.isdigit():
+                out.append((int(last_part), file))
+    return sorted(out)
+
+
+def files_to_diff(
+    path: str, baseline: typing.Optional[str] = None
+) -> typing.Tuple[str, str]:
+    """
+    Returns the telemetry files `oteltest diff` compares, old and new, given a script or one of its telemetry files:
+    the script's latest telemetry file, or the given one, and `baseline` or else the telemetry file numbered before it.
+    Raises ValueError if there's nothing to compare.
+    """
+    file = Path(path)
+    if file.suffix == ".py":
+        history = telemetry_history(str(file.parent), file.stem)
+        if not history:
+            raise ValueError(f"no telemetry files for {path}")
+        number, new = history[-1]
+    else:
+        parts = file.name.split(".")
+        if len(parts) < 3 or not parts[-2].isdigit():
+            raise ValueError(f"{path} is not a numbered telemetry file")
+        number, new = int(parts[-2]), file
+        history = telemetry_history(str(file.parent), ".".join(parts[:-2]))
+    if baseline is not None:
+        return baseline, str(new)
+    previous = [p for n, p in history if n < number]
+    if not previous:
+        raise ValueError(f"no telemetry file before {new.name} to compare it with")
+    return str(previous[-1]), str(new)
 
 
 def save_telemetry_json(script_dir: str, file_name: str, json_str: str):
@@ -116,35 +516,642 @@ def save_telemetry_json(script_dir: str, file_name: str, json_str: str):
 
 
 def run_python_script(
-    script_dir: str, script: str, oteltest_instance: OtelTest, v
-) -> typing.Tuple[str, str, int]:
+    script_dir: str,
+    script: str,
+    oteltest_instance: OtelTest,
+    v,
+    sink_port: int,
+    expectation_met: typing.Optional[threading.Event] = None,
+    protocol: str = GRPC,
+    use_wrapper: bool = True,
+    stop_after_on_start: bool = False,
+    options: typing.Optional[RunOptions] = None,
+    session: typing.Optional[str] = None,
+) -> "ScriptResult":
+    """
+    Runs the script to completion, or until its expected telemetry has arrived or on_start()'s timeout has elapsed.
+    Pass `use_wrapper=False` to run it without its wrapper command, and `stop_after_on_start=True` to stop it as soon
+    as on_start() returns, unless on_start() returns None. `options` decide what happens to the script's output.
+    `session` is the otelsink daemon session the script's telemetry is sent to, if any.
+    """
+    options = options or RunOptions()
     print(f"- Running python script: {script}")
     python_script_cmd = [
         v.path_to_executable("python"),
         str(Path(script_dir) / script),
     ]
 
-    wrapper_script = oteltest_instance.wrapper_command()
-    if wrapper_script is not None:
+    wrapper_script = oteltest_instance.wrapper_command() if use_wrapper else None
+    # an empty wrapper command means no wrapper, like None
+    if wrapper_script:
         python_script_cmd.insert(0, v.path_to_executable(wrapper_script))
 
     # typically python_script_cmd will be ["opentelemetry-instrument", "python", "foo.py"] but with full paths
     print(f"- Popen subprocess: {python_script_cmd}")
-    proc = subprocess.Popen(
+    started = time.monotonic()
+    proc = RusagePopen(
         python_script_cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=True,
-        env=oteltest_instance.environment_variables(),
+        env=script_environment(oteltest_instance, sink_port, protocol, session),
+        # in its own process group, so that stopping it stops any processes it started too
+        start_new_session=True,
+    )
+    try:
+        return watch_script(
+            script_dir,
+            script,
+            oteltest_instance,
+            proc,
+            started,
+            expectation_met,
+            stop_after_on_start,
+            options,
+        )
+    except BaseException:
+        # e.g. on_start() raised or oteltest was interrupted: the script isn't in our process group, so wouldn't get
+        # a ctrl-c, and would otherwise keep running
+        signal_process_group(proc, signal.SIGKILL)
+        proc.wait()
+        raise
+
+
+def watch_script(
+    script_dir: str,
+    script: str,
+    oteltest_instance: OtelTest,
+    proc: "RusagePopen",
+    started: float,
+    expectation_met: typing.Optional[threading.Event],
+    stop_after_on_start: bool,
+    options: RunOptions,
+) -> "ScriptResult":
+    rss_monitor = RssMonitor(proc.pid)
+    probe = get_readiness_probe(oteltest_instance)
+    output = OutputReader(
+        proc,
+        probe.feed_stdout if probe else None,
+        max_chars=options.output_limit,
+        tee_prefix=f"[{script}] " if options.stream_output else None,
+        spill_paths=spill_paths(script_dir, script) if options.spill_output else None,
+    )
+    time_to_ready_s = (
+        wait_until_ready(probe, proc, script) if probe is not None else None
     )
     timeout = exec_onstart_callback(oteltest_instance, script)
+    if stop_after_on_start and timeout is not None:
+        outcome = STOPPED if proc.poll() is None else EXITED
+    else:
+        outcome = wait_for_script(proc, timeout, expectation_met)
+    shutdown = None
+    if outcome != EXITED:
+        reason = {
+            STOPPED: "on_start() returned",
+            EXPECTATION_MET: "expected telemetry received",
+            TIMED_OUT: "timed out",
+        }[outcome]
+        print(
+            f"- Stopping script {script} ({reason}) with {options.stop_signal}, "
+            f"waiting up to {options.grace_period}s before killing it"
+        )
+        shutdown = stop_script(proc, options.stop_signal, options.grace_period)
+        if shutdown.killed:
+            print(f"- Script {script} killed")
+    wall_time = time.monotonic() - started
+    rss_monitor.stop()
+    output.join()
+    for stream, lines in output.dropped().items():
+        print(
+            f"- Dropped the first {lines} lines of {stream}, keeping the last {options.output_limit} characters"
+        )
+    if options.spill_output:
+        print(f"- Saved full output to {', '.join(spill_paths(script_dir, script))}")
+    usage = ResourceUsage(
+        wall_time, proc.rusage, rss_monitor.peak_rss_kb, rss_monitor.samples
+    )
+    return ScriptResult(
+        output.stdout(),
+        output.stderr(),
+        proc.returncode,
+        usage,
+        shutdown,
+        time_to_ready_s,
+    )
+
+
+def spill_paths(script_dir: str, script: str) -> typing.Tuple[str, str]:
+    """Returns the paths a script's full stdout and stderr are written to, overwritten by each run."""
+    module_name = script[:-3]
+    return (
+        str(Path(script_dir) / f"{module_name}.stdout.log"),
+        str(Path(script_dir) / f"{module_name}.stderr.log"),
+    )
+
+
+class ScriptResult(typing.NamedTuple):
+    """
+    The output of a script run, the resources it used, if it had to be stopped, how, and, if it has a readiness probe,
+    how long it took to become ready.
+    """
+
+    stdout: str
+    stderr: str
+    returncode: int
+    resource_usage: ResourceUsage
+    shutdown: typing.Optional["Shutdown"] = None
+    time_to_ready_s: typing.Optional[float] = None
+
+
+class RssMonitor:
+    """
+    Keeps track of a script's memory use on a daemon thread, checking every `interval` seconds until stopped:
+
+    - `peak_rss_kb`, the peak resident set size of the process in KiB, from VmHWM in /proc/<pid>/status. VmHWM is
+      itself a high water mark, so only growth during the last interval before the process exits is missed.
+    - `samples`, every `sample_interval` seconds, (seconds since the monitor started, total RSS in KiB of the process
+      and its descendants). When there are more than `max_samples`, every other sample is dropped and the sample
+      interval doubled, so that memory use stays bounded however long the script runs.
+
+    Samples taken before the process has exec'd, while it's still a copy of this process, are ignored. Only works
+    where /proc is available, i.e. on Linux.
+    """
+
+    def __init__(
+        self,
+        pid: int,
+        interval: float = 0.1,
+        sample_interval: float = 1.0,
+        max_samples: int = 1000,
+    ):
+        self.pid = pid
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.max_samples = max_samples
+        self.peak_rss_kb: typing.Optional[int] = None
+        self.samples: typing.List[typing.Tuple[float, int]] = []
+        self.own_cmdline = read_proc_file("self", "cmdline")
+        self.started = time.monotonic()
+        self.next_sample = self.started
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self.stopped.wait(self.interval):
+                return
+
+    def sample(self):
+        cmdline = read_proc_file(self.pid, "cmdline")
+        if not cmdline or cmdline == self.own_cmdline:
+            return
+        hwm = proc_status_kb(self.pid, b"VmHWM:")
+        if hwm is not None and (self.peak_rss_kb is None or hwm > self.peak_rss_kb):
+            self.peak_rss_kb = hwm
+        now = time.monotonic()
+        if now < self.next_sample:
+            return
+        total = sum(
+            proc_status_kb(pid, b"VmRSS:") or 0
+            for pid in [self.pid, *proc_descendants(self.pid)]
+        )
+        self.samples.append((round(now - self.started, 3), total))
+        self.next_sample = now + self.sample_interval
+        if len(self.samples) > self.max_samples:
+            self.samples = self.samples[::2]
+            self.sample_interval *= 2
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def read_proc_file(pid, name: str) -> typing.Optional[bytes]:
     try:
-        stdout, stderr = proc.communicate(timeout=timeout)
-        return stdout, stderr, proc.returncode
-    except subprocess.TimeoutExpired as ex:
-        proc.kill()
-        print(f"- Script {script} terminated")
-        return decode(ex.stdout), decode(ex.stderr), proc.returncode
+        with open(f"/proc/{pid}/{name}", "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def proc_status_kb(pid, field: bytes) -> typing.Optional[int]:
+    """Returns a field of /proc/<pid>/status that's in kB, e.g. b"VmRSS:", or None if it isn't available."""
+    for line in (read_proc_file(pid, "status") or b"").splitlines():
+        if line.startswith(field):
+            return int(line.split()[1])
+    return None
+
+
+def proc_descendants(pid: int) -> typing.List[int]:
+    """
+    Returns the pids of the descendants of a process, from /proc/<pid>/task/<tid>/children if the kernel has it
+    (CONFIG_PROC_CHILDREN), otherwise by reading the parent pid of every process from /proc/<pid>/stat.
+    """
+    if os.path.exists(f"/proc/{pid}/task/{pid}/children"):
+        children_of = proc_children
+    else:
+        ppids = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                stat = read_proc_file(entry, "stat")
+                if stat:
+                    # the command name, in parentheses, may contain spaces, and the parent pid comes right after it
+                    ppids[int(entry)] = int(stat.rsplit(b")", 1)[1].split()[1])
+        children: typing.Dict[int, typing.List[int]] = {}
+        for child, parent in ppids.items():
+            children.setdefault(parent, []).append(child)
+
+        def children_of(parent):
+            return children.get(parent, [])
+
+    out = []
+    pending = [pid]
+    while pending:
+        found = children_of(pending.pop())
+        out.extend(found)
+        pending.extend(found)
+    return out
+
+
+def proc_children(pid: int) -> typing.List[int]:
+    out = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(path, "rb") as f:
+                out.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return out
+
+
+# the fields of getrusage's result that add up over processes, i.e. all but ru_maxrss and the like
+RUSAGE_FIELDS = (
+    "ru_utime",
+    "ru_stime",
+    "ru_minflt",
+    "ru_majflt",
+    "ru_nvcsw",
+    "ru_nivcsw",
+)
+
+
+class RusagePopen(subprocess.Popen):
+    """
+    A Popen whose process's resource usage is available as `rusage` once wait() or poll() has seen it exit: the growth
+    of this process's RUSAGE_CHILDREN between starting the process and reaping it. Any other child process reaped in
+    the meantime would be counted too, which is why scripts run one at a time per oteltest process. ru_maxrss is the
+    maximum over all children rather than a sum, so it's left out, and RssMonitor reads the peak RSS from /proc
+    instead.
+    """
+
+    rusage = None
+
+    def __init__(self, *args, **kwargs):
+        self._children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        super().__init__(*args, **kwargs)
+
+    def poll(self):
+        returncode = super().poll()
+        self._record_rusage()
+        return returncode
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        self._record_rusage()
+        return returncode
+
+    def _record_rusage(self):
+        if self.returncode is None or self.rusage is not None:
+            return
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.rusage = types.SimpleNamespace(
+            **{
+                field: getattr(after, field) - getattr(self._children_before, field)
+                for field in RUSAGE_FIELDS
+            }
+        )
+
+
+EXITED = "exited"
+EXPECTATION_MET = "expectation met"
+TIMED_OUT = "timed out"
+STOPPED = "stopped"
+
+
+def wait_for_script(
+    proc: subprocess.Popen,
+    timeout: typing.Optional[float],
+    expectation_met: typing.Optional[threading.Event],
+) -> str:
+    """
+    Waits until the script exits, the expected telemetry has been received, or `timeout` seconds have elapsed
+    (`None` to wait indefinitely), and returns which of these happened first.
+    """
+    if expectation_met is None:
+        try:
+            proc.wait(timeout=timeout)
+            return EXITED
+        except subprocess.TimeoutExpired:
+            return TIMED_OUT
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while proc.poll() is None:
+        if expectation_met.is_set():
+            return EXPECTATION_MET
+        if deadline is not None and time.monotonic() >= deadline:
+            return TIMED_OUT
+        expectation_met.wait(0.05)
+    return EXITED
+
+
+def stop_script(
+    proc: subprocess.Popen,
+    stop_signal: str = "SIGINT",
+    grace_period: float = DEFAULT_GRACE_PERIOD,
+) -> "Shutdown":
+    """
+    Asks the script to stop by sending `stop_signal` to its process group, giving its exporters a chance to flush,
+    then kills the process group if the script is still running after `grace_period` seconds. Any processes left in
+    the group once the script has exited are killed too.
+
+    Python runs atexit handlers, and so shuts down the OpenTelemetry SDK, on SIGINT (a KeyboardInterrupt), but not on
+    SIGTERM unless the script handles it, which is why SIGINT is the default.
+    """
+    signalled_at_ns = time.time_ns()
+    signal_process_group(proc, getattr(signal, stop_signal))
+    killed = False
+    try:
+        proc.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        killed = True
+    grace_s = (time.time_ns() - signalled_at_ns) / 1e9
+    signal_process_group(proc, signal.SIGKILL)
+    proc.wait()
+    return Shutdown(stop_signal, signalled_at_ns, grace_s, killed)
+
+
+def signal_process_group(proc: subprocess.Popen, sig: int):
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        # the whole group has already exited
+        pass
+
+
+@dataclasses.dataclass
+class Shutdown:
+    """
+    How a script was stopped: the signal it was sent, when (in nanoseconds since the epoch), the seconds between that
+    and the script exiting or being killed, and whether it had to be killed.
+    """
+
+    stop_signal: str
+    signalled_at_ns: int
+    grace_s: float
+    killed: bool
+
+    def received_during_grace_period(
+        self, tel: Telemetry, start_time_ns: int
+    ) -> typing.Dict[str, typing.Tuple[int, int]]:
+        """
+        Returns the number of requests and items (spans, metric data points, or log records) of each signal received
+        after the stop signal was sent, given the time in nanoseconds since the epoch that the requests' test_elapsed_ms
+        are relative to.
+        """
+        # requests arriving within the same millisecond as the signal are most likely what prompted it, e.g. the last
+        # of the expected telemetry, so they aren't counted
+        since_ms = round((self.signalled_at_ns - start_time_ns) / 1e6)
+        out = {}
+        for sig, requests in (
+            (TRACE, tel.trace_requests),
+            (METRIC, tel.metric_requests),
+            (LOG, tel.log_requests),
+        ):
+            late = [req for req in requests if req.test_elapsed_ms > since_ms]
+            if late:
+                out[sig] = (len(late), sum(count_items(sig, req.pbreq) for req in late))
+        return out
+
+    def summary(self, tel: Telemetry, start_time_ns: int) -> str:
+        line = f"- Shutdown: {self.stop_signal}, "
+        line += (
+            f"killed after {self.grace_s:.2f}s"
+            if self.killed
+            else f"exited after {self.grace_s:.2f}s"
+        )
+        received = self.received_during_grace_period(tel, start_time_ns)
+        if not received:
+            return line + ", no telemetry received meanwhile"
+        counts = ", ".join(
+            f"{sig}: {requests} requests ({items} items)"
+            for sig, (requests, items) in sorted(received.items())
+        )
+        return f"{line}, received meanwhile {counts}"
+
+
+def get_expectation(oteltest_instance) -> typing.Optional[Expectation]:
+    # expected_telemetry() is optional, and may return either an Expectation or a function of the telemetry
+    expected_telemetry = getattr(oteltest_instance, "expected_telemetry", None)
+    expectation = expected_telemetry() if expected_telemetry else None
+    if expectation is None or isinstance(expectation, Expectation):
+        return expectation
+    return Predicate(expectation)
+
+
+def get_otlp_protocol(oteltest_instance) -> str:
+    # otlp_protocol() is optional
+    otlp_protocol = getattr(oteltest_instance, "otlp_protocol", None)
+    protocol = otlp_protocol() if otlp_protocol else GRPC
+    if protocol not in SINK_PORTS:
+        raise ValueError(f"Unsupported OTLP protocol: '{protocol}'")
+    return protocol
+
+
+def get_sink_faults(oteltest_instance) -> typing.Optional[FaultPolicy]:
+    # sink_faults() is optional
+    sink_faults = getattr(oteltest_instance, "sink_faults", None)
+    return sink_faults() if sink_faults else None
+
+
+def get_readiness_probe(oteltest_instance) -> typing.Optional[ReadinessProbe]:
+    # readiness_probe() is optional, and classes that don't inherit from OtelTest may not define it at all
+    readiness_probe = getattr(oteltest_instance, "readiness_probe", None)
+    return readiness_probe() if readiness_probe else None
+
+
+def wait_until_ready(
+    probe: ReadinessProbe, proc: subprocess.Popen, script: str
+) -> typing.Optional[float]:
+    """
+    Polls `probe`, backing off exponentially between attempts, until it succeeds, it times out, or the script exits.
+    Returns the number of seconds the script took to become ready, or None if it never did.
+    """
+    print(f"- Waiting up to {probe.timeout} seconds for {script} to be ready: {probe}")
+    start = time.monotonic()
+    delay = 0.01
+    while True:
+        if probe.is_ready():
+            elapsed = time.monotonic() - start
+            print(f"- Script {script} ready after {round(elapsed * 1000)} ms")
+            return elapsed
+        if proc.poll() is not None:
+            print(f"- Script {script} exited before it was ready")
+            return None
+        remaining = probe.timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            print(f"- Script {script} not ready after {probe.timeout} seconds")
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+
+class OutputBuffer:
+    """
+    Keeps the last `max_chars` characters of a stream's lines, dropping the oldest lines once there are more, so that
+    memory use stays bounded however much a script writes. Each line is also written as it arrives to `tee`, after
+    `prefix`, and to `spill`, if given.
+    """
+
+    def __init__(
+        self,
+        max_chars: typing.Optional[int] = None,
+        tee: typing.Optional[typing.TextIO] = None,
+        prefix: str = "",
+        spill: typing.Optional[typing.TextIO] = None,
+    ):
+        self.max_chars = max_chars
+        self.tee = tee
+        self.prefix = prefix
+        self.spill = spill
+        self.lines: typing.Deque[str] = collections.deque()
+        self.chars = 0
+        self.dropped_lines = 0
+
+    def append(self, line: str):
+        if self.tee is not None:
+            # a single write, so that lines from concurrent scripts don't interleave mid-line
+            self.tee.write(self.prefix + line)
+            self.tee.flush()
+        if self.spill is not None:
+            self.spill.write(line)
+        if self.max_chars is not None and len(line) > self.max_chars:
+            line = line[-self.max_chars :]
+        self.lines.append(line)
+        self.chars += len(line)
+        while self.max_chars is not None and self.chars > self.max_chars:
+            self.chars -= len(self.lines.popleft())
+            self.dropped_lines += 1
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+
+class OutputReader:
+    """
+    Reads a subprocess's stdout and stderr on background threads as they are written, optionally passing each stdout
+    line to a callback, so that output can be inspected while the subprocess is still running.
+
+    Only the last `max_chars` characters of each stream are kept, see OutputBuffer. If `tee_prefix` is given, each
+    line is also written to the console as it arrives, after the prefix. If `spill_paths` is given, the full stdout
+    and stderr are written to those files.
+    """
+
+    def __init__(
+        self,
+        proc: subprocess.Popen,
+        on_stdout_line: typing.Optional[typing.Callable[[str], None]] = None,
+        max_chars: typing.Optional[int] = None,
+        tee_prefix: typing.Optional[str] = None,
+        spill_paths: typing.Optional[typing.Tuple[str, str]] = None,
+    ):
+        # sys.__stdout__ rather than sys.stdout, which is redirected to a buffer for scripts run concurrently
+        tees = (
+            (sys.__stdout__, sys.__stderr__) if tee_prefix is not None else (None, None)
+        )
+        spills = (
+            [open(path, "w", encoding="utf-8") for path in spill_paths]
+            if spill_paths
+            else (None, None)
+        )
+        self.stdout_buffer, self.stderr_buffer = (
+            OutputBuffer(max_chars, tee, tee_prefix or "", spill)
+            for tee, spill in zip(tees, spills)
+        )
+        self.threads = [
+            threading.Thread(
+                target=self._read,
+                args=(proc.stdout, self.stdout_buffer, on_stdout_line),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self._read,
+                args=(proc.stderr, self.stderr_buffer, None),
+                daemon=True,
+            ),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    @staticmethod
+    def _read(stream, buffer, on_line):
+        try:
+            for line in stream:
+                buffer.append(line)
+                if on_line is not None:
+                    on_line(line)
+        finally:
+            stream.close()
+            buffer.close()
+
+    def join(self):
+        """Waits until the subprocess has closed its stdout and stderr."""
+        for thread in self.threads:
+            thread.join()
+
+    def stdout(self) -> str:
+        return self.stdout_buffer.text()
+
+    def stderr(self) -> str:
+        return self.stderr_buffer.text()
+
+    def dropped(self) -> typing.Dict[str, int]:
+        """Returns the number of lines dropped from each stream's buffer, for the streams that dropped any."""
+        out = {}
+        for name, buffer in (
+            ("stdout", self.stdout_buffer),
+            ("stderr", self.stderr_buffer),
+        ):
+            if buffer.dropped_lines:
+                out[name] = buffer.dropped_lines
+        return out
+
+
+def script_environment(
+    oteltest_instance,
+    sink_port: int,
+    protocol: str = GRPC,
+    session: typing.Optional[str] = None,
+) -> typing.Dict[str, str]:
+    """
+    Returns the script's environment variables, pointing the script's OTLP exporter at this run's sink unless the
+    script has chosen an endpoint and protocol itself, and, given an otelsink daemon session, adding a header that
+    routes the script's telemetry to it.
+    """
+    env = dict(oteltest_instance.environment_variables())
+    env.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", f"http://127.0.0.1:{sink_port}")
+    if protocol != GRPC:
+        env.setdefault("OTEL_EXPORTER_OTLP_PROTOCOL", protocol)
+    if session is not None:
+        headers = [env.get("OTEL_EXPORTER_OTLP_HEADERS"), f"{SESSION_HEADER}={session}"]
+        env["OTEL_EXPORTER_OTLP_HEADERS"] = ",".join(h for h in headers if h)
+    # so that the script's output can be read as it is written, rather than when the script's buffers fill up
+    env.setdefault("PYTHONUNBUFFERED", "1")
+    return env
 
 
 def exec_onstart_callback(oteltest_instance, script):
@@ -162,32 +1169,6 @@ def exec_onstart_callback(oteltest_instance, script):
     return timeout
 
 
-def decode(b: typing.Optional[bytes]) -> str:
-    return b.decode("utf-8") if b else ""
-
-
-def run_subprocess(args):
-    print(f"- Subprocess: {args}")
-    result = subprocess.run(
-        args,
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    print_subprocess_result(result.stdout, result.stderr, result.returncode)
-
-
-def print_subprocess_result(stdout: str, stderr: str, returncode: int):
-    print(f"- Return Code: {returncode}")
-    print("- Standard Output:")
-    if stdout:
-        print(stdout)
-    print("- Standard Error:")
-    if stderr:
-        print(stderr)
-    print("- End Subprocess -\n")
-
-
 def load_test_class_for_script(module_name, module_path):
     spec = importlib.util.spec_from_file_location(module_name, module_path)
     module = importlib.util.module_from_spec(spec)
@@ -213,47 +1194,77 @@ def is_strict_subclass(value):
     )
 
 
-class Venv:
-    def __init__(self, venv_dir):
-        self.venv_dir = venv_dir
-
-    def create(self):
-        venv.create(self.venv_dir, with_pip=True)
-
-    def path_to_executable(self, executable_name: str):
-        return f"{self.venv_dir}/bin/{executable_name}"
-
-    def rm(self):
-        shutil.rmtree(self.venv_dir)
-
-
 class AccumulatingHandler(RequestHandler):
-    def __init__(self):
-        self.start_time = time.time_ns()
-        self.telemetry = Telemetry()
+    """
+    Adds received requests to a Telemetry, or, when given an NdjsonWriter, writes them to it as they arrive without
+    holding on to them. Each request's test_elapsed_ms is measured from `start_time`, in nanoseconds since the epoch,
+    which defaults to when the handler was created.
+    """
 
-    def handle_logs(self, request: ExportLogsServiceRequest, context):  # noqa: ARG002
-        self.telemetry.add_log(
-            request,
-            get_context_headers(context),
-            self.get_test_elapsed_ms(),
+    def __init__(
+        self,
+        expectation: typing.Optional[Expectation] = None,
+        ndjson_writer: typing.Optional[NdjsonWriter] = None,
+        start_time: typing.Optional[int] = None,
+    ):
+        self.start_time = time.time_ns() if start_time is None else start_time
+        self.telemetry: typing.Union[Telemetry, NdjsonWriter] = (
+            ndjson_writer or Telemetry()
         )
+        self.expectation = expectation
+        # set once the expectation, if any, has been met
+        self.expectation_met = threading.Event() if expectation else None
+        self.expectation_lock = threading.Lock()
+        self.stats = IngestStats()
+
+    def handle_logs(self, request: ExportLogsServiceRequest, context):  # noqa: ARG002
+        started = self.stats.begin(LOG)
+        try:
+            self.telemetry.add_log(
+                request,
+                get_context_headers(context),
+                self.get_test_elapsed_ms(),
+                getattr(context, "fault", None),
+            )
+            self.check_expectation(LOG, request)
+        finally:
+            self.stats.end(LOG, started, request)
 
     def handle_metrics(
         self, request: ExportMetricsServiceRequest, context
     ):  # noqa: ARG002
-        self.telemetry.add_metric(
-            request,
-            get_context_headers(context),
-            self.get_test_elapsed_ms(),
-        )
+        started = self.stats.begin(METRIC)
+        try:
+            self.telemetry.add_metric(
+                request,
+                get_context_headers(context),
+                self.get_test_elapsed_ms(),
+                getattr(context, "fault", None),
+            )
+            self.check_expectation(METRIC, request)
+        finally:
+            self.stats.end(METRIC, started, request)
 
     def handle_trace(self, request: ExportTraceServiceRequest, context):  # noqa: ARG002
-        self.telemetry.add_trace(
-            request,
-            get_context_headers(context),
-            self.get_test_elapsed_ms(),
-        )
+        started = self.stats.begin(TRACE)
+        try:
+            self.telemetry.add_trace(
+                request,
+                get_context_headers(context),
+                self.get_test_elapsed_ms(),
+                getattr(context, "fault", None),
+            )
+            self.check_expectation(TRACE, request)
+        finally:
+            self.stats.end(TRACE, started, request)
+
+    def check_expectation(self, signal: str, request):
+        if self.expectation is None or self.expectation_met.is_set():
+            return
+        # requests arrive on multiple grpc threads, and expectations keep state
+        with self.expectation_lock:
+            if self.expectation.observe(self.telemetry, signal, request):
+                self.expectation_met.set()
 
     def get_test_elapsed_ms(self):
         return round((time.time_ns() - self.start_time) / 1e6)
@@ -261,6 +1272,48 @@ class AccumulatingHandler(RequestHandler):
     def telemetry_to_json(self):
         return self.telemetry.to_json()
 
+    def collect(self):
+        self.telemetry.ingest_stats = self.stats
+        return self.telemetry
+
+
+class CaptureHandler(RawRequestHandler):
+    """
+    Writes received requests to a CaptureWriter without deserializing them. Requests are only deserialized when there
+    is an expectation to check.
+    """
+
+    def __init__(
+        self, writer: CaptureWriter, expectation: typing.Optional[Expectation] = None
+    ):
+        self.start_time = time.time_ns()
+        self.writer = writer
+        self.expectation = expectation
+        self.expectation_met = threading.Event() if expectation else None
+        self.expectation_lock = threading.Lock()
+        self.stats = IngestStats()
+
+    def handle_raw(self, signal: str, data: bytes, context):
+        started = self.stats.begin(signal)
+        try:
+            self.writer.add_raw(
+                signal,
+                data,
+                get_context_headers(context),
+                round((time.time_ns() - self.start_time) / 1e6),
+                getattr(context, "fault", None),
+            )
+            self.check_expectation(signal, data)
+        finally:
+            self.stats.end(signal, started, size=len(data))
+
+    def check_expectation(self, signal: str, data: bytes):
+        if self.expectation is None or self.expectation_met.is_set():
+            return
+        with self.expectation_lock:
+            if self.expectation.observe(None, signal, PBTYPES[signal].FromString(data)):
+                self.expectation_met.set()
+
 
 def get_context_headers(context):
     return pbmetadata_to_dict(context.invocation_metadata())
@@ -0,0 +1,94 @@
+import abc
+import http.client
+import re
+import socket
+
+
+class ReadinessProbe(abc.ABC):
+    """
+    Tells oteltest when a script is ready, e.g. when its server is accepting connections. Return an instance from
+    OtelTest#readiness_probe() and oteltest will poll it, backing off between attempts, after starting the script and
+    before calling on_start(). If the probe doesn't succeed within `timeout` seconds, on_start() is called anyway.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+
+    @abc.abstractmethod
+    def is_ready(self) -> bool:
+        """Returns whether the script is ready. Called repeatedly until it returns True or the probe times out."""
+
+    def feed_stdout(self, line: str) -> None:
+        """Called with each line the script writes to stdout, as it is written."""
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class TcpProbe(ReadinessProbe):
+    """
+    Ready once a TCP connection to `host`:`port` can be opened.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1", timeout: float = 30.0):
+        super().__init__(timeout)
+        self.host = host
+        self.port = port
+
+    def is_ready(self) -> bool:
+        try:
+            with socket.create_connection((self.host, self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def __str__(self):
+        return f"TcpProbe({self.host}:{self.port})"
+
+
+class HttpProbe(ReadinessProbe):
+    """
+    Ready once a GET request to `path` on `host`:`port` returns a 200.
+    """
+
+    def __init__(
+        self, port: int, path: str = "/", host: str = "127.0.0.1", timeout: float = 30.0
+    ):
+        super().__init__(timeout)
+        self.host = host
+        self.port = port
+        self.path = path
+
+    def is_ready(self) -> bool:
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=1)
+        try:
+            conn.request("GET", self.path)
+            return conn.getresponse().status == 200
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            conn.close()
+
+    def __str__(self):
+        return f"HttpProbe(http://{self.host}:{self.port}{self.path})"
+
+
+class StdoutProbe(ReadinessProbe):
+    """
+    Ready once the script writes a line to stdout that matches the regular expression `pattern`.
+    """
+
+    def __init__(self, pattern: str, timeout: float = 30.0):
+        super().__init__(timeout)
+        self.pattern = re.compile(pattern)
+        self.matched = False
+
+    def is_ready(self) -> bool:
+        return self.matched
+
+    def feed_stdout(self, line: str) -> None:
+        if not self.matched and self.pattern.search(line):
+            self.matched = True
+
+    def __str__(self):
+        return f"StdoutProbe({self.pattern.pattern!r})"
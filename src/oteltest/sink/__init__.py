@@ -1,11 +1,25 @@
 import abc
+import asyncio
+import argparse
+import functools
+import multiprocessing
+import queue
+import socket
+import threading
 from concurrent import futures
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
 
 import grpc  # type: ignore
+from oteltest.sink.faults import FaultPolicy
 from oteltest.sink.private import (
+    _AsyncLogsServiceServicer,
+    _AsyncMetricsServiceServicer,
+    _AsyncTraceServiceServicer,
     _LogsServiceServicer,
     _MetricsServiceServicer,
     _TraceServiceServicer,
+    _raw_generic_handlers,
+    _serve_http_connection,
 )
 
 from opentelemetry.proto.collector.logs.v1 import (  # type: ignore
@@ -49,45 +63,363 @@ class RequestHandler(abc.ABC):
     def handle_trace(self, request: ExportTraceServiceRequest, context):
         pass
 
+    def collect(self) -> Any:
+        """
+        Called in each worker process of a MultiProcessGrpcSink when the sink stops. Whatever this returns is sent back
+        to the parent process, so it must be picklable.
+        """
+        return None
+
+
+class AsyncRequestHandler(abc.ABC):
+    """
+    The asyncio variant of RequestHandler, for use with AsyncGrpcSink. The callbacks are coroutines run on the sink's
+    event loop, so they must not block.
+    """
+
+    @abc.abstractmethod
+    async def handle_logs(self, request: ExportLogsServiceRequest, context):
+        pass
+
+    @abc.abstractmethod
+    async def handle_metrics(self, request: ExportMetricsServiceRequest, context):
+        pass
+
+    @abc.abstractmethod
+    async def handle_trace(self, request: ExportTraceServiceRequest, context):
+        pass
+
+
+class RawRequestHandler(abc.ABC):
+    """
+    An alternative to RequestHandler for when you want requests as they came over the wire. Pass an implementation to
+    the GrpcSink constructor and requests won't be deserialized at all; handle_raw() is called with the serialized
+    bytes of each ExportTraceServiceRequest, ExportMetricsServiceRequest, or ExportLogsServiceRequest.
+    """
+
+    @abc.abstractmethod
+    def handle_raw(self, signal: str, data: bytes, context):
+        """`signal` is one of "trace", "metric", or "log"."""
+
 
 class GrpcSink:
     """
     This is an OTel GRPC server to which you can send metrics, traces, and
-    logs. It requires a RequestHandler implementation passed in.
+    logs. It requires a RequestHandler (or RawRequestHandler) implementation passed in.
+    Pass a FaultPolicy as `faults` to slow down or reject requests.
     """
 
     def __init__(
         self,
-        request_handler: RequestHandler,
+        request_handler: Union[RequestHandler, RawRequestHandler],
         max_workers: int = 10,
         address: str = "0.0.0.0:4317",
+        options: Optional[Sequence[Tuple[str, Any]]] = None,
+        faults: Optional[FaultPolicy] = None,
+    ):
+        self.faults = faults
+        self.svr = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=max_workers), options=options
+        )
+        if isinstance(request_handler, RawRequestHandler):
+            self.svr.add_generic_rpc_handlers(
+                _raw_generic_handlers(request_handler.handle_raw, faults)
+            )
+        else:
+            trace_service_pb2_grpc.add_TraceServiceServicer_to_server(
+                _TraceServiceServicer(request_handler.handle_trace, faults), self.svr
+            )
+            metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(
+                _MetricsServiceServicer(request_handler.handle_metrics, faults),
+                self.svr,
+            )
+            logs_service_pb2_grpc.add_LogsServiceServicer_to_server(
+                _LogsServiceServicer(request_handler.handle_logs, faults), self.svr
+            )
+        # the actual bound port, which differs from the requested one when binding to port 0
+        self.port = self.svr.add_insecure_port(address)
+
+    def start(self):
+        """Starts the server. Does not block."""
+        if self.faults is not None:
+            self.faults.start()
+        self.svr.start()
+
+    def wait_for_termination(self):
+        """Blocks until the server stops."""
+        try:
+            self.svr.wait_for_termination()
+        except BaseException:
+            print("terminated")
+
+    def stop(self):
+        """Stops the server immediately."""
+        self.svr.stop(grace=None)
+
+
+class MultiProcessGrpcSink:
+    """
+    Runs `workers` GrpcSinks, each in its own process, all listening on the same port via SO_REUSEPORT, so that the
+    kernel spreads incoming connections across them and protobuf decoding and request handling aren't limited to one
+    core by the GIL.
+
+    Since each worker needs its own handler, this takes a `handler_factory`, a picklable callable (e.g. a
+    RequestHandler class defined at module level) that returns a RequestHandler. When the sink is stopped, each
+    worker's handler's `collect()` is called and `stop()` returns the results, one per worker. Handlers that time
+    requests should take their start time from the factory (e.g. a functools.partial), not from when the worker
+    created them, so that the workers' times are comparable.
+
+    SO_REUSEPORT is only available on Linux and some BSDs.
+    """
+
+    def __init__(
+        self,
+        handler_factory: Callable[[], RequestHandler],
+        workers: int = 2,
+        max_workers: int = 10,
+        address: str = "0.0.0.0:4317",
+        faults: Optional[FaultPolicy] = None,
+    ):
+        host, _, port = address.rpartition(":")
+        # holds the port, so that when binding to port 0 every worker gets the same one. It never listens, so the
+        # kernel only hands connections to the workers.
+        self.reserved = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.reserved.bind((host, int(port)))
+        self.port = self.reserved.getsockname()[1]
+        # spawn rather than fork: grpc doesn't support forking a process that has already used it
+        ctx = multiprocessing.get_context("spawn")
+        if faults is not None:
+            # so that a fault's `times` applies to all the workers together rather than to each
+            faults.share(ctx)
+        self.ready = ctx.Queue()
+        self.results = ctx.Queue()
+        self.stop_event = ctx.Event()
+        self.processes = [
+            ctx.Process(
+                target=_run_sink_worker,
+                args=(
+                    handler_factory,
+                    max_workers,
+                    faults,
+                    f"{host}:{self.port}",
+                    self.ready,
+                    self.results,
+                    self.stop_event,
+                ),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+
+    def start(self):
+        """Starts the worker processes. Blocks until they're all listening."""
+        for process in self.processes:
+            process.start()
+        errors = [self.ready.get() for _ in self.processes]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            self.stop_event.set()
+            for process in self.processes:
+                process.join()
+            self.reserved.close()
+            raise RuntimeError(f"otelsink worker failed to start: {errors[0]}")
+
+    def wait_for_termination(self):
+        """Blocks until the worker processes exit."""
+        try:
+            for process in self.processes:
+                process.join()
+        except BaseException:
+            print("terminated")
+
+    def stop(self, timeout: float = 30.0) -> List[Any]:
+        """
+        Stops the workers and returns what their handlers' `collect()` returned, in no particular order. Waits up to
+        `timeout` seconds for each result.
+        """
+        self.stop_event.set()
+        collected = []
+        # drain the results before joining: a process doesn't exit until what it put on a queue has been read
+        for _ in self.processes:
+            try:
+                collected.append(self.results.get(timeout=timeout))
+            except queue.Empty:
+                break
+        for process in self.processes:
+            process.join(timeout)
+        self.reserved.close()
+        return collected
+
+
+def _run_sink_worker(
+    handler_factory, max_workers, faults, address, ready, results, stop
+):
+    try:
+        handler = handler_factory()
+        sink = GrpcSink(
+            handler,
+            max_workers,
+            address,
+            options=[("grpc.so_reuseport", 1)],
+            faults=faults,
+        )
+        sink.start()
+    except Exception as e:  # noqa: BLE001
+        # the exception itself may not be picklable
+        ready.put(f"{type(e).__name__}: {e}")
+        return
+    ready.put(None)
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    sink.stop()
+    results.put(handler.collect())
+
+
+class AsyncGrpcSink:
+    """
+    An OTel GRPC server like GrpcSink, but built on grpc.aio: requests are served by an asyncio event loop running on a
+    single background thread rather than by a pool of threads, so the number of exports it can handle concurrently
+    is bounded by `max_concurrent_streams` (per connection) rather than by a number of workers. Requests larger than
+    `max_message_length` bytes are rejected.
+
+    Takes an AsyncRequestHandler, or a RequestHandler whose callbacks don't block, as they are called on the event loop.
+    """
+
+    def __init__(
+        self,
+        request_handler: Union[AsyncRequestHandler, RequestHandler],
+        address: str = "0.0.0.0:4317",
+        max_concurrent_streams: int = 1000,
+        max_message_length: int = 32 * 1024 * 1024,
+        faults: Optional[FaultPolicy] = None,
     ):
-        self.svr = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        self.faults = faults
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        options = [
+            ("grpc.max_concurrent_streams", max_concurrent_streams),
+            ("grpc.max_receive_message_length", max_message_length),
+        ]
+        self.svr, self.port = self._call(
+            self._create_server(request_handler, address, options, faults)
+        )
+
+    @staticmethod
+    async def _create_server(request_handler, address, options, faults):
+        # grpc.aio servers must be created on the loop that runs them
+        svr = grpc.aio.server(options=options)
         trace_service_pb2_grpc.add_TraceServiceServicer_to_server(
-            _TraceServiceServicer(request_handler.handle_trace), self.svr
+            _AsyncTraceServiceServicer(request_handler.handle_trace, faults), svr
         )
         metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(
-            _MetricsServiceServicer(request_handler.handle_metrics), self.svr
+            _AsyncMetricsServiceServicer(request_handler.handle_metrics, faults), svr
         )
         logs_service_pb2_grpc.add_LogsServiceServicer_to_server(
-            _LogsServiceServicer(request_handler.handle_logs), self.svr
+            _AsyncLogsServiceServicer(request_handler.handle_logs, faults), svr
         )
-        self.svr.add_insecure_port(address)
+        # the actual bound port, which differs from the requested one when binding to port 0
+        port = svr.add_insecure_port(address)
+        return svr, port
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
 
     def start(self):
         """Starts the server. Does not block."""
-        self.svr.start()
+        if self.faults is not None:
+            self.faults.start()
+        self._call(self.svr.start())
 
     def wait_for_termination(self):
         """Blocks until the server stops."""
         try:
-            self.svr.wait_for_termination()
+            self._call(self.svr.wait_for_termination())
         except BaseException:
             print("terminated")
 
     def stop(self):
         """Stops the server immediately."""
-        self.svr.stop(grace=None)
+        if self.thread.is_alive():
+            self._call(self.svr.stop(grace=None))
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+
+class HttpSink:
+    """
+    This is an OTLP/HTTP server to which you can send metrics, traces, and logs, at /v1/metrics, /v1/traces, and
+    /v1/logs. Requests may be protobuf or JSON encoded, and gzip or deflate compressed. Like GrpcSink, it requires a
+    RequestHandler (or RawRequestHandler) implementation passed in, and optionally takes a FaultPolicy.
+
+    Connections are served by an asyncio event loop running on a single background thread, so no thread is started
+    per request or connection.
+    """
+
+    def __init__(
+        self,
+        request_handler: Union[RequestHandler, RawRequestHandler],
+        address: str = "0.0.0.0:4318",
+        faults: Optional[FaultPolicy] = None,
+    ):
+        self.faults = faults
+        host, port = address.rsplit(":", 1)
+        # bind now rather than in start() so that the port is known, and taken, right away
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, int(port)))
+        self.sock.listen(128)
+        # the actual bound port, which differs from the requested one when binding to port 0
+        self.port = self.sock.getsockname()[1]
+        self.serve = functools.partial(
+            _serve_http_connection,
+            request_handler,
+            isinstance(request_handler, RawRequestHandler),
+            faults,
+        )
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self.serve, sock=self.sock)
+        )
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            # cancel the tasks serving open connections, which exporters tend to keep alive
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def start(self):
+        """Starts the server. Does not block."""
+        if self.faults is not None:
+            self.faults.start()
+        self.thread.start()
+
+    def wait_for_termination(self):
+        """Blocks until the server stops."""
+        try:
+            while self.thread.is_alive():
+                self.thread.join(1)
+        except BaseException:
+            print("terminated")
+
+    def stop(self):
+        """Stops the server immediately."""
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        else:
+            self.sock.close()
 
 
 class PrintHandler(RequestHandler):
@@ -107,9 +439,61 @@ class PrintHandler(RequestHandler):
 
 def run_with_print_handler():
     """
-    Runs otelsink with a PrintHandler.
+    Runs otelsink, both the gRPC and the HTTP server, with a PrintHandler, or, given a control address, as a SinkDaemon.
     """
+    parser = argparse.ArgumentParser(
+        prog="otelsink",
+        description="Receives OTLP metrics, traces, and logs over gRPC and HTTP and prints them, or, with "
+        "--control-address, keeps them in sessions managed over a control API",
+    )
+    parser.add_argument(
+        "--grpc-address",
+        default="0.0.0.0:4317",
+        help="The address the gRPC server listens on. Defaults to 0.0.0.0:4317.",
+    )
+    parser.add_argument(
+        "--http-address",
+        default="0.0.0.0:4318",
+        help="The address the HTTP server listens on. Defaults to 0.0.0.0:4318.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of processes receiving gRPC requests, all on the same port (via SO_REUSEPORT). Defaults to 1.",
+    )
+    parser.add_argument(
+        "--control-address",
+        help="Run as a long-lived daemon that routes telemetry to named sessions, managed with a control API on this "
+        "address, e.g. 127.0.0.1:4319, instead of printing it. See oteltest.sink.daemon.",
+    )
+    args = parser.parse_args()
+
+    if args.control_address:
+        # imported here because it depends on oteltest.telemetry, which depends on this package
+        from oteltest.sink.daemon import SinkDaemon
+
+        if args.workers > 1:
+            parser.error("--workers is not supported with --control-address")
+        daemon = SinkDaemon(args.grpc_address, args.http_address, args.control_address)
+        daemon.start()
+        print(
+            f"otelsink daemon: control API on {args.control_address}, gRPC on port {daemon.grpc_sink.port}, "
+            f"HTTP on port {daemon.http_sink.port}",
+            flush=True,
+        )
+        daemon.wait_for_termination()
+        return
+
     print("starting otelsink with a print handler", flush=True)
-    sink = GrpcSink(PrintHandler())
+    handler = PrintHandler()
+    http_sink = HttpSink(handler, address=args.http_address)
+    http_sink.start()
+    if args.workers > 1:
+        sink = MultiProcessGrpcSink(
+            PrintHandler, args.workers, address=args.grpc_address
+        )
+    else:
+        sink = GrpcSink(handler, address=args.grpc_address)
     sink.start()
     sink.wait_for_termination()
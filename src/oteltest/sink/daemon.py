@@ -0,0 +1,286 @@
+import http.client
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+from typing import Dict, Optional
+
+from oteltest.sink import GrpcSink, HttpSink, RequestHandler
+from oteltest.telemetry import Telemetry
+
+# the header, and the resource attribute, that name the session a request belongs to
+SESSION_HEADER = "x-oteltest-session"
+SESSION_ATTRIBUTE = "oteltest.session"
+# requests that name no session go to this one, if it has been started
+DEFAULT_SESSION = "default"
+DEFAULT_CONTROL_ADDRESS = "127.0.0.1:4319"
+
+
+class Session:
+    """
+    The telemetry received for one named capture session since it started or was last drained. `test_elapsed_ms` of
+    each request is relative to when the session started.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_time_ns = time.time_ns()
+        self.telemetry = Telemetry()
+        self.lock = threading.Lock()
+
+    def add(self, signal: str, request, headers: dict, fault: Optional[dict]):
+        elapsed_ms = round((time.time_ns() - self.start_time_ns) / 1e6)
+        with self.lock:
+            getattr(self.telemetry, f"add_{signal}")(
+                request, headers, elapsed_ms, fault
+            )
+
+    def drain(self) -> Telemetry:
+        """Returns the telemetry received so far, and starts over."""
+        with self.lock:
+            out, self.telemetry = self.telemetry, Telemetry()
+        return out
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "start_time_ns": self.start_time_ns,
+                "metric_requests": len(self.telemetry.metric_requests),
+                "trace_requests": len(self.telemetry.trace_requests),
+                "log_requests": len(self.telemetry.log_requests),
+            }
+
+
+class SessionRouter(RequestHandler):
+    """
+    A RequestHandler that adds each request to a Session: the one named by its x-oteltest-session header or, failing
+    that, by the oteltest.session attribute of its first resource that has one, or otherwise the "default" session.
+    Requests for sessions that haven't been started are counted as unrouted and dropped.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, Session] = {}
+        self.unrouted = {"metric": 0, "trace": 0, "log": 0}
+        self.lock = threading.Lock()
+
+    def start_session(self, name: str) -> Session:
+        with self.lock:
+            if name in self.sessions:
+                raise ValueError(f"session '{name}' already started")
+            session = self.sessions[name] = Session(name)
+        return session
+
+    def drain(self, name: str) -> Telemetry:
+        """Returns the telemetry the session has received since it started or was last drained. Raises KeyError."""
+        with self.lock:
+            session = self.sessions[name]
+        return session.drain()
+
+    def stop_session(self, name: str) -> Telemetry:
+        """Stops the session, returning the telemetry it received since it started or was last drained."""
+        with self.lock:
+            session = self.sessions.pop(name)
+        return session.drain()
+
+    def handle_logs(self, request, context):
+        self._route("log", request, context, request.resource_logs)
+
+    def handle_metrics(self, request, context):
+        self._route("metric", request, context, request.resource_metrics)
+
+    def handle_trace(self, request, context):
+        self._route("trace", request, context, request.resource_spans)
+
+    def _route(self, signal: str, request, context, resource_items):
+        headers = dict(context.invocation_metadata())
+        name = headers.get(SESSION_HEADER) or _session_attribute(resource_items)
+        with self.lock:
+            session = self.sessions.get(name or DEFAULT_SESSION)
+            if session is None:
+                self.unrouted[signal] += 1
+                return
+        session.add(signal, request, headers, getattr(context, "fault", None))
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            sessions = list(self.sessions.values())
+            unrouted = dict(self.unrouted)
+        return {
+            "sessions": {session.name: session.to_dict() for session in sessions},
+            "unrouted": unrouted,
+        }
+
+
+def _session_attribute(resource_items) -> Optional[str]:
+    for item in resource_items:
+        for kv in item.resource.attributes:
+            if kv.key == SESSION_ATTRIBUTE:
+                return kv.value.string_value
+    return None
+
+
+class SinkDaemon:
+    """
+    A long-lived otelsink that many test runs can share: a GrpcSink and an HttpSink routing requests to sessions with
+    a SessionRouter, plus a small HTTP/JSON control API, on `control_address`, to manage the sessions:
+
+    - GET / returns the sink's ports, the sessions and how many requests each has, and the unrouted request counts.
+    - PUT /sessions/<name> starts a session, returning when it started. A 409 if it's already started.
+    - POST /sessions/<name>/drain returns the session's telemetry, as saved by oteltest, and empties it.
+    - DELETE /sessions/<name> stops the session, returning its remaining telemetry.
+
+    The control API has no authentication, so keep `control_address` on localhost. Use SinkDaemonClient to call it.
+    """
+
+    def __init__(
+        self,
+        grpc_address: str = "0.0.0.0:4317",
+        http_address: str = "0.0.0.0:4318",
+        control_address: str = DEFAULT_CONTROL_ADDRESS,
+    ):
+        self.router = SessionRouter()
+        self.grpc_sink = GrpcSink(self.router, address=grpc_address)
+        self.http_sink = HttpSink(self.router, address=http_address)
+        host, port = control_address.rsplit(":", 1)
+        self.control = http.server.ThreadingHTTPServer(
+            (host, int(port)), _control_handler(self)
+        )
+        self.control.daemon_threads = True
+        # the actual bound port, which differs from the requested one when binding to port 0
+        self.control_port = self.control.server_address[1]
+        self.thread = threading.Thread(target=self.control.serve_forever, daemon=True)
+
+    def start(self):
+        """Starts the sinks and the control API. Does not block."""
+        self.grpc_sink.start()
+        self.http_sink.start()
+        self.thread.start()
+
+    def wait_for_termination(self):
+        """Blocks until the daemon stops."""
+        self.grpc_sink.wait_for_termination()
+
+    def stop(self):
+        """Stops the sinks and the control API immediately."""
+        if self.thread.is_alive():
+            self.control.shutdown()
+        self.control.server_close()
+        self.http_sink.stop()
+        self.grpc_sink.stop()
+
+    def info(self) -> dict:
+        out = {"grpc_port": self.grpc_sink.port, "http_port": self.http_sink.port}
+        out.update(self.router.to_dict())
+        return out
+
+
+def _control_handler(daemon: SinkDaemon):
+    router = daemon.router
+
+    class ControlHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            if self.path == "/":
+                self._respond(200, daemon.info())
+            else:
+                self._respond(404, {"error": f"not found: {self.path}"})
+
+        def do_PUT(self):  # noqa: N802
+            name = self._session_name()
+            if name is None:
+                return
+            try:
+                session = router.start_session(name)
+            except ValueError as e:
+                self._respond(409, {"error": str(e)})
+                return
+            self._respond(201, {"start_time_ns": session.start_time_ns})
+
+        def do_POST(self):  # noqa: N802
+            name = self._session_name("/drain")
+            if name is not None:
+                self._respond_with_telemetry(router.drain, name)
+
+        def do_DELETE(self):  # noqa: N802
+            name = self._session_name()
+            if name is not None:
+                self._respond_with_telemetry(router.stop_session, name)
+
+        def _session_name(self, suffix: str = "") -> Optional[str]:
+            prefix = "/sessions/"
+            if (
+                self.path.startswith(prefix)
+                and self.path.endswith(suffix)
+                and len(self.path) > len(prefix) + len(suffix)
+            ):
+                return urllib.parse.unquote(
+                    self.path[len(prefix) : len(self.path) - len(suffix)]
+                )
+            self._respond(404, {"error": f"not found: {self.path}"})
+            return None
+
+        def _respond_with_telemetry(self, get_telemetry, name: str):
+            try:
+                tel = get_telemetry(name)
+            except KeyError:
+                self._respond(404, {"error": f"no session '{name}'"})
+                return
+            self._respond(200, tel.to_dict())
+
+        def _respond(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):  # noqa: A002
+            # requests are routine, and would drown out anything else otelsink prints
+            pass
+
+    return ControlHandler
+
+
+class SinkDaemonClient:
+    """
+    Calls the control API of a SinkDaemon listening on `control_address`. Methods raise RuntimeError if the daemon
+    responds with an error, e.g. for a session that doesn't exist.
+    """
+
+    def __init__(self, control_address: str = DEFAULT_CONTROL_ADDRESS, timeout=30.0):
+        self.host, port = control_address.rsplit(":", 1)
+        self.port = int(port)
+        self.timeout = timeout
+
+    def info(self) -> dict:
+        """Returns the daemon's gRPC and HTTP ports, its sessions, and its unrouted request counts."""
+        return self._call("GET", "/")
+
+    def start_session(self, name: str) -> int:
+        """Starts a session, returning when it started in nanoseconds since the epoch."""
+        return self._call("PUT", _session_path(name))["start_time_ns"]
+
+    def drain(self, name: str) -> Telemetry:
+        """Returns the telemetry the session has received since it started or was last drained."""
+        return Telemetry.from_dict(self._call("POST", _session_path(name) + "/drain"))
+
+    def stop_session(self, name: str) -> Telemetry:
+        """Stops the session, returning the telemetry it received since it started or was last drained."""
+        return Telemetry.from_dict(self._call("DELETE", _session_path(name)))
+
+    def _call(self, method: str, path: str) -> dict:
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path)
+            response = conn.getresponse()
+            body = json.loads(response.read())
+        finally:
+            conn.close()
+        if response.status >= 400:
+            raise RuntimeError(f"otelsink daemon: {body.get('error')}")
+        return body
+
+
+def _session_path(name: str) -> str:
+    return "/sessions/" + urllib.parse.quote(name, safe="")
@@ -0,0 +1,227 @@
+import abc
+import ctypes
+import dataclasses
+import threading
+import time
+from typing import Iterable, List, Optional
+
+UNAVAILABLE = "UNAVAILABLE"
+RESOURCE_EXHAUSTED = "RESOURCE_EXHAUSTED"
+# the OTLP/HTTP status code for each gRPC status a fault can respond with
+HTTP_STATUSES = {UNAVAILABLE: 503, RESOURCE_EXHAUSTED: 429}
+
+
+@dataclasses.dataclass
+class FaultOutcome:
+    """
+    What the faults that apply to a request do to the response: how long to wait before responding, the error status
+    to respond with if any, and otherwise how many items to report as rejected in a partial success response.
+    """
+
+    delay: float = 0.0
+    status: Optional[str] = None
+    message: str = ""
+    retry_after: Optional[float] = None
+    rejected: int = 0
+    faults: List[str] = dataclasses.field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        """What gets recorded on the Request, see Request#fault."""
+        out = {"faults": self.faults, "delay_ms": round(self.delay * 1000)}
+        if self.status:
+            out["status"] = self.status
+        if self.rejected:
+            out["rejected"] = self.rejected
+        return out
+
+
+class Fault(abc.ABC):
+    """
+    Something otelsink does to a request instead of promptly accepting it. A fault applies to requests of the given
+    `signals` ("trace", "metric", and/or "log", all by default) received between `after` and `until` seconds since
+    the sink started, and at most `times` times. The workers of a MultiProcessGrpcSink share the count of how many times
+    a fault has been applied, so `times` applies to all of them together.
+    """
+
+    def __init__(
+        self,
+        signals: Optional[Iterable[str]] = None,
+        after: float = 0.0,
+        until: Optional[float] = None,
+        times: Optional[int] = None,
+    ):
+        self.signals = frozenset(signals) if signals is not None else None
+        self.after = after
+        self.until = until
+        self.times = times
+        # a ctypes int, like the multiprocessing.Value that replaces it when the fault is shared between processes
+        self._applied = ctypes.c_int(0)
+
+    @property
+    def applied(self) -> int:
+        """The number of times the fault has been applied, by all the processes that share it."""
+        return self._applied.value
+
+    def matches(self, signal: str, elapsed: float) -> bool:
+        if self.signals is not None and signal not in self.signals:
+            return False
+        if elapsed < self.after or (self.until is not None and elapsed >= self.until):
+            return False
+        return self.times is None or self.applied < self.times
+
+    @abc.abstractmethod
+    def apply(self, outcome: FaultOutcome, size: int) -> None:
+        """Updates `outcome` for a request of `size` bytes."""
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class Latency(Fault):
+    """
+    Waits `seconds` before responding.
+    """
+
+    def __init__(self, seconds: float, **kwargs):
+        super().__init__(**kwargs)
+        self.seconds = seconds
+
+    def apply(self, outcome, size):  # noqa: ARG002
+        outcome.delay += self.seconds
+
+    def __str__(self):
+        return f"Latency({self.seconds}s)"
+
+
+class BandwidthLimit(Fault):
+    """
+    Delays responding by as long as receiving the request would take at `bytes_per_second`.
+    """
+
+    def __init__(self, bytes_per_second: int, **kwargs):
+        super().__init__(**kwargs)
+        self.bytes_per_second = bytes_per_second
+
+    def apply(self, outcome, size):
+        outcome.delay += size / self.bytes_per_second
+
+    def __str__(self):
+        return f"BandwidthLimit({self.bytes_per_second}B/s)"
+
+
+class ErrorStatus(Fault):
+    """
+    Responds with an error status: `status` is UNAVAILABLE or RESOURCE_EXHAUSTED, both of which OTLP exporters retry.
+    Over HTTP these are a 503 and a 429, with a Retry-After header if `retry_after` is given, and over gRPC a
+    `retry_after` is sent as a google.rpc.RetryInfo in the trailing metadata.
+    """
+
+    def __init__(
+        self,
+        status: str,
+        message: str = "injected by otelsink",
+        retry_after: Optional[float] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        if status not in HTTP_STATUSES:
+            raise ValueError(f"status must be one of {list(HTTP_STATUSES)}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    def apply(self, outcome, size):  # noqa: ARG002
+        outcome.status = self.status
+        outcome.message = self.message
+        outcome.retry_after = self.retry_after
+
+    def __str__(self):
+        return self.status
+
+
+class Unavailable(ErrorStatus):
+    def __init__(self, **kwargs):
+        super().__init__(UNAVAILABLE, **kwargs)
+
+
+class ResourceExhausted(ErrorStatus):
+    def __init__(self, **kwargs):
+        super().__init__(RESOURCE_EXHAUSTED, **kwargs)
+
+
+class PartialSuccess(Fault):
+    """
+    Accepts the request but responds that `rejected` of its spans, data points, or log records were rejected.
+    """
+
+    def __init__(
+        self, rejected: int = 1, message: str = "rejected by otelsink", **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.rejected = rejected
+        self.message = message
+
+    def apply(self, outcome, size):  # noqa: ARG002
+        outcome.rejected += self.rejected
+        outcome.message = outcome.message or self.message
+
+    def __str__(self):
+        return f"PartialSuccess({self.rejected})"
+
+
+class FaultPolicy:
+    """
+    The faults a sink injects. Pass an instance to a sink's constructor, or return one from OtelTest#sink_faults().
+    Every fault that matches a request is applied to it, in order, with an error status taking precedence over a
+    partial success. Times are measured from when the sink starts.
+    """
+
+    def __init__(self, *faults: Fault):
+        self.faults = list(faults)
+        self.start_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.shared = False
+
+    def start(self):
+        self.start_time = time.monotonic()
+
+    def share(self, ctx):
+        """
+        Makes the faults' counts of how many times they've been applied shared between the processes that this policy
+        is passed to as it's started, e.g. the workers of a MultiProcessGrpcSink, so that `times` applies to all of
+        them together. `ctx` is the multiprocessing context the processes are started with.
+        """
+        if self.shared:
+            return
+        self.lock = ctx.Lock()
+        for fault in self.faults:
+            fault._applied = ctx.Value(ctypes.c_int, fault.applied, lock=False)
+        self.shared = True
+
+    def outcome(self, signal: str, size: int) -> Optional[FaultOutcome]:
+        """Returns what to do with a request, or None to accept it as usual."""
+        elapsed = time.monotonic() - self.start_time
+        outcome = FaultOutcome()
+        # faults keep count of how many times they've been applied, and requests arrive on multiple threads
+        with self.lock:
+            for fault in self.faults:
+                if fault.matches(signal, elapsed):
+                    fault._applied.value += 1
+                    fault.apply(outcome, size)
+                    outcome.faults.append(str(fault))
+        return outcome if outcome.faults else None
+
+    def __getstate__(self):
+        # threading locks can't be pickled, unlike the multiprocessing lock of a shared policy
+        state = self.__dict__.copy()
+        if not self.shared:
+            del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "lock" not in state:
+            self.lock = threading.Lock()
+
+    def __str__(self):
+        return ", ".join(str(fault) for fault in self.faults)
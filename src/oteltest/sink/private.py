@@ -1,3 +1,16 @@
+import asyncio
+import base64
+import gzip
+import inspect
+import json
+import re
+import time
+import zlib
+
+import grpc  # type: ignore
+from google.protobuf import any_pb2, duration_pb2, json_format
+from oteltest.sink.faults import HTTP_STATUSES
+
 from opentelemetry.proto.collector.logs.v1 import (  # type: ignore
     logs_service_pb2,
     logs_service_pb2_grpc,
@@ -12,28 +25,485 @@ from opentelemetry.proto.collector.trace.v1 import (  # type: ignore
 )
 
 
+class _FaultContext:
+    """
+    Wraps the context passed to RequestHandler callbacks to add `fault`: what the sink's FaultPolicy did to the request
+    (see FaultOutcome#to_dict), so that handlers can record it.
+    """
+
+    def __init__(self, context, fault: dict):
+        self.context = context
+        self.fault = fault
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+
+def _inject_faults(faults, signal: str, size_of, context):
+    """
+    Returns the FaultOutcome for a request, or None if no faults apply, and the context to pass to the handler.
+    `size_of` returns the size of the request, and is only called if there is a fault policy.
+    """
+    outcome = faults.outcome(signal, size_of()) if faults is not None else None
+    if outcome is None:
+        return None, context
+    return outcome, _FaultContext(context, outcome.to_dict())
+
+
+# the field of each signal's partial success response that counts rejected items
+_REJECTED_FIELDS = {
+    "trace": "rejected_spans",
+    "metric": "rejected_data_points",
+    "log": "rejected_log_records",
+}
+
+
+def _fault_response(outcome, signal: str, context, response):
+    """Applies the error status or partial success of a FaultOutcome, if any, to a grpc response."""
+    if outcome is None:
+        return response
+    if outcome.status:
+        context.set_code(grpc.StatusCode[outcome.status])
+        context.set_details(outcome.message)
+        if outcome.retry_after is not None:
+            context.set_trailing_metadata(
+                _retry_info_metadata(
+                    outcome.status, outcome.message, outcome.retry_after
+                )
+            )
+    elif outcome.rejected:
+        setattr(response.partial_success, _REJECTED_FIELDS[signal], outcome.rejected)
+        response.partial_success.error_message = outcome.message
+    return response
+
+
+def _retry_info_metadata(status: str, message: str, retry_after: float):
+    """
+    Returns the trailing metadata that tells a gRPC client to retry after `retry_after` seconds: a google.rpc.RetryInfo,
+    both on its own, where OTel Python's exporters look for it, and in the details of a google.rpc.Status, where
+    other OTLP exporters do. The messages are encoded by hand, as their classes are in googleapis-common-protos.
+    """
+    seconds = int(retry_after)
+    delay = duration_pb2.Duration(
+        seconds=seconds, nanos=round((retry_after - seconds) * 1e9)
+    )
+    retry_info = _length_delimited(1, delay.SerializeToString())
+    detail = any_pb2.Any(
+        type_url="type.googleapis.com/google.rpc.RetryInfo", value=retry_info
+    )
+    status_details = (
+        _varint((1 << 3) | 0)
+        + _varint(grpc.StatusCode[status].value[0])
+        + _length_delimited(2, message.encode())
+        + _length_delimited(3, detail.SerializeToString())
+    )
+    return (
+        ("google.rpc.retryinfo-bin", retry_info),
+        ("grpc-status-details-bin", status_details),
+    )
+
+
+def _length_delimited(field_number: int, data: bytes) -> bytes:
+    return _varint((field_number << 3) | 2) + _varint(len(data)) + data
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _respond(outcome, signal: str, context, response):
+    if outcome is not None and outcome.delay:
+        time.sleep(outcome.delay)
+    return _fault_response(outcome, signal, context, response)
+
+
 class _LogsServiceServicer(logs_service_pb2_grpc.LogsServiceServicer):
-    def __init__(self, handle_request):
+    def __init__(self, handle_request, faults=None):
         self.handle_request = handle_request
+        self.faults = faults
 
     def Export(self, request, context):  # noqa: N802
+        outcome, context = _inject_faults(self.faults, "log", request.ByteSize, context)
         self.handle_request(request, context)
-        return logs_service_pb2.ExportLogsServiceResponse()
+        return _respond(
+            outcome, "log", context, logs_service_pb2.ExportLogsServiceResponse()
+        )
 
 
 class _TraceServiceServicer(trace_service_pb2_grpc.TraceServiceServicer):
-    def __init__(self, handle_request):
+    def __init__(self, handle_request, faults=None):
         self.handle_request = handle_request
+        self.faults = faults
 
     def Export(self, request, context):  # noqa: N802
+        outcome, context = _inject_faults(
+            self.faults, "trace", request.ByteSize, context
+        )
         self.handle_request(request, context)
-        return trace_service_pb2.ExportTraceServiceResponse()
+        return _respond(
+            outcome, "trace", context, trace_service_pb2.ExportTraceServiceResponse()
+        )
 
 
 class _MetricsServiceServicer(metrics_service_pb2_grpc.MetricsServiceServicer):
-    def __init__(self, handle_request):
+    def __init__(self, handle_request, faults=None):
         self.handle_request = handle_request
+        self.faults = faults
 
     def Export(self, request, context):  # noqa: N802
+        outcome, context = _inject_faults(
+            self.faults, "metric", request.ByteSize, context
+        )
         self.handle_request(request, context)
-        return metrics_service_pb2.ExportMetricsServiceResponse()
+        return _respond(
+            outcome,
+            "metric",
+            context,
+            metrics_service_pb2.ExportMetricsServiceResponse(),
+        )
+
+
+async def _maybe_await(result):
+    # handlers passed to the async servicers may be coroutine functions or plain functions
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _async_respond(outcome, signal: str, context, response):
+    if outcome is not None and outcome.delay:
+        await asyncio.sleep(outcome.delay)
+    return _fault_response(outcome, signal, context, response)
+
+
+class _AsyncLogsServiceServicer(logs_service_pb2_grpc.LogsServiceServicer):
+    def __init__(self, handle_request, faults=None):
+        self.handle_request = handle_request
+        self.faults = faults
+
+    async def Export(self, request, context):  # noqa: N802
+        outcome, context = _inject_faults(self.faults, "log", request.ByteSize, context)
+        await _maybe_await(self.handle_request(request, context))
+        return await _async_respond(
+            outcome, "log", context, logs_service_pb2.ExportLogsServiceResponse()
+        )
+
+
+class _AsyncTraceServiceServicer(trace_service_pb2_grpc.TraceServiceServicer):
+    def __init__(self, handle_request, faults=None):
+        self.handle_request = handle_request
+        self.faults = faults
+
+    async def Export(self, request, context):  # noqa: N802
+        outcome, context = _inject_faults(
+            self.faults, "trace", request.ByteSize, context
+        )
+        await _maybe_await(self.handle_request(request, context))
+        return await _async_respond(
+            outcome, "trace", context, trace_service_pb2.ExportTraceServiceResponse()
+        )
+
+
+class _AsyncMetricsServiceServicer(metrics_service_pb2_grpc.MetricsServiceServicer):
+    def __init__(self, handle_request, faults=None):
+        self.handle_request = handle_request
+        self.faults = faults
+
+    async def Export(self, request, context):  # noqa: N802
+        outcome, context = _inject_faults(
+            self.faults, "metric", request.ByteSize, context
+        )
+        await _maybe_await(self.handle_request(request, context))
+        return await _async_respond(
+            outcome,
+            "metric",
+            context,
+            metrics_service_pb2.ExportMetricsServiceResponse(),
+        )
+
+
+_SERVICES = {
+    "trace": (
+        "opentelemetry.proto.collector.trace.v1.TraceService",
+        trace_service_pb2.ExportTraceServiceResponse,
+    ),
+    "metric": (
+        "opentelemetry.proto.collector.metrics.v1.MetricsService",
+        metrics_service_pb2.ExportMetricsServiceResponse,
+    ),
+    "log": (
+        "opentelemetry.proto.collector.logs.v1.LogsService",
+        logs_service_pb2.ExportLogsServiceResponse,
+    ),
+}
+
+
+def _raw_generic_handlers(handle_raw, faults=None):
+    """
+    Returns grpc handlers for the trace, metrics, and logs services that don't deserialize requests, passing the
+    serialized bytes to `handle_raw(signal, data, context)` instead.
+    """
+    out = []
+    for signal, (service, response_class) in _SERVICES.items():
+
+        def export(data, context, signal=signal, response_class=response_class):
+            outcome, context = _inject_faults(
+                faults, signal, lambda: len(data), context
+            )
+            handle_raw(signal, data, context)
+            return _respond(outcome, signal, context, response_class())
+
+        out.append(
+            grpc.method_handlers_generic_handler(
+                service,
+                {
+                    "Export": grpc.unary_unary_rpc_method_handler(
+                        export,
+                        request_deserializer=None,
+                        response_serializer=response_class.SerializeToString,
+                    )
+                },
+            )
+        )
+    return out
+
+
+# OTLP/HTTP path -> (signal, request class, response class)
+_HTTP_PATHS = {
+    "/v1/traces": (
+        "trace",
+        trace_service_pb2.ExportTraceServiceRequest,
+        trace_service_pb2.ExportTraceServiceResponse,
+    ),
+    "/v1/metrics": (
+        "metric",
+        metrics_service_pb2.ExportMetricsServiceRequest,
+        metrics_service_pb2.ExportMetricsServiceResponse,
+    ),
+    "/v1/logs": (
+        "log",
+        logs_service_pb2.ExportLogsServiceRequest,
+        logs_service_pb2.ExportLogsServiceResponse,
+    ),
+}
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    415: "Unsupported Media Type",
+    429: "Too Many Requests",
+    503: "Service Unavailable",
+}
+
+
+class _HttpContext:
+    """
+    Stands in for the grpc context passed to RequestHandler callbacks, exposing the HTTP request headers as metadata.
+    """
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def invocation_metadata(self):
+        return list(self.headers.items())
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_http_request(reader: asyncio.StreamReader):
+    """
+    Reads one HTTP/1.1 request, returning (method, path, headers, body), or None if the client closed the
+    connection. Header names are lowercased.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b"".join(chunks)
+    else:
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, target.split("?", 1)[0], headers, body
+
+
+def _decode_http_body(headers, body: bytes) -> bytes:
+    encoding = headers.get("content-encoding", "identity").lower()
+    try:
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        if encoding == "deflate":
+            return zlib.decompress(body)
+    except (OSError, zlib.error, EOFError) as ex:
+        raise _HttpError(400, f"could not decompress {encoding} body: {ex}") from ex
+    if encoding == "identity":
+        return body
+    raise _HttpError(415, f"unsupported content-encoding: {encoding}")
+
+
+# OTLP/JSON encodes these as hex strings, where protobuf's JSON mapping expects base64
+_OTLP_JSON_ID_FIELDS = frozenset(("traceId", "spanId", "parentSpanId"))
+# trace ids are 16 bytes and span ids 8; their base64 forms always end in padding, so can't be mistaken for hex
+_HEX_ID = re.compile(r"[0-9a-fA-F]{16}|[0-9a-fA-F]{32}")
+
+
+def _parse_otlp_json(data: bytes, request_class):
+    """Parses an OTLP/JSON request, whose trace and span ids are hex, into a grpc message of `request_class`."""
+    return json_format.ParseDict(
+        _hex_ids_to_base64(json.loads(data)),
+        request_class(),
+        ignore_unknown_fields=True,
+    )
+
+
+def _hex_ids_to_base64(value):
+    if isinstance(value, dict):
+        return {
+            key: (
+                base64.b64encode(bytes.fromhex(item)).decode()
+                if key in _OTLP_JSON_ID_FIELDS
+                and isinstance(item, str)
+                and _HEX_ID.fullmatch(item)
+                else _hex_ids_to_base64(item)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_hex_ids_to_base64(item) for item in value]
+    return value
+
+
+def _handle_http_request(
+    request_handler, raw: bool, method, path, headers, body, faults=None
+):
+    """
+    Dispatches an OTLP/HTTP request to a RequestHandler, or, if `raw`, a RawRequestHandler. Returns (status, content
+    type, response body, FaultOutcome or None). Protobuf requests get protobuf responses and JSON requests get JSON
+    responses.
+    """
+    if path not in _HTTP_PATHS:
+        raise _HttpError(404, f"no such path: {path}")
+    if method != "POST":
+        raise _HttpError(405, f"method not allowed: {method}")
+    signal, request_class, response_class = _HTTP_PATHS[path]
+    data = _decode_http_body(headers, body)
+    is_json = headers.get("content-type", "").startswith("application/json")
+    try:
+        if is_json:
+            pbreq = _parse_otlp_json(data, request_class)
+        elif not raw:
+            pbreq = request_class.FromString(data)
+    except Exception as ex:  # pylint: disable=W0718
+        raise _HttpError(400, f"could not parse request: {ex}") from ex
+    outcome, context = _inject_faults(
+        faults, signal, lambda: len(body), _HttpContext(headers)
+    )
+    if raw:
+        request_handler.handle_raw(
+            signal, pbreq.SerializeToString() if is_json else data, context
+        )
+    else:
+        _dispatch(request_handler, signal, pbreq, context)
+    if outcome is not None and outcome.status:
+        return (
+            HTTP_STATUSES[outcome.status],
+            "text/plain",
+            outcome.message.encode(),
+            outcome,
+        )
+    response = _fault_response(outcome, signal, context, response_class())
+    if is_json:
+        return (
+            200,
+            "application/json",
+            json_format.MessageToJson(response).encode(),
+            outcome,
+        )
+    return 200, "application/x-protobuf", response.SerializeToString(), outcome
+
+
+def _dispatch(request_handler, signal: str, pbreq, context):
+    if signal == "trace":
+        request_handler.handle_trace(pbreq, context)
+    elif signal == "metric":
+        request_handler.handle_metrics(pbreq, context)
+    else:
+        request_handler.handle_logs(pbreq, context)
+
+
+async def _serve_http_connection(request_handler, raw: bool, faults, reader, writer):
+    """
+    Serves OTLP/HTTP requests on one connection until the client closes it. Requests are handled on the event loop,
+    without spawning a thread per request or connection.
+    """
+    try:
+        while True:
+            try:
+                request = await _read_http_request(reader)
+            except (asyncio.IncompleteReadError, ValueError):
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            outcome = None
+            try:
+                status, content_type, response, outcome = _handle_http_request(
+                    request_handler, raw, method, path, headers, body, faults
+                )
+            except _HttpError as ex:
+                status, content_type, response = (
+                    ex.status,
+                    "text/plain",
+                    str(ex).encode(),
+                )
+            extra = ""
+            if outcome is not None:
+                if outcome.delay:
+                    await asyncio.sleep(outcome.delay)
+                if outcome.status and outcome.retry_after is not None:
+                    extra = f"Retry-After: {round(outcome.retry_after)}\r\n"
+            close = headers.get("connection", "").lower() == "close"
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(response)}\r\n"
+                    f"{extra}"
+                    f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+                ).encode("latin-1")
+                + response
+            )
+            await writer.drain()
+            if close:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
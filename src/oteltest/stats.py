@@ -0,0 +1,322 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# a LogHistogram has this many buckets per power of two, so values are recorded to within 1/16 (6.25%)
+SUB_BUCKETS = 16
+_SUB_BITS = SUB_BUCKETS.bit_length() - 1
+
+
+class LogHistogram:
+    """
+    A histogram of non-negative integers with log-linear buckets, in the style of HdrHistogram: values below 16 are
+    counted exactly, and larger values in one of 16 equal width buckets per power of two. Recording a value is a
+    few integer operations and a dict update, and memory use grows with the range of values rather than their count.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    @staticmethod
+    def bucket_index(value: int) -> int:
+        if value < SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - _SUB_BITS - 1
+        return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def bucket_bounds(index: int):
+        """Returns the lowest and highest values counted in the bucket at `index`."""
+        if index < SUB_BUCKETS:
+            return index, index
+        shift = index // SUB_BUCKETS - 1
+        low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value: int):
+        value = max(0, int(value))
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram"):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> int:
+        """
+        Returns the highest value in the bucket that holds the `p`th percentile (0-100), so results are at most 1/16
+        higher than the actual percentile, and never higher than the maximum recorded value.
+        """
+        if not self.count:
+            return 0
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.mean(), 2),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class SignalStats:
+    """
+    Ingest stats for the requests of one signal: totals, and histograms of request size in bytes, items (spans, metric
+    data points, or log records) per request, the time the handler took in microseconds, and the time since the
+    previous request in microseconds.
+
+    The handler time starts once the handler is called. For handlers that receive deserialized requests, that's after
+    the sink has deserialized them, so it leaves out the time spent decoding protobuf.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.items = 0
+        self.size = LogHistogram()
+        self.items_per_request = LogHistogram()
+        self.handler_us = LogHistogram()
+        self.interarrival_us = LogHistogram()
+        self.first_arrival_ns: Optional[int] = None
+        self.last_arrival_ns: Optional[int] = None
+
+    def items_per_second(self) -> float:
+        """Items received per second between the first and the last request."""
+        if (
+            self.first_arrival_ns is None
+            or self.last_arrival_ns == self.first_arrival_ns
+        ):
+            return 0.0
+        return self.items / ((self.last_arrival_ns - self.first_arrival_ns) / 1e9)
+
+    def merge(self, other: "SignalStats"):
+        self.requests += other.requests
+        self.bytes += other.bytes
+        self.items += other.items
+        self.size.merge(other.size)
+        self.items_per_request.merge(other.items_per_request)
+        self.handler_us.merge(other.handler_us)
+        self.interarrival_us.merge(other.interarrival_us)
+        for attr, pick in (("first_arrival_ns", min), ("last_arrival_ns", max)):
+            values = [
+                v for v in (getattr(self, attr), getattr(other, attr)) if v is not None
+            ]
+            setattr(self, attr, pick(values) if values else None)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "items": self.items,
+            "items_per_second": round(self.items_per_second(), 2),
+            "size": self.size.to_dict(),
+            "items_per_request": self.items_per_request.to_dict(),
+            "handler_us": self.handler_us.to_dict(),
+            "interarrival_us": self.interarrival_us.to_dict(),
+        }
+
+
+class IngestStats:
+    """
+    What otelsink received and how long it took to handle it, per signal ("trace", "metric", or "log"), plus how many
+    requests were being handled at once. Available as Telemetry#ingest_stats in on_stop().
+
+    A handler calls `begin()` when a request arrives and `end()` once it's done with it.
+    """
+
+    def __init__(self):
+        self.signals: Dict[str, SignalStats] = {}
+        self.in_flight = 0
+        # the number of requests being handled when each request arrived, including itself
+        self.in_flight_at_arrival = LogHistogram()
+        self.lock = threading.Lock()
+
+    def begin(self, signal: str) -> int:
+        """Records the arrival of a request. Returns the arrival time, to pass to `end()`."""
+        now = time.perf_counter_ns()
+        with self.lock:
+            stats = self.signals.get(signal)
+            if stats is None:
+                stats = self.signals[signal] = SignalStats()
+                stats.first_arrival_ns = now
+            else:
+                stats.interarrival_us.record((now - stats.last_arrival_ns) // 1000)
+            stats.last_arrival_ns = now
+            self.in_flight += 1
+            self.in_flight_at_arrival.record(self.in_flight)
+        return now
+
+    def end(self, signal: str, started: int, pbreq=None, size: Optional[int] = None):
+        """
+        Records that the handler is done with a request that arrived at `started`. Pass the deserialized request as
+        `pbreq`, or, if it wasn't deserialized, its size in bytes as `size`.
+        """
+        elapsed_us = (time.perf_counter_ns() - started) // 1000
+        items = None
+        if pbreq is not None:
+            size = pbreq.ByteSize()
+            items = count_items(signal, pbreq)
+        with self.lock:
+            self.in_flight -= 1
+            stats = self.signals[signal]
+            stats.requests += 1
+            stats.bytes += size
+            stats.size.record(size)
+            stats.handler_us.record(elapsed_us)
+            if items is not None:
+                stats.items += items
+                stats.items_per_request.record(items)
+
+    def merge(self, other: "IngestStats"):
+        for signal, stats in other.signals.items():
+            self.signals.setdefault(signal, SignalStats()).merge(stats)
+        self.in_flight_at_arrival.merge(other.in_flight_at_arrival)
+
+    def max_in_flight(self) -> int:
+        return self.in_flight_at_arrival.max or 0
+
+    def to_dict(self) -> dict:
+        return {
+            "signals": {signal: s.to_dict() for signal, s in self.signals.items()},
+            "in_flight": self.in_flight_at_arrival.to_dict(),
+        }
+
+    def summary(self) -> str:
+        if not self.signals:
+            return "- Ingest: no requests received"
+        lines = ["- Ingest:"]
+        for signal, s in sorted(self.signals.items()):
+            line = f"  {signal}: {s.requests} requests, {s.bytes} bytes"
+            if s.items_per_request.count:
+                line += (
+                    f", {s.items} items ({s.items_per_request.mean():.1f}/request, "
+                    f"{s.items_per_second():.1f}/s)"
+                )
+            line += (
+                f" | size p50/p99 {s.size.percentile(50)}/{s.size.percentile(99)} B"
+                f" | handler p50/p99 {s.handler_us.percentile(50)}/{s.handler_us.percentile(99)} us"
+            )
+            if s.interarrival_us.count:
+                line += f" | inter-arrival p50 {s.interarrival_us.percentile(50)} us"
+            lines.append(line)
+        lines.append(f"  max in-flight: {self.max_in_flight()}")
+        return "\n".join(lines)
+
+    def __getstate__(self):
+        # locks can't be pickled, e.g. when sent back from the workers of a MultiProcessGrpcSink
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+def count_items(signal: str, pbreq) -> int:
+    """Returns the number of spans, metric data points, or log records in a request."""
+    if signal == "trace":
+        return sum(
+            len(ss.spans) for rs in pbreq.resource_spans for ss in rs.scope_spans
+        )
+    if signal == "log":
+        return sum(
+            len(sl.log_records) for rl in pbreq.resource_logs for sl in rl.scope_logs
+        )
+    out = 0
+    for rm in pbreq.resource_metrics:
+        for sm in rm.scope_metrics:
+            for metric in sm.metrics:
+                kind = metric.WhichOneof("data")
+                if kind:
+                    out += len(getattr(metric, kind).data_points)
+    return out
+
+
+class ResourceUsage:
+    """
+    The resources a script's process used, as reported by getrusage(RUSAGE_CHILDREN) once it exited (see
+    RusagePopen), which includes the usage of any child processes it waited for. Wrappers like opentelemetry-instrument
+    exec the script in the same process, so it's counted too. Available as Telemetry#resource_usage in on_stop(), and
+    saved with the telemetry in the json format.
+
+    `peak_rss_kb` is the script process's peak resident set size, in KiB. `rss_samples` are periodic samples of
+    (seconds since the script started, total RSS in KiB of the script process and its descendants), so that memory
+    growth shows up as a curve. Both are only available on Linux.
+    """
+
+    def __init__(
+        self,
+        wall_time_s: float,
+        rusage=None,
+        peak_rss_kb: Optional[int] = None,
+        rss_samples: Optional[List[Tuple[float, int]]] = None,
+    ):
+        self.wall_time_s = wall_time_s
+        self.user_time_s = rusage.ru_utime if rusage else None
+        self.system_time_s = rusage.ru_stime if rusage else None
+        self.voluntary_context_switches = rusage.ru_nvcsw if rusage else None
+        self.involuntary_context_switches = rusage.ru_nivcsw if rusage else None
+        self.minor_page_faults = rusage.ru_minflt if rusage else None
+        self.major_page_faults = rusage.ru_majflt if rusage else None
+        self.peak_rss_kb = peak_rss_kb
+        self.rss_samples = rss_samples or []
+
+    @property
+    def cpu_time_s(self) -> Optional[float]:
+        if self.user_time_s is None:
+            return None
+        return self.user_time_s + self.system_time_s
+
+    def to_dict(self) -> dict:
+        out = dict(self.__dict__)
+        out["rss_samples"] = [list(sample) for sample in self.rss_samples]
+        return out
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ResourceUsage":
+        out = cls(d["wall_time_s"])
+        out.__dict__.update(d)
+        out.rss_samples = [tuple(sample) for sample in d.get("rss_samples", [])]
+        return out
+
+    def summary(self) -> str:
+        line = f"- Resources: {self.wall_time_s:.2f}s wall"
+        if self.user_time_s is not None:
+            line += (
+                f", {self.user_time_s:.2f}s user + {self.system_time_s:.2f}s system CPU"
+                f", {self.voluntary_context_switches}/{self.involuntary_context_switches} (in)voluntary context "
+                f"switches, {self.minor_page_faults}/{self.major_page_faults} minor/major page faults"
+            )
+        if self.peak_rss_kb is not None:
+            line += f", peak RSS {self.peak_rss_kb / 1024:.1f} MiB"
+        return line
@@ -1,8 +1,14 @@
+import array
 import dataclasses
+import itertools
 import json
-from typing import List, Optional, Union
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, List, Optional, Sequence, Union
 
-from google.protobuf.json_format import MessageToDict
+from google.protobuf.json_format import MessageToDict, ParseDict
 from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import (
     ExportLogsServiceRequest,
 )
@@ -13,12 +19,17 @@ from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
     ExportTraceServiceRequest,
 )
 
+from oteltest.stats import IngestStats, ResourceUsage
+
 
 @dataclasses.dataclass
 class Request:
     """
     Wraps a grpc message (metric, trace, or log), http headers that came in with the message, and the time elapsed
-    between the start of the test and the receipt of the message.
+    between the start of the test and the receipt of the message. If otelsink injected a fault into its response to
+    the message (see oteltest.sink.faults), `fault` describes it, e.g. {"faults": ["UNAVAILABLE"], "delay_ms": 0,
+    "status": "UNAVAILABLE"}. `seq` is the order in which the message arrived among all messages of the run, whatever
+    their signal, which unlike `test_elapsed_ms` never ties.
     """
 
     pbreq: Union[
@@ -26,61 +37,273 @@ class Request:
     ]
     headers: dict
     test_elapsed_ms: int
+    fault: Optional[dict] = None
+    # where a request arrived doesn't make it a different request
+    seq: Optional[int] = dataclasses.field(default=None, compare=False)
 
     def get_header(self, name):
         return self.headers.get(name)
 
+    @property
+    def size(self) -> int:
+        """The size in bytes of the serialized grpc message."""
+        return self.pbreq.ByteSize()
+
     def to_json(self):
         return json.dumps(self.to_dict())
 
     def to_dict(self):
-        return {
+        out = {
             "pbreq": MessageToDict(self.pbreq),
             "headers": self.headers,
             "test_elapsed_ms": self.test_elapsed_ms,
         }
+        if self.fault is not None:
+            out["fault"] = self.fault
+        if self.seq is not None:
+            out["seq"] = self.seq
+        return out
+
+    @classmethod
+    def from_dict(cls, d: dict, pbtype) -> "Request":
+        """
+        The inverse of `to_dict`, where `pbtype` is the class of the grpc message, e.g. ExportTraceServiceRequest.
+        """
+        return cls(
+            ParseDict(d["pbreq"], pbtype()),
+            d["headers"],
+            d["test_elapsed_ms"],
+            d.get("fault"),
+            d.get("seq"),
+        )
 
 
 class Telemetry:
     """
     Wraps lists of metric, trace, and log requests sent during a single oteltest script run. An instance is passed in to
-    OtelTest#on_stop().
+    OtelTest#on_stop(). The requests may also be read-only sequences that load requests lazily, e.g. as returned by
+    `read_ndjson`.
+
+    When passed to on_stop(), `ingest_stats` holds the IngestStats of the sink that received the requests: request
+    sizes, items per request, handler latency, and so on. It isn't saved with the telemetry. `resource_usage` holds
+    the ResourceUsage of the script: CPU time, peak RSS, page faults, and so on. `time_to_ready_s` holds how long the
+    script took to pass its readiness probe, if it has one and did. Both are saved, in the json format.
+
+    The `add_*` methods may be called from many threads at once, e.g. by a sink's handler threads, without contending
+    for a lock: each thread appends to buffers of its own, and buffered requests are moved to the request lists, in
+    `seq` order, when the lists are read.
     """
 
+    # class attributes so that pickled instances from before they existed have them too
+    ingest_stats: Optional[IngestStats] = None
+    resource_usage: Optional[ResourceUsage] = None
+    time_to_ready_s: Optional[float] = None
+
     def __init__(
         self,
-        metric_requests: Optional[List[Request]] = None,
-        trace_requests: Optional[List[Request]] = None,
-        log_requests: Optional[List[Request]] = None,
+        metric_requests: Optional[Sequence[Request]] = None,
+        trace_requests: Optional[Sequence[Request]] = None,
+        log_requests: Optional[Sequence[Request]] = None,
     ):
-        self.metric_requests: List[Request] = metric_requests or []
-        self.trace_requests: List[Request] = trace_requests or []
-        self.log_requests: List[Request] = log_requests or []
+        self._requests: Dict[str, Sequence[Request]] = {
+            "metric": metric_requests or [],
+            "trace": trace_requests or [],
+            "log": log_requests or [],
+        }
+        self._init_buffers(sum(len(r) for r in self._requests.values()))
+
+    def _init_buffers(self, next_seq: int):
+        self._local = threading.local()
+        # the buffers of every thread that has added requests, by signal
+        self._buffers: List[Dict[str, List[Request]]] = []
+        self._buffers_lock = threading.Lock()
+        self._seq = itertools.count(next_seq)
+
+    @property
+    def metric_requests(self) -> Sequence[Request]:
+        return self._flush("metric")
+
+    @metric_requests.setter
+    def metric_requests(self, requests: Sequence[Request]):
+        self._set_requests("metric", requests)
+
+    @property
+    def trace_requests(self) -> Sequence[Request]:
+        return self._flush("trace")
+
+    @trace_requests.setter
+    def trace_requests(self, requests: Sequence[Request]):
+        self._set_requests("trace", requests)
+
+    @property
+    def log_requests(self) -> Sequence[Request]:
+        return self._flush("log")
+
+    @log_requests.setter
+    def log_requests(self, requests: Sequence[Request]):
+        self._set_requests("log", requests)
+
+    def _set_requests(self, signal: str, requests: Sequence[Request]):
+        self._requests[signal] = requests
+        # the index refers to the requests it indexed by position in the replaced list
+        self._index = None
 
     def add_metric(
-        self, pbreq: ExportMetricsServiceRequest, headers: dict, test_elapsed_ms: int
+        self,
+        pbreq: ExportMetricsServiceRequest,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
     ):
-        self.metric_requests.append(Request(pbreq, headers, test_elapsed_ms))
+        self._add("metric", Request(pbreq, headers, test_elapsed_ms, fault))
 
     def add_trace(
-        self, pbreq: ExportTraceServiceRequest, headers: dict, test_elapsed_ms: int
+        self,
+        pbreq: ExportTraceServiceRequest,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
     ):
-        self.trace_requests.append(Request(pbreq, headers, test_elapsed_ms))
+        self._add("trace", Request(pbreq, headers, test_elapsed_ms, fault))
 
     def add_log(
-        self, pbreq: ExportLogsServiceRequest, headers: dict, test_elapsed_ms: int
+        self,
+        pbreq: ExportLogsServiceRequest,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
     ):
-        self.log_requests.append(Request(pbreq, headers, test_elapsed_ms))
-
-    def get_metric_requests(self) -> List[Request]:
+        self._add("log", Request(pbreq, headers, test_elapsed_ms, fault))
+
+    def _add(self, signal: str, req: Request):
+        # next() on an itertools.count is atomic, as is appending to a list
+        req.seq = next(self._seq)
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            # the only time a thread takes the lock to add a request
+            buffers = self._local.buffers = {"metric": [], "trace": [], "log": []}
+            with self._buffers_lock:
+                self._buffers.append(buffers)
+        buffers[signal].append(req)
+
+    def _flush(self, signal: str) -> Sequence[Request]:
+        """Moves buffered requests of `signal` to its request list, keeping the list in `seq` order."""
+        requests = self._requests[signal]
+        if not self._buffers:
+            return requests
+        pending: List[Request] = []
+        with self._buffers_lock:
+            for buffers in self._buffers:
+                buffer = buffers[signal]
+                # the owning thread may append meanwhile, but only ever to the end
+                n = len(buffer)
+                if n:
+                    pending.extend(buffer[:n])
+                    del buffer[:n]
+        if not pending:
+            return requests
+        pending.sort(key=_seq_key)
+        if not isinstance(requests, list):
+            requests = self._requests[signal] = list(requests)
+        # a request is numbered just before it's buffered, so one may be moved after a request numbered later
+        first = _seq_key(pending[0])
+        settled = len(requests)
+        while settled and _seq_key(requests[settled - 1]) > first:
+            settled -= 1
+        out_of_order = settled < len(requests)
+        requests.extend(pending)
+        if out_of_order:
+            requests.sort(key=_seq_key)
+            # the index refers to requests by position, and those from `settled` on have moved
+            index = getattr(self, "_index", None)
+            if index is not None and index._indexed[signal] > settled:
+                self._index = None
+        return requests
+
+    def get_metric_requests(self) -> Sequence[Request]:
         return self.metric_requests
 
-    def get_trace_requests(self) -> List[Request]:
+    def get_trace_requests(self) -> Sequence[Request]:
         return self.trace_requests
 
-    def get_logs_requests(self) -> List[Request]:
+    def get_logs_requests(self) -> Sequence[Request]:
         return self.log_requests
 
+    @classmethod
+    def merge(cls, *telemetries: "Telemetry") -> "Telemetry":
+        """
+        Combines the requests of several Telemetry instances, e.g. those received by the workers of a
+        MultiProcessGrpcSink, into a new one. Requests are ordered by when they were received.
+        """
+
+        def merged(requests_of):
+            requests = [req for tel in telemetries for req in requests_of(tel)]
+            return sorted(
+                requests, key=lambda req: (req.test_elapsed_ms, _seq_key(req))
+            )
+
+        out = cls(
+            merged(cls.get_metric_requests),
+            merged(cls.get_trace_requests),
+            merged(cls.get_logs_requests),
+        )
+        # each instance numbered its requests separately, so they're renumbered in the order they were received
+        for seq, req in enumerate(
+            sorted(
+                [*out.metric_requests, *out.trace_requests, *out.log_requests],
+                key=lambda req: (req.test_elapsed_ms, _seq_key(req)),
+            )
+        ):
+            req.seq = seq
+        for tel in telemetries:
+            if tel.ingest_stats is not None:
+                if out.ingest_stats is None:
+                    out.ingest_stats = IngestStats()
+                out.ingest_stats.merge(tel.ingest_stats)
+        return out
+
+    @property
+    def index(self) -> "TelemetryIndex":
+        """
+        A TelemetryIndex of this telemetry's spans, metrics, and logs. It's built on first access and brought up to
+        date with any requests added since on each subsequent access, so repeated queries are cheap.
+        """
+        # flushed first, as flushing requests that arrived out of order may invalidate the index
+        for signal in self._requests:
+            self._flush(signal)
+        # getattr because pickled instances from before the index existed don't have the attribute
+        index = getattr(self, "_index", None)
+        if index is None:
+            index = self._index = TelemetryIndex()
+        index.update(self)
+        return index
+
+    def __getstate__(self):
+        # thread locals and locks can't be pickled, e.g. when sent back from the workers of a MultiProcessGrpcSink
+        state = self.__dict__.copy()
+        state["_requests"] = {
+            signal: self._flush(signal) for signal in ("metric", "trace", "log")
+        }
+        state["_next_seq"] = next(self._seq)
+        for attr in ("_local", "_buffers", "_buffers_lock", "_seq"):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        # instances pickled before requests were buffered have plain request list attributes
+        requests = {
+            signal: state.pop(f"{signal}_requests")
+            for signal in ("metric", "trace", "log")
+            if f"{signal}_requests" in state
+        }
+        if requests:
+            state["_requests"] = requests
+        next_seq = state.pop(
+            "_next_seq", sum(len(r) for r in state["_requests"].values())
+        )
+        self.__dict__.update(state)
+        self._init_buffers(next_seq)
+
     def __str__(self):
         return self.to_json()
 
@@ -88,49 +311,501 @@ class Telemetry:
         return json.dumps(self.to_dict(), indent=2)
 
     def to_dict(self):
-        return {
+        out = {
             "metric_requests": [req.to_dict() for req in self.metric_requests],
             "trace_requests": [req.to_dict() for req in self.trace_requests],
             "log_requests": [req.to_dict() for req in self.log_requests],
         }
+        if self.resource_usage is not None:
+            out["resource_usage"] = self.resource_usage.to_dict()
+        if self.time_to_ready_s is not None:
+            out["time_to_ready_s"] = self.time_to_ready_s
+        return out
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Telemetry":
+        """The inverse of `to_dict`, e.g. for reading back a saved json file."""
+        out = cls(
+            [
+                Request.from_dict(req, ExportMetricsServiceRequest)
+                for req in d["metric_requests"]
+            ],
+            [
+                Request.from_dict(req, ExportTraceServiceRequest)
+                for req in d["trace_requests"]
+            ],
+            [
+                Request.from_dict(req, ExportLogsServiceRequest)
+                for req in d["log_requests"]
+            ],
+        )
+        if "resource_usage" in d:
+            out.resource_usage = ResourceUsage.from_dict(d["resource_usage"])
+        out.time_to_ready_s = d.get("time_to_ready_s")
+        return out
+
+
+def _seq_key(req: Request) -> int:
+    # requests that weren't numbered, e.g. read from files written before seq existed, go first
+    return -1 if req.seq is None else req.seq
+
+
+def _key(id_or_hex: Union[bytes, str]) -> bytes:
+    return bytes.fromhex(id_or_hex) if isinstance(id_or_hex, str) else id_or_hex
+
+
+class TelemetryIndex:
+    """
+    Flattens the spans, metrics, and log records of a Telemetry's requests and indexes them, so that lookups don't
+    walk the nested resource/scope structure of every request. Spans are indexed by name, trace id, span id, and
+    parent span id, metrics by name, and log records by severity number. Ids may be passed as bytes or hex strings.
+    Results are lists of the grpc messages, in the order they were received.
+
+    Don't create one directly, use Telemetry#index, which keeps the index up to date as requests are added.
+    """
+
+    def __init__(self):
+        self.spans: list = []
+        self.metrics: list = []
+        self.logs: list = []
+        self._spans_by_name: dict = {}
+        self._spans_by_trace_id: dict = {}
+        self._spans_by_parent_id: dict = {}
+        self._span_by_id: dict = {}
+        self._metrics_by_name: dict = {}
+        self._logs_by_severity: dict = {}
+        # (resource, scope) by id() of each indexed span, metric, and log record
+        self._scopes: dict = {}
+        # (item, attribute dict) by id() of each span, metric data point, log record, or resource
+        self._attributes: dict = {}
+        # the number of requests of each signal that have been indexed
+        self._indexed = {"trace": 0, "metric": 0, "log": 0}
+
+    def update(self, tel: "Telemetry"):
+        """Indexes the requests that have been added to `tel` since the last update."""
+        for req in self._unindexed(tel.trace_requests, "trace"):
+            for rs in req.pbreq.resource_spans:
+                for ss in rs.scope_spans:
+                    for span in ss.spans:
+                        self._add_span(span, rs.resource, ss.scope)
+        for req in self._unindexed(tel.metric_requests, "metric"):
+            for rm in req.pbreq.resource_metrics:
+                for sm in rm.scope_metrics:
+                    for metric in sm.metrics:
+                        self.metrics.append(metric)
+                        self._metrics_by_name.setdefault(metric.name, []).append(metric)
+                        self._scopes[id(metric)] = (rm.resource, sm.scope)
+        for req in self._unindexed(tel.log_requests, "log"):
+            for rl in req.pbreq.resource_logs:
+                for sl in rl.scope_logs:
+                    for record in sl.log_records:
+                        self.logs.append(record)
+                        self._logs_by_severity.setdefault(
+                            record.severity_number, []
+                        ).append(record)
+                        self._scopes[id(record)] = (rl.resource, sl.scope)
+
+    def _unindexed(self, requests: Sequence[Request], signal: str):
+        start = self._indexed[signal]
+        end = len(requests)
+        self._indexed[signal] = end
+        for i in range(start, end):
+            yield requests[i]
+
+    def _add_span(self, span, resource, scope):
+        self.spans.append(span)
+        self._spans_by_name.setdefault(span.name, []).append(span)
+        self._spans_by_trace_id.setdefault(span.trace_id, []).append(span)
+        self._spans_by_parent_id.setdefault(span.parent_span_id, []).append(span)
+        self._span_by_id[span.span_id] = span
+        self._scopes[id(span)] = (resource, scope)
+
+    def span_names(self) -> set:
+        return set(self._spans_by_name)
+
+    def spans_by_name(self, name: str) -> list:
+        return self._spans_by_name.get(name, [])
+
+    def spans_by_trace_id(self, trace_id: Union[bytes, str]) -> list:
+        return self._spans_by_trace_id.get(_key(trace_id), [])
+
+    def span_by_id(self, span_id: Union[bytes, str]):
+        return self._span_by_id.get(_key(span_id))
+
+    def children(self, parent_span_id: Union[bytes, str]) -> list:
+        """Returns the spans whose parent is the span with the given id."""
+        return self._spans_by_parent_id.get(_key(parent_span_id), [])
+
+    def root_spans(self) -> list:
+        return self._spans_by_parent_id.get(b"", [])
+
+    def trace_ids(self) -> set:
+        return set(self._spans_by_trace_id)
+
+    def metric_names(self) -> set:
+        return set(self._metrics_by_name)
+
+    def metrics_by_name(self, name: str) -> list:
+        return self._metrics_by_name.get(name, [])
+
+    def logs_by_severity(self, severity_number: int) -> list:
+        return self._logs_by_severity.get(severity_number, [])
+
+    def resource(self, item):
+        """Returns the Resource of an indexed span, metric, or log record."""
+        return self._scopes[id(item)][0]
+
+    def scope(self, item):
+        """Returns the InstrumentationScope of an indexed span, metric, or log record."""
+        return self._scopes[id(item)][1]
+
+    def attributes(self, item) -> dict:
+        """
+        Returns the attributes of a span, metric data point, log record, or resource as a dict of Python values,
+        converting them on first access.
+        """
+        key = id(item)
+        entry = self._attributes.get(key)
+        if entry is None:
+            # the item is kept alongside its attributes so that its id can't be reused
+            entry = self._attributes[key] = (item, attributes_to_dict(item.attributes))
+        return entry[1]
+
+
+def attributes_to_dict(attributes) -> dict:
+    """Converts a repeated KeyValue field to a dict of Python values."""
+    return {kv.key: any_value_to_python(kv.value) for kv in attributes}
+
+
+def any_value_to_python(value):
+    kind = value.WhichOneof("value")
+    if kind is None:
+        return None
+    if kind == "array_value":
+        return [any_value_to_python(v) for v in value.array_value.values]
+    if kind == "kvlist_value":
+        return attributes_to_dict(value.kvlist_value.values)
+    return getattr(value, kind)
+
+
+PBTYPES = {
+    "metric": ExportMetricsServiceRequest,
+    "trace": ExportTraceServiceRequest,
+    "log": ExportLogsServiceRequest,
+}
+
+
+class NdjsonWriter:
+    """
+    Writes requests to a file as they arrive, one JSON object per line, instead of accumulating them in memory.
+    Each line is a Request's `to_dict()` plus a "signal" key: "metric", "trace", or "log". Has the same `add_*`
+    methods as Telemetry so that it can be used in its place. Use `read_ndjson` to read the file back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")  # noqa: SIM115
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    def add_metric(
+        self,
+        pbreq: ExportMetricsServiceRequest,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
+    ):
+        self.write("metric", Request(pbreq, headers, test_elapsed_ms, fault))
+
+    def add_trace(
+        self,
+        pbreq: ExportTraceServiceRequest,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
+    ):
+        self.write("trace", Request(pbreq, headers, test_elapsed_ms, fault))
+
+    def add_log(
+        self,
+        pbreq: ExportLogsServiceRequest,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
+    ):
+        self.write("log", Request(pbreq, headers, test_elapsed_ms, fault))
+
+    def write(self, signal: str, req: Request):
+        # "signal" goes first so that readers can tell signals apart without parsing the whole line
+        line = json.dumps({"signal": signal, **req.to_dict()})
+        with self.lock:
+            # numbered as written, so that lines are in seq order; appended to the serialized line rather than
+            # serializing while holding the lock
+            req.seq = self.seq
+            self.seq += 1
+            self.file.write(f'{line[:-1]}, "seq": {req.seq}}}\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class _NdjsonRequests(Sequence):
+    """
+    A read-only sequence of the requests of one signal in an NDJSON telemetry file. Only the byte offsets of the lines
+    are kept in memory, and a request is parsed each time it is accessed.
+    """
+
+    def __init__(self, path: str, pbtype, offsets: array.array):
+        self.path = path
+        self.pbtype = pbtype
+        self.offsets = offsets
+        self.file = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if self.file is None:
+            self.file = open(self.path, "rb")  # noqa: SIM115
+        self.file.seek(self.offsets[index])
+        return Request.from_dict(json.loads(self.file.readline()), self.pbtype)
+
+    def __getstate__(self):
+        return {**self.__dict__, "file": None}
+
+
+def read_ndjson(path: str) -> "Telemetry":
+    """
+    Returns a Telemetry backed by an NDJSON file written by NdjsonWriter. The file is scanned once for line offsets,
+    and requests are parsed lazily, as they are accessed, so memory use doesn't grow with the size of the file.
+    """
+    offsets = {signal: array.array("q") for signal in PBTYPES}
+    prefixes = {
+        json.dumps({"signal": signal})[:-1].encode(): signal for signal in PBTYPES
+    }
+    offset = 0
+    with open(path, "rb") as file:
+        for line in file:
+            for prefix, signal in prefixes.items():
+                if line.startswith(prefix):
+                    offsets[signal].append(offset)
+                    break
+            else:
+                if line.strip():
+                    offsets[json.loads(line)["signal"]].append(offset)
+            offset += len(line)
+    requests = {
+        signal: _NdjsonRequests(path, PBTYPES[signal], offsets[signal])
+        for signal in PBTYPES
+    }
+    return Telemetry(
+        metric_requests=requests["metric"],
+        trace_requests=requests["trace"],
+        log_requests=requests["log"],
+    )
+
+
+class LazyRequest(Request):
+    """
+    A Request backed by a region of a capture file (see CaptureWriter). The grpc message, headers, and fault are only
+    deserialized the first time they are accessed. In captures from before faults were recorded, the JSON between
+    `headers_start` and `pb_start` is just the headers, and `metadata` is False.
+    """
+
+    def __init__(
+        self,
+        pbtype,
+        buf,
+        headers_start: int,
+        pb_start: int,
+        end: int,
+        test_elapsed_ms,
+        seq: Optional[int] = None,
+        metadata: bool = True,
+    ):  # pylint: disable=W0231
+        self.pbtype = pbtype
+        self.buf = buf
+        self.headers_start = headers_start
+        self.pb_start = pb_start
+        self.end = end
+        self.test_elapsed_ms = test_elapsed_ms
+        self.seq = seq
+        self.metadata = metadata
+        self._pbreq = None
+        self._headers = None
+        self._fault = None
+
+    @property
+    def pbreq(self):
+        if self._pbreq is None:
+            self._pbreq = self.pbtype.FromString(self.buf[self.pb_start : self.end])
+        return self._pbreq
+
+    def parse(self):
+        """
+        Deserializes the grpc message without keeping it, so that a pass over every request of a large capture doesn't
+        end up holding all of them in memory.
+        """
+        if self._pbreq is not None:
+            return self._pbreq
+        return self.pbtype.FromString(self.buf[self.pb_start : self.end])
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._load_metadata()
+        return self._headers
+
+    @property
+    def fault(self) -> Optional[dict]:
+        if self._headers is None:
+            self._load_metadata()
+        return self._fault
+
+    def _load_metadata(self):
+        loaded = json.loads(self.buf[self.headers_start : self.pb_start])
+        if self.metadata:
+            self._fault = loaded.get("fault")
+            loaded = loaded["headers"]
+        self._headers = loaded
+
+    @property
+    def size(self) -> int:
+        """The size in bytes of the serialized grpc message."""
+        return self.end - self.pb_start
+
+
+CAPTURE_MAGIC = b"OTCAP002"
+# captures from before faults were recorded, whose records have just the headers where they now have metadata
+CAPTURE_MAGIC_V1 = b"OTCAP001"
+# per record: signal, length of metadata json, length of serialized grpc message, test_elapsed_ms
+CAPTURE_RECORD = struct.Struct("<BIIq")
+CAPTURE_SIGNALS = ("metric", "trace", "log")
+
+
+class CaptureWriter:
+    """
+    Writes requests, as received over the wire, to a binary capture file: CAPTURE_MAGIC followed by one record per
+    request, each a CAPTURE_RECORD followed by the request's metadata as JSON, {"headers": {...}} plus the "fault"
+    otelsink injected into its response, if any (see Request#fault), and its serialized grpc message. Use
+    `read_capture` to read the file back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")  # noqa: SIM115
+        self.file.write(CAPTURE_MAGIC)
+        self.lock = threading.Lock()
+
+    def add_raw(
+        self,
+        signal: str,
+        data: bytes,
+        headers: dict,
+        test_elapsed_ms: int,
+        fault: Optional[dict] = None,
+    ):
+        metadata = {"headers": headers}
+        if fault is not None:
+            metadata["fault"] = fault
+        metadata_json = json.dumps(metadata).encode()
+        record = CAPTURE_RECORD.pack(
+            CAPTURE_SIGNALS.index(signal),
+            len(metadata_json),
+            len(data),
+            test_elapsed_ms,
+        )
+        with self.lock:
+            self.file.write(record)
+            self.file.write(metadata_json)
+            self.file.write(data)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_capture(path: str) -> "Telemetry":
+    """
+    Returns a Telemetry backed by a memory-mapped capture file written by CaptureWriter. Loading only reads the record
+    headers; each request's grpc message is deserialized the first time it is accessed.
+    """
+    requests: dict = {signal: [] for signal in CAPTURE_SIGNALS}
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size <= len(CAPTURE_MAGIC):
+            return Telemetry()
+        buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic = buf[: len(CAPTURE_MAGIC)]
+    if magic not in (CAPTURE_MAGIC, CAPTURE_MAGIC_V1):
+        raise ValueError(f"{path} is not an oteltest capture file")
+    offset = len(CAPTURE_MAGIC)
+    # records are written in the order requests arrive, so their number is their seq
+    seq = 0
+    # a truncated last record (e.g. if the writer was interrupted) is ignored
+    while offset + CAPTURE_RECORD.size <= len(buf):
+        signal_index, headers_len, pb_len, test_elapsed_ms = CAPTURE_RECORD.unpack_from(
+            buf, offset
+        )
+        headers_start = offset + CAPTURE_RECORD.size
+        pb_start = headers_start + headers_len
+        end = pb_start + pb_len
+        if end > len(buf):
+            break
+        signal = CAPTURE_SIGNALS[signal_index]
+        requests[signal].append(
+            LazyRequest(
+                PBTYPES[signal],
+                buf,
+                headers_start,
+                pb_start,
+                end,
+                test_elapsed_ms,
+                seq,
+                metadata=magic == CAPTURE_MAGIC,
+            )
+        )
+        seq += 1
+        offset = end
+    return Telemetry(
+        metric_requests=requests["metric"],
+        trace_requests=requests["trace"],
+        log_requests=requests["log"],
+    )
+
+
+def read_telemetry(path: str) -> "Telemetry":
+    """
+    Reads back a telemetry file saved by oteltest in any format, going by its extension: .json, .ndjson, or .otcap.
+    """
+    if path.endswith(".ndjson"):
+        return read_ndjson(path)
+    if path.endswith(".otcap"):
+        return read_capture(path)
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as file:
+            return Telemetry.from_dict(json.load(file))
+    raise ValueError(f"{path} is not an oteltest telemetry file")
 
 
 def num_metrics(telemetry) -> int:
-    out = 0
-    for req in telemetry.metric_requests:
-        for rm in req.pbreq.resource_metrics:
-            for sm in rm.scope_metrics:
-                out += len(sm.metrics)
-    return out
+    return len(telemetry.index.metrics)
 
 
 def metric_names(telemetry) -> set:
-    out = set()
-    for req in telemetry.metric_requests:
-        for rm in req.pbreq.resource_metrics:
-            for sm in rm.scope_metrics:
-                for metric in sm.metrics:
-                    out.add(metric.name)
-    return out
+    return telemetry.index.metric_names()
 
 
 def num_spans(telemetry) -> int:
-    out = 0
-    for req in telemetry.trace_requests:
-        for rs in req.pbreq.resource_spans:
-            for ss in rs.scope_spans:
-                out += len(ss.spans)
-    return out
+    return len(telemetry.index.spans)
 
 
 def span_names(telemetry) -> set:
-    out = set()
-    for req in telemetry.trace_requests:
-        for rs in req.pbreq.resource_spans:
-            for ss in rs.scope_spans:
-                for span in ss.spans:
-                    out.add(span.name)
-    return out
+    return telemetry.index.span_names()
 
 
 def has_trace_header(telemetry, key, expected) -> bool:
@@ -163,3 +838,14 @@ def span_attribute_by_name(span, attr_name) -> Optional[str]:
             if attr.value.HasField("string_value"):
                 return attr.value.string_value
     return None
+
+
+def export_attempts(requests: Sequence[Request]) -> List[List[Request]]:
+    """
+    Groups requests with identical contents, in the order they were first received, so that each group is one export
+    and any retries of it, e.g. after otelsink responded to the first attempt with an injected fault.
+    """
+    attempts: Dict[bytes, List[Request]] = {}
+    for req in requests:
+        attempts.setdefault(req.pbreq.SerializeToString(), []).append(req)
+    return list(attempts.values())
@@ -0,0 +1,212 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from oteltest.telemetry import Telemetry
+
+
+class SpanNode:
+    """
+    A span in a Trace, linked to its parent and children. Times are in nanoseconds since the epoch, and durations in
+    nanoseconds.
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self.parent: Optional["SpanNode"] = None
+        self.children: List["SpanNode"] = []
+
+    @property
+    def name(self) -> str:
+        return self.span.name
+
+    @property
+    def span_id(self) -> bytes:
+        return self.span.span_id
+
+    @property
+    def start(self) -> int:
+        return self.span.start_time_unix_nano
+
+    @property
+    def end(self) -> int:
+        # a span that ends before it starts, e.g. because of clock adjustments, is taken to have taken no time
+        return max(self.span.end_time_unix_nano, self.span.start_time_unix_nano)
+
+    @property
+    def duration_ns(self) -> int:
+        return self.end - self.start
+
+    @property
+    def self_time_ns(self) -> int:
+        """
+        The time during which none of the span's children were running, counting only the parts of the children that
+        fall within the span, e.g. the time a server span spent outside of its database calls.
+        """
+        covered = 0
+        cursor = self.start
+        for child in sorted(self.children, key=lambda c: c.start):
+            start = max(child.start, cursor)
+            end = min(child.end, self.end)
+            if end > start:
+                covered += end - start
+                cursor = end
+        return self.duration_ns - covered
+
+    def walk(self) -> Iterable["SpanNode"]:
+        """Yields this node and its descendants, depth first, children in the order they started."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(sorted(node.children, key=lambda c: c.start, reverse=True))
+
+    def __repr__(self):
+        return f"SpanNode({self.name!r}, {self.span_id.hex()})"
+
+
+class Trace:
+    """
+    The spans received for one trace id, assembled into trees by parent span id:
+
+    - `roots` are the spans without a parent.
+    - `orphans` are the spans whose parent wasn't received, e.g. because the service that created the parent isn't
+      instrumented or its exporter didn't flush, and `missing_parent_ids` the ids of those parents. Each orphan heads
+      a tree of its own.
+    - `duplicates` counts spans received more than once, e.g. because an export was retried. Only the first is kept.
+    """
+
+    def __init__(self, trace_id: bytes):
+        self.trace_id = trace_id
+        self.nodes: Dict[bytes, SpanNode] = {}
+        self.duplicates = 0
+        # children by the id of a parent that hasn't been received (yet)
+        self._waiting: Dict[bytes, List[SpanNode]] = {}
+        self._roots: List[SpanNode] = []
+
+    def add(self, span):
+        if span.span_id in self.nodes:
+            self.duplicates += 1
+            return
+        node = SpanNode(span)
+        parent_id = span.parent_span_id
+        if not parent_id:
+            self._roots.append(node)
+        elif parent_id in self.nodes:
+            self._link(self.nodes[parent_id], node)
+        else:
+            self._waiting.setdefault(parent_id, []).append(node)
+        self.nodes[span.span_id] = node
+        waiting = self._waiting.pop(span.span_id, None)
+        if not waiting:
+            return
+        # spans that (through others) name each other as parents are left as orphans, rather than making a cycle
+        ancestors = set()
+        ancestor: Optional[SpanNode] = node
+        while ancestor is not None:
+            ancestors.add(id(ancestor))
+            ancestor = ancestor.parent
+        for child in waiting:
+            if id(child) in ancestors:
+                self._waiting.setdefault(span.span_id, []).append(child)
+            else:
+                self._link(node, child)
+
+    @staticmethod
+    def _link(parent: SpanNode, child: SpanNode):
+        child.parent = parent
+        parent.children.append(child)
+
+    @property
+    def roots(self) -> List[SpanNode]:
+        return self._roots
+
+    @property
+    def orphans(self) -> List[SpanNode]:
+        return [node for nodes in self._waiting.values() for node in nodes]
+
+    @property
+    def missing_parent_ids(self) -> Set[bytes]:
+        return set(self._waiting)
+
+    def tops(self) -> List[SpanNode]:
+        """The roots and the orphans, i.e. the spans at the top of each tree."""
+        return self._roots + self.orphans
+
+    def spans_by_name(self, name: str) -> List[SpanNode]:
+        return [node for node in self.nodes.values() if node.name == name]
+
+    @property
+    def start(self) -> int:
+        return min(node.start for node in self.nodes.values())
+
+    @property
+    def end(self) -> int:
+        return max(node.end for node in self.nodes.values())
+
+    @property
+    def duration_ns(self) -> int:
+        """The time from the first span starting to the last span ending."""
+        return self.end - self.start
+
+    def critical_path(self) -> List[Tuple[SpanNode, int]]:
+        """
+        Returns the critical path of the tree that ends last: the spans that, had they been faster, would have made the
+        trace faster, each with the number of nanoseconds of the path spent in the span itself rather than in one of
+        its children on the path. The nanoseconds add up to the duration of the top span.
+
+        Works back from the end of the top span: the child that finished last is on the path, then the child that
+        finished last before that child started, and so on, recursively. Time not spent in any such child is the
+        span's own.
+        """
+        tops = self.tops()
+        if not tops:
+            return []
+        top = max(tops, key=lambda node: (node.end, node.duration_ns))
+        out: List[Tuple[SpanNode, int]] = []
+        _critical_path(top, top.start, top.end, out)
+        return out
+
+    def __repr__(self):
+        return f"Trace({self.trace_id.hex()}, {len(self.nodes)} spans)"
+
+
+def _critical_path(
+    node: SpanNode, since: int, until: int, out: List[Tuple[SpanNode, int]]
+):
+    """Appends the critical path of the part of `node` between `since` and `until` to `out`."""
+    entry = len(out)
+    out.append((node, 0))
+    start = max(node.start, since)
+    cursor = min(node.end, until)
+    own = 0
+    for child in sorted(node.children, key=lambda c: c.end, reverse=True):
+        if cursor <= start:
+            break
+        if child.start >= cursor or child.end <= start:
+            # started after, or, e.g. with clock skew between processes, ended before the part of the span being
+            # attributed
+            continue
+        child_end = max(min(child.end, cursor), start)
+        own += cursor - child_end
+        _critical_path(child, start, child_end, out)
+        cursor = max(child.start, start)
+    own += max(cursor - start, 0)
+    out[entry] = (node, own)
+
+
+def build_traces(tel_or_spans: Union[Telemetry, Iterable]) -> Dict[bytes, Trace]:
+    """
+    Assembles spans, from a Telemetry's trace requests or any iterable of Span messages, into Traces by trace id, in a
+    single pass over the spans, whatever order they arrive in.
+    """
+    spans = (
+        tel_or_spans.index.spans
+        if isinstance(tel_or_spans, Telemetry)
+        else tel_or_spans
+    )
+    traces: Dict[bytes, Trace] = {}
+    for span in spans:
+        trace = traces.get(span.trace_id)
+        if trace is None:
+            trace = traces[span.trace_id] = Trace(span.trace_id)
+        trace.add(span)
+    return traces
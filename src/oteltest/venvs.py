@@ -0,0 +1,472 @@
+import abc
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+import typing
+import venv
+from pathlib import Path
+
+DEFAULT_VENV_CACHE_SIZE = 32
+
+PhaseTimings = typing.List[typing.Tuple[str, float]]
+
+
+class Installer(abc.ABC):
+    """
+    Installs requirements into a Venv in a single invocation, so that all requirements are resolved together.
+    """
+
+    name = ""
+    # whether venvs need pip bootstrapped into them for this installer to work
+    needs_pip = True
+
+    def __init__(self, wheelhouse: typing.Optional[str] = None):
+        # when set, requirements are installed only from this directory of wheels, without any index lookups
+        self.wheelhouse = wheelhouse
+
+    def index_args(self) -> list:
+        if self.wheelhouse is None:
+            return []
+        return ["--no-index", "--find-links", self.wheelhouse]
+
+    @abc.abstractmethod
+    def install_args(self, v: "Venv", requirements: typing.Sequence[str]) -> list:
+        """Returns the command line that installs `requirements` into `v`."""
+
+    @abc.abstractmethod
+    def phase_timings(
+        self, lines: typing.List[typing.Tuple[float, str]], total: float
+    ) -> PhaseTimings:
+        """
+        Returns how long each phase of an install took, given the install's output lines, each paired with the
+        number of seconds since the install started, and the total install time.
+        """
+
+
+class PipInstaller(Installer):
+    name = "pip"
+
+    def install_args(self, v, requirements):
+        return [
+            v.path_to_executable("pip"),
+            "install",
+            *self.index_args(),
+            *requirements,
+        ]
+
+    def phase_timings(self, lines, total):
+        # pip downloads while it resolves, so those two phases can only be timed together
+        for elapsed, line in lines:
+            if line.startswith("Installing collected packages"):
+                return [("resolve+download", elapsed), ("install", total - elapsed)]
+        return [("resolve+download", total)]
+
+
+class UvInstaller(Installer):
+    name = "uv"
+    needs_pip = False
+
+    PHASES = {"Resolved": "resolve", "Prepared": "download", "Installed": "install"}
+    SUMMARY_LINE = re.compile(
+        r"^\s*(Resolved|Prepared|Installed) \d+ packages? in (.+)$"
+    )
+
+    def __init__(self, uv_path: str = "uv", wheelhouse: typing.Optional[str] = None):
+        super().__init__(wheelhouse)
+        self.uv_path = uv_path
+
+    def install_args(self, v, requirements):
+        return [
+            self.uv_path,
+            "pip",
+            "install",
+            "--python",
+            v.path_to_executable("python"),
+            *self.index_args(),
+            *requirements,
+        ]
+
+    def phase_timings(self, lines, total):  # noqa: ARG002
+        out = []
+        for _, line in lines:
+            match = self.SUMMARY_LINE.match(line)
+            if match:
+                out.append(
+                    (self.PHASES[match.group(1)], parse_uv_duration(match.group(2)))
+                )
+        return out
+
+
+def parse_uv_duration(s: str) -> float:
+    """
+    Parses a duration as printed by uv, e.g. "850ms", "1.20s" or "1m 5s", to seconds.
+    """
+    out = 0.0
+    for value, unit in re.findall(r"([\d.]+)(ms|s|m)", s):
+        out += float(value) * {"ms": 0.001, "s": 1.0, "m": 60.0}[unit]
+    return out
+
+
+def get_installer(
+    name: str = "auto", wheelhouse: typing.Optional[str] = None
+) -> Installer:
+    """
+    Returns the installer called `name`. "auto" selects uv when it's on the PATH and pip otherwise. With a
+    `wheelhouse`, the installer installs only from that directory.
+    """
+    if name == "auto":
+        uv_path = shutil.which("uv")
+        return UvInstaller(uv_path, wheelhouse) if uv_path else PipInstaller(wheelhouse)
+    if name == "uv":
+        return UvInstaller(shutil.which("uv") or "uv", wheelhouse)
+    if name == "pip":
+        return PipInstaller(wheelhouse)
+    raise ValueError(f"Unknown installer: '{name}'")
+
+
+class Venv:
+    def __init__(self, venv_dir, installer: typing.Optional[Installer] = None):
+        self.venv_dir = venv_dir
+        self.installer = installer or PipInstaller()
+
+    def create(self):
+        venv.create(self.venv_dir, with_pip=self.installer.needs_pip)
+
+    def install(self, requirements: typing.Sequence[str]):
+        """
+        Installs all `requirements` with a single installer invocation and reports how long each phase took.
+        """
+        if not requirements:
+            return
+        for req in requirements:
+            print(f"- Will install requirement: '{req}'")
+        start = time.monotonic()
+        lines = run_timed_subprocess(self.installer.install_args(self, requirements))
+        total = time.monotonic() - start
+        phases = ", ".join(
+            f"{phase}: {secs:.2f}s"
+            for phase, secs in self.installer.phase_timings(lines, total)
+        )
+        print(
+            f"- Installed {len(requirements)} requirement(s) with {self.installer.name} in {total:.2f}s ({phases})"
+        )
+
+    def path_to_executable(self, executable_name: str):
+        return f"{self.venv_dir}/bin/{executable_name}"
+
+    def rm(self):
+        shutil.rmtree(self.venv_dir)
+
+    def clone(self, dest_dir: str) -> "Venv":
+        """
+        Creates a copy of this venv at `dest_dir`. Files are hardlinked rather than copied where possible, which
+        makes cloning nearly free. Installers replace files rather than writing to them, so installing into the
+        clone leaves this venv untouched. The files that hold the venv's own path, i.e. the scripts in `bin` and
+        `pyvenv.cfg`, are copied and rewritten to point at the clone instead.
+        """
+        src = os.path.abspath(self.venv_dir)
+        dest = os.path.abspath(dest_dir)
+
+        def ignore(path, names):
+            if path != src:
+                return []
+            return [n for n in names if n in ("bin", "pyvenv.cfg", VenvCache.MARKER)]
+
+        shutil.copytree(
+            src, dest, symlinks=True, ignore=ignore, copy_function=link_or_copy
+        )
+        shutil.copytree(
+            os.path.join(src, "bin"), os.path.join(dest, "bin"), symlinks=True
+        )
+        shutil.copy2(os.path.join(src, "pyvenv.cfg"), os.path.join(dest, "pyvenv.cfg"))
+
+        rewrite = [os.path.join(dest, "pyvenv.cfg")]
+        rewrite += [entry.path for entry in os.scandir(os.path.join(dest, "bin"))]
+        for path in rewrite:
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            with open(path, "rb") as file:
+                content = file.read()
+            if src.encode() in content:
+                with open(path, "wb") as file:
+                    file.write(content.replace(src.encode(), dest.encode()))
+        return Venv(dest_dir, self.installer)
+
+
+def link_or_copy(src: str, dest: str):
+    try:
+        os.link(src, dest)
+    except OSError:
+        # e.g. when src and dest are on different filesystems
+        shutil.copy2(src, dest)
+
+
+def provision_venv(v: Venv, requirements: typing.Sequence[str]):
+    v.create()
+    v.install(requirements)
+
+
+def venv_cache_key(
+    requirements: typing.Sequence[str], wrapper_command: typing.Optional[str]
+) -> str:
+    """
+    Returns a hash of everything that determines the contents of a script's venv: its requirements (in any order),
+    its wrapper command, and the Python interpreter the venv is created from.
+    """
+    key_data = {
+        "requirements": sorted(requirements),
+        "wrapper_command": wrapper_command,
+        "python": [
+            sys.implementation.name,
+            platform.python_version(),
+            sys.base_prefix,
+        ],
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+class VenvCache:
+    """
+    A persistent cache of script venvs under a parent directory. Venvs are keyed by `venv_cache_key`, so scripts with
+    the same requirements share a single venv, and a venv built by a previous run is reused as is. Once there are more
+    than `max_entries` venvs, the least recently used ones are removed.
+
+    With `rebuild`, venvs built before this cache was created are rebuilt. Venvs built since (e.g. for another script
+    with the same requirements) are still reused.
+
+    With `template_requirements`, a template venv with just those requirements is built once, and script venvs are
+    created by cloning it and installing the rest of their requirements on top.
+
+    Each venv has a lock file next to it. It's held exclusively while the venv is built, and shared while a script
+    runs from it (see `use`), so that other oteltest processes sharing the cache don't evict it in the meantime.
+    """
+
+    MARKER = ".oteltest-venv.json"
+
+    def __init__(
+        self,
+        parent_dir: str,
+        max_entries: int = DEFAULT_VENV_CACHE_SIZE,
+        rebuild: bool = False,
+        installer: typing.Optional[Installer] = None,
+        template_requirements: typing.Optional[typing.Sequence[str]] = None,
+    ):
+        self.parent_dir = parent_dir
+        self.max_entries = max_entries
+        self.stale_before = time.time() if rebuild else None
+        self.installer = installer or PipInstaller()
+        self.template_requirements = template_requirements
+
+    def use_template(self, requirements: typing.Sequence[str]):
+        """
+        Makes script venvs clones of a template venv with `requirements` installed. Does nothing when the template
+        would save nothing: an empty venv is as fast to create as to clone unless pip has to be bootstrapped into it.
+        """
+        if not requirements and not self.installer.needs_pip:
+            return
+        print(f"- Will clone script venvs from a template venv with: {requirements}")
+        self.template_requirements = list(requirements)
+
+    def get(
+        self,
+        requirements: typing.Sequence[str],
+        wrapper_command: typing.Optional[str],
+    ) -> Venv:
+        """
+        Returns the venv for `requirements` and `wrapper_command`, building it if it isn't cached yet. Use `use`
+        instead to keep other processes from evicting the venv while it's in use.
+        """
+        with self.use(requirements, wrapper_command) as v:
+            return v
+
+    @contextlib.contextmanager
+    def use(
+        self,
+        requirements: typing.Sequence[str],
+        wrapper_command: typing.Optional[str],
+    ) -> typing.Iterator[Venv]:
+        """
+        Like `get`, but holds a shared lock on the venv until the block exits, so that it isn't evicted or rebuilt
+        while a script runs from it.
+        """
+        key = venv_cache_key(requirements, wrapper_command)
+        v = Venv(str(Path(self.parent_dir) / f"venv-{key[:16]}"), self.installer)
+        with self._get_or_build(
+            v,
+            {
+                "key": key,
+                "requirements": list(requirements),
+                "wrapper_command": wrapper_command,
+            },
+            lambda: self._provision(v, requirements),
+        ):
+            self.evict(keep=v.venv_dir)
+            yield v
+
+    def template(self) -> Venv:
+        """
+        Returns the template venv, building it if it isn't cached yet.
+        """
+        with self._template() as v:
+            return v
+
+    @contextlib.contextmanager
+    def _template(self) -> typing.Iterator[Venv]:
+        requirements = self.template_requirements or []
+        key = venv_cache_key(requirements, None)
+        v = Venv(str(Path(self.parent_dir) / f"template-{key[:16]}"), self.installer)
+        with self._get_or_build(
+            v,
+            {"key": key, "requirements": requirements},
+            lambda: provision_venv(v, requirements),
+        ):
+            yield v
+
+    def evict(self, keep: typing.Optional[str] = None):
+        """
+        Removes the least recently used venvs, template venvs included, beyond `max_entries`, skipping `keep` and any
+        venv that is locked, i.e. being built or in use.
+        """
+        parent = Path(self.parent_dir)
+        entries = sorted(
+            [
+                *parent.glob(f"venv-*/{self.MARKER}"),
+                *parent.glob(f"template-*/{self.MARKER}"),
+            ],
+            key=lambda p: p.stat().st_mtime,
+            reverse=True,
+        )
+        for marker in entries[self.max_entries :]:
+            venv_dir = str(marker.parent)
+            if venv_dir == keep:
+                continue
+            lock_path = f"{venv_dir}.lock"
+            with open(lock_path, "a", encoding="utf-8") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                print(f"- Evicting cached venv {venv_dir}")
+                shutil.rmtree(venv_dir, ignore_errors=True)
+
+    def _provision(self, v: Venv, requirements: typing.Sequence[str]):
+        if self.template_requirements is None:
+            provision_venv(v, requirements)
+            return
+        with self._template() as template:
+            print(f"- Cloning template venv {template.venv_dir}")
+            template.clone(v.venv_dir)
+        v.install(requirements)
+
+    @contextlib.contextmanager
+    def _get_or_build(self, v: Venv, metadata: dict, build: typing.Callable):
+        """Builds the venv unless it's cached, then holds a shared lock on it until the block exits."""
+        marker = Path(v.venv_dir) / self.MARKER
+        os.makedirs(self.parent_dir, exist_ok=True)
+        with open(f"{v.venv_dir}.lock", "a", encoding="utf-8") as lock_file:
+            # a shared lock suffices to reuse the venv, so scripts with the same requirements can run at once
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            try:
+                if self._is_fresh(marker):
+                    print(f"- Reusing cached venv {v.venv_dir}")
+                    marker.touch()
+                else:
+                    # exclusive, so that concurrently running scripts with the same requirements build it only once
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    self._build(v, marker, metadata, build)
+                    fcntl.flock(lock_file, fcntl.LOCK_SH)
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _build(self, v: Venv, marker: Path, metadata: dict, build: typing.Callable):
+        # another process may have built it while this one waited for the lock
+        if self._is_fresh(marker):
+            print(f"- Reusing cached venv {v.venv_dir}")
+            marker.touch()
+            return
+        if os.path.exists(v.venv_dir):
+            print(f"- Rebuilding venv {v.venv_dir}")
+            v.rm()
+        build()
+        marker.write_text(
+            json.dumps({**metadata, "python": sys.version, "created": time.time()}),
+            encoding="utf-8",
+        )
+
+    def _is_fresh(self, marker: Path) -> bool:
+        if not marker.exists():
+            return False
+        if self.stale_before is None:
+            return True
+        created = json.loads(marker.read_text(encoding="utf-8")).get("created", 0)
+        return created >= self.stale_before
+
+
+def common_requirements(
+    requirement_lists: typing.Sequence[typing.Sequence[str]],
+) -> typing.List[str]:
+    """
+    Returns the requirements that appear in every one of `requirement_lists`, in the order of the first list.
+    """
+    if not requirement_lists:
+        return []
+    rest = [set(reqs) for reqs in requirement_lists[1:]]
+    return [req for req in requirement_lists[0] if all(req in reqs for reqs in rest)]
+
+
+def run_subprocess(args):
+    print(f"- Subprocess: {args}")
+    result = subprocess.run(
+        args,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    print_subprocess_result(result.stdout, result.stderr, result.returncode)
+
+
+def run_timed_subprocess(args) -> typing.List[typing.Tuple[float, str]]:
+    """
+    Runs a subprocess, returning its output lines (stdout and stderr combined), each paired with the number of seconds
+    between the start of the subprocess and the line being read.
+    """
+    print(f"- Subprocess: {args}")
+    start = time.monotonic()
+    lines = []
+    with subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    ) as proc:
+        for line in proc.stdout:
+            lines.append((time.monotonic() - start, line))
+    output = "".join(line for _, line in lines)
+    print_subprocess_result(output, "", proc.returncode)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, output)
+    return lines
+
+
+def print_subprocess_result(
+    stdout: str, stderr: str, returncode: int, streamed: bool = False
+):
+    print(f"- Return Code: {returncode}")
+    if streamed:
+        # already written to the console as it arrived
+        print("- End Subprocess (output streamed above) -\n")
+        return
+    print("- Standard Output:")
+    if stdout:
+        print(stdout)
+    print("- Standard Error:")
+    if stderr:
+        print(stderr)
+    print("- End Subprocess -\n")
@@ -1,16 +1,70 @@
+import io
 import json
 import os
 import pickle
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
 from typing import Mapping, Optional, Sequence
 
 import pytest
 
-from oteltest import OtelTest, telemetry, Telemetry
+from oteltest import OtelTest, Telemetry, metrics, private, telemetry, venvs
+from oteltest.bench import compare_samples, nearest_rank, summarize_samples
+from oteltest.columnar import CSV, telemetry_tables, write_columnar
+from oteltest.diff import diff_summaries, summarize
+from oteltest.expectation import AllOf, MetricPresent, Predicate, SpanCount
+from oteltest.metrics import CUMULATIVE, DELTA, histogram_percentile, metric_series
 from oteltest.private import (
+    EXPECTATION_MET,
+    AccumulatingHandler,
+    OutputBuffer,
+    OutputReader,
+    RssMonitor,
+    RusagePopen,
+    Shutdown,
+    files_to_diff,
     get_next_json_file,
     is_test_class,
     load_test_class_for_script,
+    run,
+    run_python_script,
     save_telemetry_json,
+    script_environment,
+    stop_script,
+    wait_for_script,
+    wait_until_ready,
+)
+from oteltest.readiness import StdoutProbe, TcpProbe
+from oteltest.sink import (
+    AsyncGrpcSink,
+    AsyncRequestHandler,
+    GrpcSink,
+    HttpSink,
+    MultiProcessGrpcSink,
+    RequestHandler,
+)
+from oteltest.sink.faults import (
+    FaultPolicy,
+    Latency,
+    PartialSuccess,
+    ResourceExhausted,
+    Unavailable,
+)
+from oteltest.stats import LogHistogram, ResourceUsage, count_items
+from oteltest.tracetree import build_traces
+from oteltest.venvs import (
+    PipInstaller,
+    UvInstaller,
+    Venv,
+    VenvCache,
+    common_requirements,
+    parse_uv_duration,
+    venv_cache_key,
 )
 
 
@@ -68,6 +122,950 @@ def test_load_test_class_for_script():
     assert klass is not None
 
 
+def test_script_environment():
+    klass = load_test_class_for_script(
+        "script", os.path.join(fixtures_dir, "script.py")
+    )
+    env = script_environment(klass(), 54321)
+    assert env["OTEL_EXPORTER_OTLP_ENDPOINT"] == "http://127.0.0.1:54321"
+
+
+def test_sinks_on_ephemeral_ports():
+    sinks = [GrpcSink(AccumulatingHandler(), address="0.0.0.0:0") for _ in range(2)]
+    try:
+        for sink in sinks:
+            sink.start()
+        assert sinks[0].port != sinks[1].port
+        assert all(sink.port > 0 for sink in sinks)
+    finally:
+        for sink in sinks:
+            sink.stop()
+
+
+def test_venv_cache_key():
+    assert venv_cache_key(["a", "b"], "w") == venv_cache_key(("b", "a"), "w")
+    assert venv_cache_key(["a", "b"], "w") != venv_cache_key(["a", "b"], "")
+    assert venv_cache_key(["a"], "w") != venv_cache_key(["a", "b"], "w")
+
+
+def test_venv_cache(tmp_path, monkeypatch):
+    provisioned = []
+
+    def fake_provision_venv(v, requirements):
+        os.makedirs(v.venv_dir)
+        provisioned.append(tuple(requirements))
+
+    monkeypatch.setattr(venvs, "provision_venv", fake_provision_venv)
+
+    cache = VenvCache(str(tmp_path), max_entries=2)
+    v1 = cache.get(["a", "b"], "w")
+    assert cache.get(["b", "a"], "w").venv_dir == v1.venv_dir
+    assert len(provisioned) == 1
+
+    v2 = cache.get(["c"], "w")
+    v3 = cache.get(["d"], "w")
+    assert len(provisioned) == 3
+    assert not os.path.exists(v1.venv_dir)
+    assert os.path.exists(v2.venv_dir) and os.path.exists(v3.venv_dir)
+
+    VenvCache(str(tmp_path), max_entries=2, rebuild=True).get(["d"], "w")
+    assert len(provisioned) == 4
+
+    # a venv in use isn't evicted, however old
+    cache = VenvCache(str(tmp_path), max_entries=1)
+    with cache.use(["e"], "w") as v5:
+        cache.get(["f"], "w")
+        assert os.path.exists(v5.venv_dir)
+    cache.get(["g"], "w")
+    assert not os.path.exists(v5.venv_dir)
+
+    # template venvs are evicted like any other
+    template = VenvCache(str(tmp_path), template_requirements=["t"]).template()
+    assert os.path.exists(template.venv_dir)
+    cache.get(["h"], "w")
+    assert not os.path.exists(template.venv_dir)
+
+
+def test_parse_uv_duration():
+    assert parse_uv_duration("850ms") == pytest.approx(0.85)
+    assert parse_uv_duration("1.20s") == pytest.approx(1.2)
+    assert parse_uv_duration("1m 5s") == pytest.approx(65)
+
+
+def test_installer_phase_timings():
+    pip_lines = [
+        (0.5, "Collecting flask\n"),
+        (2.0, "Installing collected packages: flask\n"),
+        (3.0, "Successfully installed flask-2.3.3\n"),
+    ]
+    assert PipInstaller().phase_timings(pip_lines, 3.5) == [
+        ("resolve+download", 2.0),
+        ("install", 1.5),
+    ]
+
+    uv_lines = [
+        (0.1, "Resolved 7 packages in 120ms\n"),
+        (1.0, "Prepared 7 packages in 850ms\n"),
+        (1.1, "Installed 7 packages in 15ms\n"),
+        (1.1, " + flask==2.3.3\n"),
+    ]
+    assert UvInstaller().phase_timings(uv_lines, 1.2) == [
+        ("resolve", pytest.approx(0.12)),
+        ("download", pytest.approx(0.85)),
+        ("install", pytest.approx(0.015)),
+    ]
+
+
+def test_wheelhouse_install_args():
+    v = Venv("/v")
+    assert PipInstaller().install_args(v, ["a"]) == ["/v/bin/pip", "install", "a"]
+    assert PipInstaller("/wh").install_args(v, ["a"]) == [
+        "/v/bin/pip",
+        "install",
+        "--no-index",
+        "--find-links",
+        "/wh",
+        "a",
+    ]
+    assert UvInstaller("uv", "/wh").install_args(v, ["a"])[-4:] == [
+        "--no-index",
+        "--find-links",
+        "/wh",
+        "a",
+    ]
+
+
+def test_common_requirements():
+    assert common_requirements([["a", "b", "c"], ["c", "a"], ["a", "c", "d"]]) == [
+        "a",
+        "c",
+    ]
+    assert common_requirements([]) == []
+
+
+def test_venv_clone(tmp_path):
+    src = tmp_path / "template"
+    (src / "bin").mkdir(parents=True)
+    (src / "lib").mkdir()
+    (src / "bin" / "tool").write_text(f"#!{src}/bin/python\nprint('hi')\n")
+    (src / "pyvenv.cfg").write_text(f"command = python -m venv {src}\n")
+    (src / "lib" / "mod.py").write_text("x = 1\n")
+
+    clone = Venv(str(src)).clone(str(tmp_path / "clone"))
+    dest = Path(clone.venv_dir)
+
+    assert (dest / "bin" / "tool").read_text().startswith(f"#!{dest}/bin/python")
+    assert str(dest) in (dest / "pyvenv.cfg").read_text()
+    assert (src / "bin" / "tool").read_text().startswith(f"#!{src}/bin/python")
+    assert (dest / "lib" / "mod.py").stat().st_ino == (
+        src / "lib" / "mod.py"
+    ).stat().st_ino
+
+
+def test_tcp_probe():
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        probe = TcpProbe(server.getsockname()[1])
+        assert not probe.is_ready()
+        server.listen()
+        assert probe.is_ready()
+
+
+def test_wait_until_ready_on_stdout():
+    proc = subprocess.Popen(
+        [sys.executable, "-u", "-c", "import time; print('ready now'); time.sleep(5)"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    probe = StdoutProbe(r"ready \w+", timeout=5)
+    output = OutputReader(proc, probe.feed_stdout)
+    try:
+        assert wait_until_ready(probe, proc, "script.py") < 5
+    finally:
+        proc.kill()
+        proc.wait()
+        output.join()
+    assert output.stdout() == "ready now\n"
+
+
+def test_output_reader_bounds_and_spills_output(tmp_path):
+    code = "import sys; [print(f'line {i}') for i in range(1000)]; print('oops', file=sys.stderr)"
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    paths = (str(tmp_path / "out.log"), str(tmp_path / "err.log"))
+    output = OutputReader(proc, max_chars=27, spill_paths=paths)
+    proc.wait()
+    output.join()
+    # only the last lines that fit in 27 characters are kept...
+    assert output.stdout() == "line 997\nline 998\nline 999\n"
+    assert output.stderr() == "oops\n"
+    assert output.dropped() == {"stdout": 997}
+    # ...but all of them are spilled
+    assert Path(paths[0]).read_text().count("\n") == 1000
+    assert Path(paths[1]).read_text() == "oops\n"
+
+
+def test_output_buffer_tee():
+    tee = io.StringIO()
+    buffer = OutputBuffer(max_chars=4, tee=tee, prefix="[s.py] ")
+    buffer.append("hello\n")
+    buffer.append("hi\n")
+    assert tee.getvalue() == "[s.py] hello\n[s.py] hi\n"
+    # a line longer than the limit keeps its end
+    assert buffer.text() == "hi\n"
+    assert buffer.dropped_lines == 1
+
+
+def test_expectations(metrics_trace_fixture: Telemetry):
+    expectations = [
+        SpanCount(10, name="my-span"),
+        MetricPresent("loop-counter"),
+        Predicate(lambda tel: telemetry.num_spans(tel) >= 10),
+    ]
+    handler = AccumulatingHandler(AllOf(*expectations))
+    for req in metrics_trace_fixture.metric_requests:
+        handler.handle_metrics(req.pbreq, FakeContext())
+    assert not handler.expectation_met.is_set()
+    for req in metrics_trace_fixture.trace_requests:
+        handler.handle_trace(req.pbreq, FakeContext())
+    assert handler.expectation_met.is_set()
+
+
+def test_wait_for_script_until_expectation_met():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    expectation_met = threading.Event()
+    threading.Timer(0.1, expectation_met.set).start()
+    try:
+        assert wait_for_script(proc, 30, expectation_met) == EXPECTATION_MET
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_stop_script():
+    # a script that flushes on ctrl-c, after its child (in the same process group) has been stopped too
+    code = (
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        "print('ready', flush=True)\n"
+        "try:\n"
+        "    time.sleep(30)\n"
+        "except KeyboardInterrupt:\n"
+        "    child.wait()\n"
+        "    print('flushed', child.returncode)\n"
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    assert proc.stdout.readline() == "ready\n"
+    shutdown = stop_script(proc, "SIGINT", grace_period=10)
+    assert not shutdown.killed
+    assert shutdown.grace_s < 10
+    assert proc.stdout.read() == f"flushed {-signal.SIGINT}\n"
+
+    # a script that ignores the stop signal is killed once the grace period is over
+    code = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print('ready', flush=True); time.sleep(30)"
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    assert proc.stdout.readline() == "ready\n"
+    shutdown = stop_script(proc, "SIGTERM", grace_period=0.2)
+    assert shutdown.killed
+    assert proc.returncode == -signal.SIGKILL
+
+
+def test_shutdown_summary(metrics_trace_fixture: Telemetry):
+    tel = Telemetry()
+    for i, req in enumerate(metrics_trace_fixture.trace_requests[:2]):
+        tel.add_trace(req.pbreq, {}, i * 1000)
+    # signalled 500ms after the sink started, so only the second request arrived during the grace period
+    shutdown = Shutdown("SIGINT", 1_500_000_000, 0.7, False)
+    received = shutdown.received_during_grace_period(tel, 1_000_000_000)
+    spans = count_items("trace", tel.trace_requests[1].pbreq)
+    assert received == {"trace": (1, spans)}
+    assert shutdown.summary(tel, 1_000_000_000) == (
+        f"- Shutdown: SIGINT, exited after 0.70s, received meanwhile trace: 1 requests ({spans} items)"
+    )
+
+
+def test_concurrent_telemetry_adds(metrics_trace_fixture: Telemetry):
+    tel = Telemetry()
+    pbreq = metrics_trace_fixture.trace_requests[0].pbreq
+    seen = []
+
+    def add(i):
+        for n in range(500):
+            (tel.add_trace if (i + n) % 2 else tel.add_log)(pbreq, {}, n)
+            if n % 100 == 0:
+                # reading while others add
+                seen.append(len(tel.trace_requests))
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests = [*tel.trace_requests, *tel.log_requests]
+    assert len(tel.trace_requests) == len(tel.log_requests) == 2000
+    assert sorted(req.seq for req in requests) == list(range(4000))
+    for reqs in (tel.trace_requests, tel.log_requests):
+        assert [req.seq for req in reqs] == sorted(req.seq for req in reqs)
+
+    copy = pickle.loads(pickle.dumps(tel))
+    assert [req.seq for req in copy.trace_requests] == [
+        req.seq for req in tel.trace_requests
+    ]
+    copy.add_metric(pbreq, {}, 0)
+    assert copy.metric_requests[0].seq == 4000
+
+
+def test_index_after_out_of_order_adds(metrics_trace_fixture: Telemetry):
+    first, second = (req.pbreq for req in metrics_trace_fixture.trace_requests[:2])
+    tel = Telemetry()
+    # as when a thread numbers a request, then another thread numbers and buffers one before it buffers its own
+    tel._seq = iter([1, 0, 2])
+    tel.add_trace(second, {}, 0)
+    assert telemetry.num_spans(tel) == 5
+    tel.add_trace(first, {}, 0)
+    assert telemetry.num_spans(tel) == 9
+    assert tel.index.spans[0] is first.resource_spans[0].scope_spans[0].spans[0]
+    # in order again: only the new request is indexed
+    tel.add_trace(first, {}, 0)
+    assert telemetry.num_spans(tel) == 13
+    tel.trace_requests = tel.trace_requests[:1]
+    assert telemetry.num_spans(tel) == 4
+
+
+def test_ndjson_round_trip(tmp_path, metrics_trace_fixture: Telemetry):
+    path = str(tmp_path / "script.0.ndjson")
+    writer = telemetry.NdjsonWriter(path)
+    for req in metrics_trace_fixture.trace_requests:
+        writer.add_trace(req.pbreq, req.headers, req.test_elapsed_ms)
+    for req in metrics_trace_fixture.metric_requests:
+        writer.add_metric(req.pbreq, req.headers, req.test_elapsed_ms)
+    writer.close()
+
+    tel = telemetry.read_ndjson(path)
+    assert len(tel.trace_requests) == len(metrics_trace_fixture.trace_requests)
+    assert [req.seq for req in tel.trace_requests] == list(
+        range(len(tel.trace_requests))
+    )
+    assert len(tel.log_requests) == 0
+    assert tel.trace_requests[-1] == metrics_trace_fixture.trace_requests[-1]
+    assert telemetry.num_spans(tel) == 10
+    assert telemetry.metric_names(tel) == telemetry.metric_names(metrics_trace_fixture)
+    assert get_next_json_file(str(tmp_path), "script") == "script.1.json"
+
+
+def test_capture_round_trip(tmp_path, metrics_trace_fixture: Telemetry):
+    handler = private.CaptureHandler(
+        telemetry.CaptureWriter(str(tmp_path / "script.0.otcap")), SpanCount(10)
+    )
+    faulty = FakeContext()
+    faulty.fault = {"faults": ["UNAVAILABLE"], "delay_ms": 0, "status": "UNAVAILABLE"}
+    for req in metrics_trace_fixture.trace_requests:
+        handler.handle_raw("trace", req.pbreq.SerializeToString(), FakeContext())
+    for req in metrics_trace_fixture.metric_requests:
+        handler.handle_raw("metric", req.pbreq.SerializeToString(), faulty)
+    handler.writer.close()
+    assert handler.expectation_met.is_set()
+
+    tel = telemetry.read_capture(str(tmp_path / "script.0.otcap"))
+    assert len(tel.metric_requests) == len(metrics_trace_fixture.metric_requests)
+    assert tel.trace_requests[0]._pbreq is None
+    assert tel.trace_requests[0].headers == {"user-agent": "test"}
+    assert tel.trace_requests[0].fault is None
+    assert tel.metric_requests[0].fault == faulty.fault
+    assert telemetry.num_spans(tel) == 10
+    assert telemetry.first_span(tel) == telemetry.first_span(metrics_trace_fixture)
+
+
+def test_raw_grpc_sink(tmp_path, metrics_trace_fixture: Telemetry):
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    writer = telemetry.CaptureWriter(str(tmp_path / "script.0.otcap"))
+    sink = GrpcSink(private.CaptureHandler(writer), address="127.0.0.1:0")
+    sink.start()
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+            stub = trace_service_pb2_grpc.TraceServiceStub(channel)
+            stub.Export(metrics_trace_fixture.trace_requests[0].pbreq)
+    finally:
+        sink.stop()
+    writer.close()
+    tel = telemetry.read_capture(str(tmp_path / "script.0.otcap"))
+    assert tel.trace_requests[0].pbreq == metrics_trace_fixture.trace_requests[0].pbreq
+
+
+def test_http_sink(metrics_trace_fixture: Telemetry):
+    import gzip
+    import http.client
+
+    from google.protobuf.json_format import MessageToJson
+
+    handler = AccumulatingHandler()
+    sink = HttpSink(handler, address="127.0.0.1:0")
+    sink.start()
+    pbreq = metrics_trace_fixture.trace_requests[0].pbreq
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", sink.port)
+        conn.request(
+            "POST",
+            "/v1/traces",
+            gzip.compress(pbreq.SerializeToString()),
+            {
+                "Content-Type": "application/x-protobuf",
+                "Content-Encoding": "gzip",
+            },
+        )
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == "application/x-protobuf"
+        response.read()
+        # same connection
+        conn.request(
+            "POST",
+            "/v1/traces",
+            MessageToJson(pbreq),
+            {"Content-Type": "application/json", "X-Test": "hello"},
+        )
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.read() == b"{}"
+        # OTLP/JSON, with hex ids
+        trace_id, span_id = "5b8efff798038103d269b633813fc60c", "eee19b7ec3c1b174"
+        conn.request(
+            "POST",
+            "/v1/traces",
+            json.dumps(
+                {
+                    "resourceSpans": [
+                        {
+                            "scopeSpans": [
+                                {
+                                    "spans": [
+                                        {
+                                            "traceId": trace_id,
+                                            "spanId": span_id,
+                                            "parentSpanId": "",
+                                            "name": "hex",
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
+                    ]
+                }
+            ),
+            {"Content-Type": "application/json"},
+        )
+        response = conn.getresponse()
+        assert response.status == 200
+        response.read()
+        conn.request(
+            "POST",
+            "/v1/traces",
+            b"not gzip",
+            {"Content-Type": "application/x-protobuf", "Content-Encoding": "gzip"},
+        )
+        response = conn.getresponse()
+        assert response.status == 400
+        response.read()
+        conn.request("POST", "/v1/nope", b"")
+        assert conn.getresponse().status == 404
+        conn.close()
+    finally:
+        sink.stop()
+    requests = handler.telemetry.trace_requests
+    assert [req.pbreq for req in requests[:2]] == [pbreq, pbreq]
+    assert requests[1].get_header("x-test") == "hello"
+    span = requests[2].pbreq.resource_spans[0].scope_spans[0].spans[0]
+    assert (span.trace_id.hex(), span.span_id.hex()) == (trace_id, span_id)
+    assert span.parent_span_id == b""
+
+
+def test_sink_faults(metrics_trace_fixture: Telemetry):
+    import http.client
+
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    faults = FaultPolicy(
+        Unavailable(signals=["trace"], times=1),
+        PartialSuccess(rejected=2, signals=["trace"]),
+        Latency(0.01, until=60),
+    )
+    handler = AccumulatingHandler()
+    sink = GrpcSink(handler, address="127.0.0.1:0", faults=faults)
+    sink.start()
+    pbreq = metrics_trace_fixture.trace_requests[0].pbreq
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+            stub = trace_service_pb2_grpc.TraceServiceStub(channel)
+            with pytest.raises(grpc.RpcError) as err:
+                stub.Export(pbreq)
+            assert err.value.code() == grpc.StatusCode.UNAVAILABLE
+            # the retry
+            response = stub.Export(pbreq)
+            assert response.partial_success.rejected_spans == 2
+    finally:
+        sink.stop()
+    reqs = handler.telemetry.trace_requests
+    assert reqs[0].fault["status"] == "UNAVAILABLE"
+    assert reqs[0].fault["delay_ms"] == 10
+    assert reqs[1].fault == {
+        "faults": ["PartialSuccess(2)", "Latency(0.01s)"],
+        "delay_ms": 10,
+        "rejected": 2,
+    }
+    assert telemetry.export_attempts(reqs) == [reqs]
+    assert telemetry.Request.from_dict(reqs[0].to_dict(), type(pbreq)) == reqs[0]
+
+    from google.protobuf.duration_pb2 import Duration
+
+    sink = GrpcSink(
+        AccumulatingHandler(),
+        address="127.0.0.1:0",
+        faults=FaultPolicy(ResourceExhausted(retry_after=1.5)),
+    )
+    sink.start()
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+            stub = trace_service_pb2_grpc.TraceServiceStub(channel)
+            with pytest.raises(grpc.RpcError) as err:
+                stub.Export(pbreq)
+    finally:
+        sink.stop()
+    assert err.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    retry_info = dict(err.value.trailing_metadata())["google.rpc.retryinfo-bin"]
+    # a RetryInfo, whose only field is the Duration
+    delay = Duration.FromString(retry_info[2:])
+    assert (delay.seconds, delay.nanos) == (1, 500_000_000)
+
+    handler = AccumulatingHandler()
+    faults = FaultPolicy(ResourceExhausted(retry_after=3, signals=["metric"]))
+    sink = HttpSink(handler, address="127.0.0.1:0", faults=faults)
+    sink.start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", sink.port)
+        conn.request("POST", "/v1/traces", pbreq.SerializeToString())
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200
+        conn.request("POST", "/v1/metrics", b"")
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 429
+        assert response.getheader("Retry-After") == "3"
+        conn.close()
+    finally:
+        sink.stop()
+    assert handler.telemetry.trace_requests[0].fault is None
+    assert handler.telemetry.metric_requests[0].fault["status"] == "RESOURCE_EXHAUSTED"
+
+
+def test_bench_statistics():
+    summary = summarize_samples([1.0, 2.0, 3.0])
+    assert summary["mean"] == 2.0
+    assert summary["stdev"] == 1.0
+    # t(2) = 4.303, stdev / sqrt(3)
+    assert summary["ci95"] == pytest.approx([2.0 - 2.4843, 2.0 + 2.4843], abs=1e-3)
+
+    comparison = compare_samples([11.0, 12.0, 13.0], [10.0, 10.0, 10.0])
+    assert comparison["diff"] == 2.0
+    assert comparison["relative_pct"] == 20.0
+    assert comparison["diff_ci95"] == pytest.approx(summary["ci95"])
+    assert compare_samples([1.0], [1.0, 2.0]) is None
+    assert nearest_rank([1, 2, 3, 4], 50) == 2
+
+
+# not a subclass of OtelTest, as the script runs in a venv without oteltest
+CONCURRENT_SCRIPT = """
+class ConcurrentOtelTest:
+    def environment_variables(self):
+        return {{}}
+
+    def requirements(self):
+        return []
+
+    def wrapper_command(self):
+        return ""
+
+    def on_start(self):
+        return None
+
+    def on_stop(self, tel, stdout, stderr, returncode):
+        assert {passes}, "failed on purpose"
+
+
+if __name__ == "__main__":
+    for i in range(20):
+        print("line", i)
+"""
+
+
+def test_run_scripts_concurrently(tmp_path, capsys):
+    script_dir = tmp_path / "scripts"
+    script_dir.mkdir()
+    for name, passes in (("one", True), ("two", True), ("three", False)):
+        (script_dir / f"concurrent_{name}.py").write_text(
+            CONCURRENT_SCRIPT.format(passes=passes)
+        )
+
+    with pytest.raises(RuntimeError, match="1 script.s. failed: concurrent_three.py"):
+        run(
+            str(script_dir),
+            str(tmp_path / "venvs"),
+            jobs=2,
+            installer="pip",
+            template=False,
+        )
+
+    lines = capsys.readouterr().out.splitlines()
+    starts = [
+        i for i, line in enumerate(lines) if line.startswith("- Setting up environment")
+    ]
+    assert len(starts) == 3
+    # each script's output is printed in one piece, from its first line to its result
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        block = lines[start:end]
+        script = block[0].rsplit(" ", 1)[1]
+        results = [line for line in block if line.startswith(("- PASSED", "- FAILED"))]
+        assert results in ([f"- PASSED: {script}"], [f"- FAILED: {script}"])
+        assert [line for line in block if line.startswith("line ")] == [
+            f"line {i}" for i in range(20)
+        ]
+    assert "- FAILED: concurrent_three.py" in lines
+    assert "- PASSED: concurrent_one.py" in lines
+    assert "- PASSED: concurrent_two.py" in lines
+
+
+def test_run_python_script_without_wrapper(tmp_path):
+    script = tmp_path / "script.py"
+    script.write_text("import time; print('hi', flush=True); time.sleep(0.2)")
+
+    class Test(OtelTest):
+        def environment_variables(self):
+            return {}
+
+        def readiness_probe(self):
+            return StdoutProbe("hi", timeout=5)
+
+        def requirements(self):
+            return []
+
+        def wrapper_command(self):
+            return ""
+
+        def on_start(self):
+            return None
+
+        def on_stop(self, tel, stdout, stderr, returncode):
+            pass
+
+    class FakeVenv:
+        def path_to_executable(self, name):
+            return sys.executable if name == "python" else name
+
+    result = run_python_script(str(tmp_path), "script.py", Test(), FakeVenv(), 4317)
+    assert (result.stdout, result.returncode) == ("hi\n", 0)
+    usage = result.resource_usage
+    assert usage.cpu_time_s > 0
+    assert usage.wall_time_s > 0
+    assert usage.minor_page_faults > 0
+    assert ResourceUsage.from_dict(usage.to_dict()).to_dict() == usage.to_dict()
+    assert 0 < result.time_to_ready_s < 5
+
+    tel = Telemetry()
+    tel.time_to_ready_s = result.time_to_ready_s
+    assert Telemetry.from_dict(tel.to_dict()).time_to_ready_s == tel.time_to_ready_s
+
+
+def test_rusage_popen():
+    # burns some CPU time, so that it shows up in the resource usage
+    code = "sum(range(3_000_000))"
+
+    proc = RusagePopen([sys.executable, "-c", code])
+    assert proc.rusage is None
+    assert proc.wait() == 0
+    assert proc.rusage.ru_utime + proc.rusage.ru_stime > 0
+    assert proc.rusage.ru_minflt > 0
+
+    proc = RusagePopen([sys.executable, "-c", code])
+    while proc.poll() is None:
+        time.sleep(0.01)
+    assert proc.rusage.ru_utime + proc.rusage.ru_stime > 0
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="needs /proc")
+def test_rss_monitor():
+    # a parent that allocates ~50MB and a child that allocates ~100MB
+    code = (
+        "import subprocess, sys, time; x = bytearray(50_000_000); "
+        "subprocess.run([sys.executable, '-c', "
+        "'import time; y = bytearray(100_000_000); time.sleep(0.5)'])"
+    )
+    proc = subprocess.Popen([sys.executable, "-c", code])
+    monitor = RssMonitor(proc.pid, interval=0.02, sample_interval=0.05, max_samples=8)
+    proc.wait()
+    monitor.stop()
+    assert 50_000 < monitor.peak_rss_kb < 100_000
+    assert max(rss for _, rss in monitor.samples) > 150_000
+    # downsampled rather than growing without bound
+    assert len(monitor.samples) <= 8
+    assert monitor.sample_interval > 0.05
+
+
+def test_log_histogram():
+    h = LogHistogram()
+    for value in range(1, 1001):
+        h.record(value)
+    assert (h.count, h.min, h.max) == (1000, 1, 1000)
+    assert h.mean() == 500.5
+    # within a bucket's width (1/16) of the actual percentile
+    assert 500 <= h.percentile(50) <= 500 * 17 / 16
+    assert 990 <= h.percentile(99) <= 1000
+    assert h.percentile(100) == 1000
+    for value in (0, 15, 16, 17, 31, 32, 33, 1000, 2**40 + 5):
+        low, high = LogHistogram.bucket_bounds(LogHistogram.bucket_index(value))
+        assert low <= value <= high
+    other = LogHistogram()
+    other.record(5000)
+    h.merge(other)
+    assert (h.count, h.max) == (1001, 5000)
+
+
+def test_ingest_stats(metrics_trace_fixture: Telemetry):
+    handler = AccumulatingHandler()
+    for req in metrics_trace_fixture.trace_requests:
+        handler.handle_trace(req.pbreq, FakeContext())
+    for req in metrics_trace_fixture.metric_requests:
+        handler.handle_metrics(req.pbreq, FakeContext())
+    tel = handler.collect()
+    stats = tel.ingest_stats
+    trace = stats.signals["trace"]
+    assert trace.requests == len(metrics_trace_fixture.trace_requests)
+    assert trace.items == telemetry.num_spans(metrics_trace_fixture)
+    assert trace.bytes == sum(
+        r.pbreq.ByteSize() for r in metrics_trace_fixture.trace_requests
+    )
+    assert trace.interarrival_us.count == trace.requests - 1
+    assert stats.signals["metric"].items > 0
+    assert stats.max_in_flight() == 1
+    assert "trace: 3 requests" in stats.summary()
+
+    merged = Telemetry.merge(tel, tel).ingest_stats
+    assert merged.signals["trace"].requests == 2 * trace.requests
+    assert pickle.loads(pickle.dumps(stats)).to_dict() == stats.to_dict()
+
+    # a failing handler still ends the request
+    def fail(signal, request):
+        raise ValueError(signal)
+
+    handler.check_expectation = fail
+    with pytest.raises(ValueError):
+        handler.handle_trace(
+            metrics_trace_fixture.trace_requests[0].pbreq, FakeContext()
+        )
+    assert handler.stats.in_flight == 0
+
+
+class _TraceCollector(RequestHandler):
+    # module level so that MultiProcessGrpcSink can pickle it for its worker processes
+
+    def __init__(self):
+        self.telemetry = Telemetry()
+
+    def handle_logs(self, request, context):
+        pass
+
+    def handle_metrics(self, request, context):
+        pass
+
+    def handle_trace(self, request, context):
+        self.telemetry.add_trace(request, {}, len(self.telemetry.trace_requests))
+
+    def collect(self):
+        return self.telemetry
+
+
+def test_multi_process_grpc_sink(metrics_trace_fixture: Telemetry):
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    sink = MultiProcessGrpcSink(_TraceCollector, workers=2, address="127.0.0.1:0")
+    sink.start()
+    sent = [req.pbreq for req in metrics_trace_fixture.trace_requests] * 4
+    try:
+        # a channel per request, since the kernel balances connections rather than requests across workers
+        for pbreq in sent:
+            with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+                trace_service_pb2_grpc.TraceServiceStub(channel).Export(pbreq)
+    finally:
+        collected = sink.stop()
+    assert len(collected) == 2
+    merged = Telemetry.merge(*collected)
+    assert len(merged.trace_requests) == len(sent)
+    assert sorted(r.pbreq.SerializeToString() for r in merged.trace_requests) == sorted(
+        pbreq.SerializeToString() for pbreq in sent
+    )
+
+
+def test_multi_process_sink_faults(metrics_trace_fixture: Telemetry):
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    faults = FaultPolicy(Unavailable(times=2))
+    sink = MultiProcessGrpcSink(
+        _TraceCollector, workers=2, address="127.0.0.1:0", faults=faults
+    )
+    sink.start()
+    pbreq = metrics_trace_fixture.trace_requests[0].pbreq
+    codes = []
+    try:
+        for _ in range(8):
+            with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+                try:
+                    trace_service_pb2_grpc.TraceServiceStub(channel).Export(pbreq)
+                    codes.append(grpc.StatusCode.OK)
+                except grpc.RpcError as e:
+                    codes.append(e.code())
+    finally:
+        sink.stop()
+    # times applies to the workers together, not to each
+    assert codes == [grpc.StatusCode.UNAVAILABLE] * 2 + [grpc.StatusCode.OK] * 6
+    assert faults.faults[0].applied == 2
+
+
+def test_multi_process_sink_start_time(metrics_trace_fixture: Telemetry):
+    import functools
+    import time
+
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    start_time = time.time_ns() - 60 * 10**9
+    sink = MultiProcessGrpcSink(
+        functools.partial(AccumulatingHandler, start_time=start_time),
+        workers=2,
+        address="127.0.0.1:0",
+    )
+    sink.start()
+    pbreq = metrics_trace_fixture.trace_requests[0].pbreq
+    try:
+        for _ in range(4):
+            with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+                trace_service_pb2_grpc.TraceServiceStub(channel).Export(pbreq)
+    finally:
+        collected = sink.stop()
+    merged = Telemetry.merge(*collected)
+    # measured from the given start time, not from when each worker started
+    assert len(merged.trace_requests) == 4
+    assert all(60_000 <= r.test_elapsed_ms < 120_000 for r in merged.trace_requests)
+
+
+def test_sink_daemon(metrics_trace_fixture: Telemetry):
+    import http.client
+
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    from oteltest.sink.daemon import SESSION_ATTRIBUTE, SinkDaemon, SinkDaemonClient
+
+    daemon = SinkDaemon("127.0.0.1:0", "127.0.0.1:0", "127.0.0.1:0")
+    daemon.start()
+    client = SinkDaemonClient(f"127.0.0.1:{daemon.control_port}")
+    pbreq = metrics_trace_fixture.trace_requests[0].pbreq
+    try:
+        client.start_session("a/1")
+        client.start_session("b")
+        with pytest.raises(RuntimeError, match="already started"):
+            client.start_session("b")
+        with grpc.insecure_channel(f"127.0.0.1:{daemon.grpc_sink.port}") as channel:
+            export = trace_service_pb2_grpc.TraceServiceStub(channel).Export
+            # routed by header
+            export(pbreq, metadata=[("x-oteltest-session", "a/1")])
+            export(pbreq, metadata=[("x-oteltest-session", "a/1")])
+            # no session named, and no default session
+            export(pbreq)
+        # routed by resource attribute
+        tagged = type(pbreq)()
+        tagged.CopyFrom(pbreq)
+        attr = tagged.resource_spans[0].resource.attributes.add()
+        attr.key = SESSION_ATTRIBUTE
+        attr.value.string_value = "b"
+        conn = http.client.HTTPConnection("127.0.0.1", daemon.http_sink.port)
+        conn.request(
+            "POST",
+            "/v1/traces",
+            tagged.SerializeToString(),
+            {"Content-Type": "application/x-protobuf"},
+        )
+        assert conn.getresponse().status == 200
+        conn.close()
+
+        info = client.info()
+        assert info["sessions"]["a/1"]["trace_requests"] == 2
+        assert info["unrouted"]["trace"] == 1
+        drained = client.drain("a/1")
+        assert [r.pbreq for r in drained.trace_requests] == [pbreq, pbreq]
+        assert drained.trace_requests[0].headers["x-oteltest-session"] == "a/1"
+        assert not client.drain("a/1").trace_requests
+        assert client.stop_session("b").trace_requests[0].pbreq == tagged
+        with pytest.raises(RuntimeError, match="no session 'b'"):
+            client.drain("b")
+    finally:
+        daemon.stop()
+
+
+def test_async_grpc_sink(metrics_trace_fixture: Telemetry):
+    import grpc
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+
+    class Handler(AsyncRequestHandler):
+        def __init__(self):
+            self.requests = []
+
+        async def handle_logs(self, request, context):
+            pass
+
+        async def handle_metrics(self, request, context):
+            pass
+
+        async def handle_trace(self, request, context):
+            self.requests.append(request)
+
+    handler = Handler()
+    sink = AsyncGrpcSink(handler, address="127.0.0.1:0", max_message_length=1000)
+    sink.start()
+    small = metrics_trace_fixture.trace_requests[0].pbreq
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{sink.port}") as channel:
+            stub = trace_service_pb2_grpc.TraceServiceStub(channel)
+            stub.Export(small)
+            big = type(small)()
+            for req in metrics_trace_fixture.trace_requests:
+                big.MergeFrom(req.pbreq)
+            with pytest.raises(grpc.RpcError) as err:
+                stub.Export(big)
+            assert err.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    finally:
+        sink.stop()
+    assert handler.requests == [small]
+
+
 def test_telemetry_functions(metrics_trace_fixture: Telemetry):
     assert len(metrics_trace_fixture.trace_requests)
     assert len(metrics_trace_fixture.trace_requests)
@@ -100,6 +1098,246 @@ def test_telemetry_functions(metrics_trace_fixture: Telemetry):
     assert span.trace_id.hex() == "0adffbc2cb9f3cdb09f6801a788da973"
 
 
+def test_telemetry_index(client_server_fixture: Telemetry):
+    index = client_server_fixture.index
+    span = telemetry.first_span(client_server_fixture)
+    assert index.spans_by_name(span.name)[0] is span
+    assert span in index.spans_by_trace_id(span.trace_id.hex())
+    assert index.span_by_id(span.span_id) is span
+    assert index.attributes(span)["http.method"] == "GET"
+    assert index.attributes(index.resource(span))["telemetry.sdk.language"] == "python"
+    assert index.spans_by_name("no-such-span") == []
+
+    num_spans = len(index.spans)
+    req = client_server_fixture.trace_requests[0]
+    client_server_fixture.add_trace(req.pbreq, req.headers, req.test_elapsed_ms)
+    assert len(client_server_fixture.index.spans) == num_spans + 1
+    assert len(client_server_fixture.index.spans_by_name(span.name)) == 2
+
+
+def test_build_traces():
+    from opentelemetry.proto.trace.v1.trace_pb2 import Span
+
+    def span(name, span_id, parent_id, start, end, trace_id=b"t" * 16):
+        return Span(
+            name=name,
+            trace_id=trace_id,
+            span_id=span_id * 8,
+            parent_span_id=parent_id * 8,
+            start_time_unix_nano=start,
+            end_time_unix_nano=end,
+        )
+
+    spans = [
+        # children arrive before their parents, as they end first
+        span("remote", b"d", b"c", 30, 80),
+        span("db", b"b", b"a", 10, 30),
+        span("http call", b"c", b"a", 20, 90),
+        span("GET /", b"a", b"", 0, 100),
+        span("http call", b"c", b"a", 20, 90),
+        span("lost", b"e", b"x", 40, 50),
+        span("other", b"a", b"", 0, 5, trace_id=b"u" * 16),
+    ]
+    traces = build_traces(spans)
+    assert len(traces) == 2
+    trace = traces[b"t" * 16]
+    assert trace.duplicates == 1
+    (root,) = trace.roots
+    assert [node.name for node in root.walk()] == ["GET /", "db", "http call", "remote"]
+    assert [node.name for node in trace.orphans] == ["lost"]
+    assert trace.missing_parent_ids == {b"x" * 8}
+    assert trace.duration_ns == root.duration_ns == 100
+    assert root.self_time_ns == 20
+    (http,) = trace.spans_by_name("http call")
+    assert http.self_time_ns == 20
+    path = [(node.name, ns) for node, ns in trace.critical_path()]
+    assert path == [("GET /", 20), ("http call", 20), ("remote", 50), ("db", 10)]
+    assert sum(ns for _, ns in path) == root.duration_ns
+
+    # with clock skew, e.g. between processes, a child can seem to have ended before its parent started
+    skewed = build_traces(
+        [
+            span("p", b"p", b"", 0, 100),
+            span("x", b"x", b"p", 50, 100),
+            span("g", b"g", b"x", 40, 45),
+        ]
+    )[b"t" * 16]
+    path = [(node.name, ns) for node, ns in skewed.critical_path()]
+    assert path == [("p", 50), ("x", 50)]
+    assert sum(ns for _, ns in path) == skewed.duration_ns
+
+
+def test_columnar_export(tmp_path, metrics_trace_fixture: Telemetry):
+    tables = telemetry_tables(metrics_trace_fixture, run="metrics_trace.1")
+    spans, points = tables["spans"], tables["metric_points"]
+    assert len(spans["name"]) == telemetry.num_spans(metrics_trace_fixture)
+    assert set(spans["run"]) == {"metrics_trace.1"}
+    assert len(points["metric_name"]) == sum(
+        count_items("metric", r.pbreq) for r in metrics_trace_fixture.metric_requests
+    )
+    assert set(points["metric_name"]) == telemetry.metric_names(metrics_trace_fixture)
+    # every column has a value, or None, for every row
+    for table in tables.values():
+        assert len({len(column) for column in table.values()}) == 1
+
+    paths = write_columnar(metrics_trace_fixture, str(tmp_path), "run", CSV)
+    assert [os.path.basename(p) for p in paths] == [
+        "run.spans.csv",
+        "run.metric_points.csv",
+        "run.logs.csv",
+    ]
+    with open(paths[0]) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith("run,seq,test_elapsed_ms,service_name")
+    assert len(lines) == 1 + len(spans["name"])
+
+
+@pytest.fixture(params=["lists", "numpy"])
+def metric_arrays(request, monkeypatch):
+    # oteltest.metrics uses NumPy arrays if it's installed, so the tests run both with and without it
+    if request.param == "numpy":
+        monkeypatch.setattr(metrics, "_np", pytest.importorskip("numpy"))
+    else:
+        monkeypatch.setattr(metrics, "_np", None)
+    return request.param
+
+
+def test_metric_series(metric_arrays):
+    from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import (
+        ExportMetricsServiceRequest,
+    )
+    from opentelemetry.proto.common.v1.common_pb2 import AnyValue, KeyValue
+    from opentelemetry.proto.metrics.v1.metrics_pb2 import (
+        Histogram,
+        HistogramDataPoint,
+        Metric,
+        NumberDataPoint,
+        ResourceMetrics,
+        ScopeMetrics,
+        Sum,
+    )
+
+    s = 1_000_000_000
+    route = [KeyValue(key="route", value=AnyValue(string_value="/"))]
+
+    def export(start, time, requests, buckets):
+        counter = Sum(
+            aggregation_temporality=CUMULATIVE,
+            is_monotonic=True,
+            data_points=[
+                NumberDataPoint(
+                    start_time_unix_nano=start,
+                    time_unix_nano=time,
+                    as_int=requests,
+                    attributes=route,
+                )
+            ],
+        )
+        histogram = Histogram(
+            aggregation_temporality=CUMULATIVE,
+            data_points=[
+                HistogramDataPoint(
+                    start_time_unix_nano=start,
+                    time_unix_nano=time,
+                    count=sum(buckets),
+                    sum=0,
+                    bucket_counts=buckets,
+                    explicit_bounds=[10, 100],
+                    attributes=route,
+                )
+            ],
+        )
+        return ExportMetricsServiceRequest(
+            resource_metrics=[
+                ResourceMetrics(
+                    scope_metrics=[
+                        ScopeMetrics(
+                            metrics=[
+                                Metric(name="requests", sum=counter),
+                                Metric(name="duration", histogram=histogram),
+                            ]
+                        )
+                    ]
+                )
+            ]
+        )
+
+    tel = Telemetry()
+    # exported every 10s, out of order, and reset (the process restarted) at 30s
+    for start, time, requests, buckets in (
+        (0, 20 * s, 30, [10, 20, 0]),
+        (0, 10 * s, 10, [5, 5, 0]),
+        (25 * s, 30 * s, 5, [0, 0, 5]),
+    ):
+        tel.add_metric(export(start, time, requests, buckets), {}, 0)
+
+    (requests,) = metric_series(tel, "requests", {"route": "/"})
+    assert metric_series(tel, "requests", {"route": "/other"}) == []
+    assert list(requests.times) == [10 * s, 20 * s, 30 * s]
+    delta = requests.to_delta()
+    assert delta.temporality == DELTA
+    assert list(delta.values) == [10, 20, 5]
+    assert list(delta.start_times) == [0, 10 * s, 25 * s]
+    assert list(requests.rates()) == [1, 2, 1]
+    assert list(delta.to_cumulative().values) == [10, 30, 35]
+
+    (duration,) = metric_series(tel, "duration")
+    assert duration.bucket_totals() == [10, 20, 5]
+    # the 50th percentile is the 17.5th of 35 values, 7.5 values into the (10, 100] bucket
+    assert duration.percentile(50) == 10 + 90 * 7.5 / 20
+    assert duration.percentiles(50) == [10, 40, 100]
+    assert histogram_percentile([0, 0, 0], [10, 100], 50) is None
+    assert histogram_percentile([4, 0], [10], 50) == 5
+    assert histogram_percentile([0, 4], [10], 50, max_value=30) == 20
+
+
+def test_diff(metrics_trace_fixture: Telemetry):
+    old = summarize(metrics_trace_fixture)
+    assert not diff_summaries(old, old)
+
+    tel = Telemetry.from_dict(metrics_trace_fixture.to_dict())
+    span = tel.trace_requests[0].pbreq.resource_spans[0].scope_spans[0].spans[0]
+    kv = span.attributes.add()
+    kv.key = "new.key"
+    kv.value.string_value = "x"
+    # one metric gone, the others exported twice as often, and a batch of spans exported again
+    del tel.metric_requests[0].pbreq.resource_metrics[0].scope_metrics[0].metrics[0]
+    tel.metric_requests = list(tel.metric_requests) * 2
+    tel.trace_requests = list(tel.trace_requests) + [tel.trace_requests[0]]
+
+    diff = diff_summaries(old, summarize(tel))
+    assert diff.removed == {"metric": ["loop-counter"]}
+    assert diff.added == {}
+    assert diff.attribute_keys["span"] == {span.name: (["new.key"], [])}
+    assert diff.counts["span"] == {"my-span": (10, 14)}
+    assert diff.counts["metric"]["process.runtime.cpython.cpu_time"] == (2, 4)
+    metric_exports = diff.exports["metric"]
+    assert metric_exports["requests"] == (
+        len(metrics_trace_fixture.metric_requests),
+        2 * len(metrics_trace_fixture.metric_requests),
+    )
+    assert "- Metric exports: requests" in diff.summary()
+    # within the tolerance
+    assert "span" not in diff_summaries(old, summarize(tel), tolerance=10).counts
+
+
+def test_files_to_diff(tmp_path):
+    for name in ("a.0.json", "a.2.ndjson", "a.10.otcap", "b.11.json", "a.py"):
+        (tmp_path / name).touch()
+    path = str(tmp_path)
+    assert files_to_diff(f"{path}/a.py") == (f"{path}/a.2.ndjson", f"{path}/a.10.otcap")
+    assert files_to_diff(f"{path}/a.2.ndjson") == (
+        f"{path}/a.0.json",
+        f"{path}/a.2.ndjson",
+    )
+    assert files_to_diff(f"{path}/a.py", "base.json") == (
+        "base.json",
+        f"{path}/a.10.otcap",
+    )
+    with pytest.raises(ValueError):
+        files_to_diff(f"{path}/a.0.json")
+
+
 def test_span_attribute_by_name(client_server_fixture: Telemetry):
     span = telemetry.first_span(client_server_fixture)
     assert telemetry.span_attribute_by_name(span, "http.method") == "GET"
@@ -121,6 +1359,11 @@ def client_server_fixture() -> Telemetry:
 # utils
 
 
+class FakeContext:
+    def invocation_metadata(self):
+        return [("user-agent", "test")]
+
+
 def telemetry_from_json(json_str: str) -> telemetry.Telemetry:
     return telemetry_from_dict(json.loads(json_str))
 